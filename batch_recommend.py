@@ -0,0 +1,123 @@
+"""Headless batch recommendations over a JSONL file of preference profiles.
+
+Each input line is either a preferences dict as written by
+``TravelCompanion.set_preferences`` or an object of the form
+``{"id": ..., "preferences": {...}, "ratings": {...}}``. One JSON line is
+written per input line, in input order:
+``{"id": ..., "recommendations": [...]}`` or ``{"id": ..., "error": "..."}``.
+
+With ``TRAVEL_CATALOG`` set to a compiled catalog file (see
+``catalog_file.py``), the parent and every worker map the same file
+instead of each holding a copy of the catalog. ``TRAVEL_SCORE_TABLES``
+(see ``score_tables.py``) answers questionnaire-shaped profiles from
+precomputed tables.
+
+Usage:
+    python batch_recommend.py profiles.jsonl results.jsonl --workers 8
+    TRAVEL_CATALOG=catalog.bin python batch_recommend.py profiles.jsonl results.jsonl
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import smart_travel_app as app
+
+
+def _profile_result(line_no, line, top_k):
+    # Errors carry the profile's own id once it is known, so they join like results.
+    profile_id = line_no
+    try:
+        record = json.loads(line)
+        if isinstance(record, dict):
+            profile_id = record.get("id", line_no)
+        if "preferences" in record:
+            prefs = record["preferences"]
+            ratings = record.get("ratings")
+        else:
+            prefs, ratings = record, None
+        recommendations = app.recommend(prefs, ratings, top_k)
+        return {"id": profile_id, "recommendations": recommendations}
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return {"id": profile_id, "error": f"{type(e).__name__}: {e}"}
+
+
+def score_chunk(numbered_lines, top_k):
+    """Score a chunk of ``(line number, raw line)`` pairs and return the serialized output lines."""
+    out = []
+    for line_no, line in numbered_lines:
+        out.append(json.dumps(_profile_result(line_no, line, top_k)) + "\n")
+    return "".join(out)
+
+
+def _read_chunks(f, chunk_size):
+    # Blank lines are skipped, so every line carries its own number.
+    chunk = []
+    for line_no, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        chunk.append((line_no, line))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _pool_context():
+    # With fork the workers inherit the compiled catalog and rating index
+    # copy-on-write instead of each one rebuilding it.
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def run_batch(input_path, output_path, workers=None, top_k=3, chunk_size=1000, max_inflight=None):
+    """Score every profile of ``input_path`` into ``output_path``.
+
+    At most ``max_inflight`` chunks are queued or in flight at once, so
+    memory stays bounded however large the input is. Returns
+    ``(profiles, seconds)``.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_inflight = max_inflight or 2 * workers
+    profiles = 0
+    start = time.perf_counter()
+    # Open the user store (and score tables) before forking so workers inherit them.
+    app.ensure_users()
+    app.score_tables()
+
+    with open(input_path, "r") as src, open(output_path, "w") as dst, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+        inflight = deque()
+        for lines in _read_chunks(src, chunk_size):
+            if len(inflight) >= max_inflight:
+                dst.write(inflight.popleft().result())
+            inflight.append(pool.submit(score_chunk, lines, top_k))
+            profiles += len(lines)
+        while inflight:
+            dst.write(inflight.popleft().result())
+
+    return profiles, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score preference profiles from a JSONL file.")
+    parser.add_argument("input", help="JSONL file with one preference profile per line")
+    parser.add_argument("output", help="JSONL file to write recommendations to")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--top-k", type=int, default=3, help="recommendations per profile")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="profiles sent to a worker at once")
+    args = parser.parse_args(argv)
+
+    profiles, seconds = run_batch(args.input, args.output, args.workers, args.top_k, args.chunk_size)
+    rate = profiles / seconds if seconds else 0.0
+    print(f"Scored {profiles} profiles in {seconds:.2f}s ({rate:,.0f} profiles/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Reproducible benchmarks for the user store and the recommendation path.
+
+For each scale a seeded catalog and user base are generated (see
+``synthetic_data.py``) in a temporary directory. Then ``load_users``,
+``save_users``, ``get_recommendations`` (cold and warm cache) and
+``rate_destination`` are timed. Every benchmark reports wall time over
+``--repeat`` runs, plus peak traced memory and the net number of new
+allocated blocks from one extra run under tracemalloc. Results are written
+as JSON, so runs from different commits can be compared.
+
+Logins are measured against an in-process ``TravelService``: concurrent
+keep-alive clients post ``/login`` requests, and throughput plus median and
+p99 latency are reported.
+
+Startup is measured in fresh interpreters against the same users.json:
+``startup_to_prompt`` is the time from launching the CLI to its first
+input prompt, and ``startup_with_users`` the time until the user store and
+the indexes built from it are ready.
+
+Usage:
+    python benchmarks.py --scale small medium --output bench_results.json
+    python benchmarks.py --destinations 50000 --users 200000 --ratings-per-user 10
+"""
+import argparse
+import asyncio
+import builtins
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import smart_travel_app as app
+import travel_service
+from synthetic_data import generate_catalog, iter_users, write_users
+
+# (destinations, users) per named scale
+SCALES = {
+    "tiny": (1_000, 1_000),
+    "small": (10_000, 10_000),
+    "medium": (100_000, 100_000),
+    "large": (1_000_000, 1_000_000),
+}
+# Module globals of the app that run_scale points at its own catalog and users.
+APP_STATE = ("DESTINATIONS", "CATALOG", "RATING_INDEX", "ITEM_NEIGHBORS", "TAG_INDEX", "FACET_INDEX", "GEO_INDEX",
+             "USERS")
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "smart_travel_app.py")
+
+
+@contextlib.contextmanager
+def scripted_input(answers):
+    """Answer ``input()`` prompts from ``answers`` and silence printing."""
+    answers = iter(answers)
+    original = builtins.input
+    builtins.input = lambda prompt="": next(answers)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        builtins.input = original
+
+
+def _summary(times):
+    return {
+        "runs": len(times),
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.fmean(times),
+    }
+
+
+def measure(func, repeat, setup=None, trace_memory=True):
+    """Time ``func`` ``repeat`` times, then once more under tracemalloc."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    result = _summary(times)
+    if trace_memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        func()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_bytes"] = peak
+        result["alloc_blocks"] = sum(max(0, stat.count_diff) for stat in after.compare_to(before, "lineno"))
+    return result
+
+
+def time_until(args, marker, stdin=b""):
+    """Seconds from launching ``python args...`` until ``marker`` appears on its stdout."""
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, *args], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    seen = b""
+    while marker not in seen:
+        chunk = proc.stdout.read1(4096)
+        if not chunk:
+            raise RuntimeError(f"process exited before printing {marker!r}")
+        seen += chunk
+    elapsed = time.perf_counter() - start
+    proc.communicate(stdin)
+    return elapsed
+
+
+def measure_logins(usernames, requests=2000, concurrency=64):
+    """Log in ``requests`` times over ``concurrency`` connections; synthetic passwords equal usernames."""
+    async def run():
+        service = travel_service.TravelService()
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        names = iter(usernames * (requests // len(usernames) + 1))
+        latencies = []
+
+        async def client(n):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            for _ in range(n):
+                username = next(names)
+                body = json.dumps({"username": username, "password": username}).encode()
+                start = time.perf_counter()
+                writer.write(b"POST /login HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head.startswith(b"HTTP/1.1 200"):
+                    raise RuntimeError(f"login failed: {head.splitlines()[0]!r}")
+                length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+                await reader.readexactly(length)
+                latencies.append(time.perf_counter() - start)
+            writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(requests // concurrency) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        server.close()
+        await server.wait_closed()
+        return latencies, elapsed
+
+    latencies, elapsed = asyncio.run(run())
+    result = _summary(latencies)
+    result.update({"p99_s": float(np.percentile(latencies, 99)), "logins_per_s": len(latencies) / elapsed,
+                   "concurrency": concurrency})
+    return result
+
+
+def measure_startup(repeat):
+    to_prompt = [time_until([APP_PATH], b"Choose an option", stdin=b"3\n") for _ in range(repeat)]
+    with_users = [time_until(["-c", f"import sys; sys.path.insert(0, {os.path.dirname(APP_PATH)!r}); "
+                                    "import smart_travel_app as app; app.ensure_users(); print('ready')"],
+                             b"ready") for _ in range(repeat)]
+    return {"startup_to_prompt": _summary(to_prompt), "startup_with_users": _summary(with_users)}
+
+
+def _restore_app(saved):
+    """Point the app back at the catalog and users it had before a benchmark."""
+    if app.USERS is not saved["USERS"]:
+        app.USERS.close()
+    for name, value in saved.items():
+        setattr(app, name, value)
+    app.RECOMMENDATION_CACHE.clear()
+    users = saved["USERS"]
+    if isinstance(users, app.LazyUsers):
+        # An unopened store rebuilds the leaderboards when it is opened.
+        users = users.load() if users.loaded else {}
+    app.LEADERBOARDS.rebuild(*app.rating_events(users))
+
+
+def run_scale(name, n_destinations, n_users, ratings_per_user, skew, seed, repeat, trace_memory):
+    workdir = tempfile.mkdtemp(prefix=f"travel-bench-{name}-")
+    previous_cwd = os.getcwd()
+    saved = {name: getattr(app, name) for name in APP_STATE}
+    os.chdir(workdir)
+    try:
+        destinations = generate_catalog(n_destinations, seed)
+        write_users("users.json", iter_users(n_users, destinations, ratings_per_user, skew, seed))
+        app.install_catalog(destinations)
+
+        benchmarks = measure_startup(repeat)
+
+        def load():
+            app.USERS = app.load_users()
+
+        def close_loaded():
+            # Every run opens the store afresh; close the one the run before opened.
+            if app.USERS is not saved["USERS"]:
+                app.USERS.close()
+
+        benchmarks["load_users"] = measure(load, repeat, setup=close_loaded, trace_memory=trace_memory)
+        companion = app.TravelCompanion()
+        benchmarks["save_users"] = measure(companion.save_users, repeat, trace_memory=trace_memory)
+
+        rng = np.random.default_rng(seed)
+        usernames = [f"user{i}" for i in rng.integers(0, n_users, 64)]
+        picks = iter(usernames * (4 * repeat + 8))
+
+        def recommend():
+            companion.current_user = next(picks)
+            with scripted_input([]):
+                companion.get_recommendations()
+
+        benchmarks["get_recommendations"] = measure(recommend, repeat, setup=app.RECOMMENDATION_CACHE.clear,
+                                                    trace_memory=trace_memory)
+
+        def recommend_again():
+            with scripted_input([]):
+                companion.get_recommendations()
+
+        companion.current_user = usernames[0]
+        # The second request for the same preferences caches their scored pool.
+        recommend_again()
+        recommend_again()
+        benchmarks["get_recommendations_cached"] = measure(recommend_again, repeat, trace_memory=trace_memory)
+
+        def rate():
+            if not companion.last_recommendations:
+                return
+            dest_id = companion.last_recommendations[0]["id"]
+            with scripted_input([dest_id, str(int(rng.integers(1, 6)))]):
+                companion.rate_destination()
+
+        benchmarks["rate_destination"] = measure(rate, repeat, trace_memory=trace_memory)
+        benchmarks["login"] = measure_logins(usernames)
+
+        total_ratings = sum(len(user["ratings"]) for user in app.USERS.values())
+        matrix = getattr(app.USERS, "ratings", None)  # the journaled store's RatingMatrix
+        return {"scale": name, "destinations": n_destinations, "users": n_users,
+                "ratings": total_ratings, "rating_matrix_bytes": matrix.nbytes if matrix is not None else None,
+                "benchmarks": benchmarks}
+    finally:
+        _restore_app(saved)
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the travel companion at several scales.")
+    parser.add_argument("--scale", nargs="*", choices=sorted(SCALES), default=["tiny", "small"])
+    parser.add_argument("--destinations", type=int, help="custom scale: number of destinations")
+    parser.add_argument("--users", type=int, help="custom scale: number of users")
+    parser.add_argument("--ratings-per-user", type=float, default=5.0)
+    parser.add_argument("--popularity-skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    scales = [(name, *SCALES[name]) for name in args.scale]
+    if args.destinations or args.users:
+        scales = [("custom", args.destinations or 10_000, args.users or 10_000)]
+
+    results = []
+    for name, n_destinations, n_users in scales:
+        print(f"Running {name}: {n_destinations} destinations, {n_users} users...", file=sys.stderr)
+        result = run_scale(name, n_destinations, n_users, args.ratings_per_user, args.popularity_skew,
+                           args.seed, args.repeat, not args.no_memory)
+        for bench, stats in result["benchmarks"].items():
+            print(f"  {bench:28s} median {stats['median_s'] * 1000:10.3f} ms", file=sys.stderr)
+        results.append(result)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "ratings_per_user": args.ratings_per_user,
+            "popularity_skew": args.popularity_skew,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
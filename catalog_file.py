@@ -0,0 +1,320 @@
+"""Compiled catalog files, opened with mmap.
+
+A catalog file holds everything ``CompiledCatalog`` needs in a form that is
+used in place, without parsing:
+
+    magic (8 bytes) | header length (uint64) | JSON header | arrays
+
+The header lists every array (dtype, shape, offset) plus the small
+vocabularies. Arrays start on 64-byte boundaries and cover:
+
+* the string table: ``strings.offsets`` into the UTF-8 blob ``strings.data``;
+  every string in the catalog is stored there once
+* fixed-width columns: ``id``, ``name``, ``type``, ``region``, ``location``
+  (string table indices), ``price``, ``lat`` and ``lon`` (NaN where a
+  destination has no coordinates), ``type_code``, ``has_activities`` and
+  the matching bitmasks
+* variable-length lists as ``<field>.indptr`` plus ``<field>.items``:
+  activities, cuisines, accommodation, ideal_weather and tags (whose
+  weights are in ``tags.weights``)
+* ``id_order``, the rows sorted by id, for lookups by bisection
+* the candidate index: posting lists and the per-type price lists
+
+Opened files are mapped read-only, so every process using the same file
+shares its pages through the OS page cache. ``write_catalog_file`` writes
+to a temporary file and renames it over ``path``; processes that already
+opened the old version keep reading it until they reopen.
+
+Usage:
+    python catalog_file.py catalog.bin                      # the built-in DESTINATIONS
+    python catalog_file.py catalog.bin --source data/destinations.jsonl
+"""
+import argparse
+import json
+import mmap
+import os
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+import catalog_source
+
+MAGIC = b"TRVLCAT1"
+ALIGNMENT = 64
+STRING_FIELDS = ("name", "type", "region", "location")
+LIST_FIELDS = ("ideal_weather", "activities", "accommodation", "cuisines")
+RECORD_FIELDS = ("name", "type", "region", "location", "price", "tags") + LIST_FIELDS
+GEO_FIELDS = ("lat", "lon")
+MASK_FIELDS = ("activity", "cuisine", "accommodation", "weather")
+# CompiledCatalog attribute holding the masks of each vocabulary
+MASK_ATTRIBUTES = {"activity": "activities", "cuisine": "cuisines",
+                   "accommodation": "accommodation", "weather": "weather"}
+
+
+# ---- writing ----
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+
+    def add(self, value):
+        return self.index.setdefault(value, len(self.index))
+
+    def arrays(self):
+        blobs = [value.encode() for value in self.index]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.uint64)
+        np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+        return offsets, np.frombuffer(b"".join(blobs), dtype=np.uint8)
+
+
+def _list_column(strings, lists):
+    indptr = np.zeros(len(lists) + 1, dtype=np.uint64)
+    np.cumsum([len(values) for values in lists], out=indptr[1:])
+    items = np.array([strings.add(value) for values in lists for value in values], dtype=np.uint32)
+    return indptr, items
+
+
+def write_catalog_file(catalog, path):
+    """Write a ``CompiledCatalog`` to ``path`` atomically.
+
+    Rows that ``CompiledCatalog.updated`` left behind for removed ids are not
+    written: such a catalog is recompiled from its live destinations first.
+    """
+    if len(catalog.row_of) < len(catalog.ids):
+        catalog = type(catalog)(catalog.destinations)
+    strings = _StringTable()
+    records = catalog.records
+    arrays = {
+        "id": np.array([strings.add(dest_id) for dest_id in catalog.ids], dtype=np.uint32),
+        "price": np.asarray(catalog.price),
+        "lat": np.asarray(catalog.lat, dtype=np.float64),
+        "lon": np.asarray(catalog.lon, dtype=np.float64),
+        "type_code": np.asarray(catalog.type_code),
+        "has_activities": np.asarray(catalog.has_activities),
+    }
+    for field in STRING_FIELDS:
+        arrays[field] = np.array([strings.add(dest[field]) for dest in records], dtype=np.uint32)
+    for field in LIST_FIELDS:
+        arrays[f"{field}.indptr"], arrays[f"{field}.items"] = _list_column(strings, [dest[field] for dest in records])
+    arrays["tags.indptr"], arrays["tags.items"] = _list_column(strings, [list(dest["tags"]) for dest in records])
+    arrays["tags.weights"] = np.array([weight for dest in records for weight in dest["tags"].values()],
+                                      dtype=np.float64)
+    # Fields beyond the known schema are kept as a JSON object per row ("" when there are none).
+    known = RECORD_FIELDS + GEO_FIELDS
+    extras = ({key: value for key, value in dest.items() if key not in known} for dest in records)
+    arrays["extra"] = np.array([strings.add(json.dumps(extra) if extra else "") for extra in extras],
+                               dtype=np.uint32)
+    arrays["id_order"] = np.array(sorted(range(len(catalog.ids)), key=catalog.ids.__getitem__), dtype=np.int64)
+    for field in MASK_FIELDS:
+        arrays[f"mask.{field}"] = getattr(catalog, MASK_ATTRIBUTES[field])
+
+    postings = {}
+    for field, by_value in catalog.index.postings.items():
+        postings[field] = list(by_value)
+        rows = [by_value[value] for value in postings[field]]
+        arrays[f"postings.{field}.indptr"] = np.cumsum([0] + [len(r) for r in rows], dtype=np.int64)
+        arrays[f"postings.{field}.rows"] = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    price_types = list(catalog.index.by_price)
+    for i, trip_type in enumerate(price_types):
+        prices, rows = catalog.index.by_price[trip_type]
+        arrays[f"by_price.{i}.prices"] = prices
+        arrays[f"by_price.{i}.rows"] = rows
+
+    arrays["strings.offsets"], arrays["strings.data"] = strings.arrays()
+
+    header = {
+        "version": 1,
+        "rows": len(catalog.ids),
+        "type_vocab": list(catalog.type_vocab),
+        "vocab": {field: list(getattr(catalog, f"{field}_vocab")) for field in MASK_FIELDS},
+        "postings": postings,
+        "by_price": price_types,
+        "arrays": {},
+    }
+    # Offsets depend on the header length, which depends on the offsets;
+    # lay out relative to the start of the data section instead.
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# ---- reading ----
+
+class CatalogFile:
+    """A catalog file mapped into memory. Arrays are read-only views of the mapping."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._identity = (stat.st_dev, stat.st_ino)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a compiled catalog file")
+        header_len = int(np.frombuffer(self._mmap, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        header_end = len(MAGIC) + 8 + header_len
+        self.header = json.loads(self._mmap[len(MAGIC) + 8:header_end])
+        data_start = -(-header_end // ALIGNMENT) * ALIGNMENT
+        self.arrays = {
+            name: np.ndarray(spec["shape"], dtype=np.dtype(spec["dtype"]), buffer=self._mmap,
+                             offset=data_start + spec["offset"])
+            for name, spec in self.header["arrays"].items()
+        }
+        self._offsets = self.arrays["strings.offsets"]
+        self._data = self.arrays["strings.data"]
+
+    def __len__(self):
+        return self.header["rows"]
+
+    def changed(self):
+        """True once ``path`` has been replaced by a newer file."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_dev, stat.st_ino) != self._identity
+
+    def string(self, i):
+        return self._data[int(self._offsets[i]):int(self._offsets[i + 1])].tobytes().decode()
+
+    def list_at(self, field, row):
+        indptr = self.arrays[f"{field}.indptr"]
+        items = self.arrays[f"{field}.items"][int(indptr[row]):int(indptr[row + 1])]
+        return [self.string(i) for i in items.tolist()]
+
+    def record(self, row):
+        """Rebuild the destination dict of ``row``."""
+        arrays = self.arrays
+        dest = {field: self.string(arrays[field][row]) for field in STRING_FIELDS}
+        dest["price"] = arrays["price"][row].item()
+        lo, hi = int(arrays["tags.indptr"][row]), int(arrays["tags.indptr"][row + 1])
+        dest["tags"] = dict(zip(self.list_at("tags", row), arrays["tags.weights"][lo:hi].tolist()))
+        for field in LIST_FIELDS:
+            dest[field] = self.list_at(field, row)
+        if "lat" in arrays and not np.isnan(arrays["lat"][row]):
+            dest["lat"], dest["lon"] = arrays["lat"][row].item(), arrays["lon"][row].item()
+        extra = self.string(arrays["extra"][row])
+        if extra:
+            dest.update(json.loads(extra))
+        return dest
+
+    def row_of(self, dest_id):
+        """Row of ``dest_id`` by bisection over ``id_order``, or None."""
+        order, ids = self.arrays["id_order"], self.arrays["id"]
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.string(ids[order[mid]]) < dest_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self.string(ids[order[lo]]) == dest_id:
+            return int(order[lo])
+        return None
+
+
+class MappedIds(Sequence):
+    def __init__(self, catalog_file):
+        self._file = catalog_file
+        self._ids = catalog_file.arrays["id"]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        return self._file.string(self._ids[row])
+
+
+class MappedRecords(Sequence):
+    def __init__(self, catalog_file):
+        self._file = catalog_file
+
+    def __len__(self):
+        return len(self._file)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self._file.record(row)
+
+
+class MappedRows(Mapping):
+    """``dest_id -> row`` without building a dict of every id."""
+
+    def __init__(self, catalog_file):
+        self._file = catalog_file
+
+    def __getitem__(self, dest_id):
+        row = self._file.row_of(dest_id) if isinstance(dest_id, str) else None
+        if row is None:
+            raise KeyError(dest_id)
+        return row
+
+    def __iter__(self):
+        return iter(MappedIds(self._file))
+
+    def __len__(self):
+        return len(self._file)
+
+
+class MappedDestinations(Mapping):
+    """Read-only ``dest_id -> destination dict`` view of a catalog file."""
+
+    def __init__(self, catalog_file):
+        self._rows = MappedRows(catalog_file)
+        self._records = MappedRecords(catalog_file)
+
+    def __getitem__(self, dest_id):
+        return self._records[self._rows[dest_id]]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a destinations catalog into a memory-mappable file.")
+    parser.add_argument("output", help="catalog file to write (replaced atomically)")
+    parser.add_argument("--source", help="JSONL or CSV catalog in the formats catalog_source.py reads "
+                                         "(default: the built-in DESTINATIONS)")
+    args = parser.parse_args(argv)
+
+    import smart_travel_app as app
+
+    destinations = app.DESTINATIONS
+    if args.source:
+        try:
+            destinations = catalog_source.CatalogSource(args.source).load()
+        except (OSError, catalog_source.CatalogError) as e:
+            parser.error(str(e))
+    write_catalog_file(app.CompiledCatalog(destinations), args.output)
+    print(f"Wrote {len(destinations)} destinations to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
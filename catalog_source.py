@@ -0,0 +1,198 @@
+"""External destination catalogs in JSONL or CSV, with change detection.
+
+JSONL files hold one ``{"id": ..., **fields}`` object per line (the format
+``synthetic_data.write_catalog`` writes). CSV files have a header row with
+``id`` and the destination fields; list fields are ``|``-separated and
+tags are written ``name:weight|name:weight``. Coordinates (``lat`` and
+``lon`` in degrees) are optional, but an entry has both or neither.
+
+Both formats are parsed one entry at a time and every entry is checked
+against the destination schema before anything is installed, so a bad
+edit leaves the running catalog untouched.
+
+``CatalogSource.diff`` re-reads a changed file and reports only the entries
+whose content differs from the last successful read.
+"""
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+
+STRING_FIELDS = ("name", "type", "region", "location")
+LIST_FIELDS = ("ideal_weather", "activities", "accommodation", "cuisines")
+# Optional coordinates in degrees, with their valid ranges
+GEO_FIELDS = {"lat": (-90.0, 90.0), "lon": (-180.0, 180.0)}
+
+
+class CatalogError(ValueError):
+    def __init__(self, path, line_no, message):
+        super().__init__(f"{path}:{line_no}: {message}")
+        self.path = path
+        self.line_no = line_no
+
+
+def validate_destination(dest):
+    """Check that ``dest`` has the shape of a ``DESTINATIONS`` entry.
+
+    Raises ValueError describing the first problem found.
+    """
+    if not isinstance(dest, dict):
+        raise ValueError("destination must be an object")
+    for field in STRING_FIELDS:
+        if not isinstance(dest.get(field), str) or not dest[field]:
+            raise ValueError(f"{field} must be a non-empty string")
+    price = dest.get("price")
+    if not isinstance(price, (int, float)) or isinstance(price, bool) or price < 0:
+        raise ValueError("price must be a non-negative number")
+    tags = dest.get("tags")
+    if not isinstance(tags, dict) or not all(
+            isinstance(name, str) and isinstance(weight, (int, float)) and not isinstance(weight, bool)
+            for name, weight in tags.items()):
+        raise ValueError("tags must map names to numbers")
+    for field in LIST_FIELDS:
+        values = dest.get(field)
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{field} must be a list of strings")
+    if any(field in dest for field in GEO_FIELDS):
+        for field, (low, high) in GEO_FIELDS.items():
+            value = dest.get(field)
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not low <= value <= high:
+                raise ValueError(f"{field} must be a number between {low:g} and {high:g}")
+
+
+def _split(value):
+    return [part.strip() for part in value.split("|") if part.strip()] if value else []
+
+
+def _csv_destination(row):
+    dest = {field: row.get(field) or "" for field in STRING_FIELDS}
+    price = (row.get("price") or "").strip()
+    try:
+        dest["price"] = int(price) if price.lstrip("-").isdigit() else float(price)
+    except ValueError:
+        raise ValueError(f"price {price!r} is not a number")
+    dest["tags"] = {}
+    for tag in _split(row.get("tags")):
+        name, _, weight = tag.partition(":")
+        try:
+            dest["tags"][name.strip()] = float(weight)
+        except ValueError:
+            raise ValueError(f"tag {tag!r} must be written name:weight")
+    for field in LIST_FIELDS:
+        dest[field] = _split(row.get(field))
+    for field in GEO_FIELDS:
+        value = (row.get(field) or "").strip()
+        if value:
+            try:
+                dest[field] = float(value)
+            except ValueError:
+                raise ValueError(f"{field} {value!r} is not a number")
+    return dest
+
+
+def iter_destinations(path):
+    """Yield ``(line_no, dest_id, dest)`` for every entry of a JSONL or CSV catalog.
+
+    Raises CatalogError on the first malformed or invalid entry.
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            reader = csv.DictReader(f)
+            entries = ((reader.line_num, row) for row in reader)
+        else:
+            entries = ((line_no, line) for line_no, line in enumerate(f, 1) if line.strip())
+        for line_no, entry in entries:
+            try:
+                if isinstance(entry, dict):
+                    dest_id, dest = entry.get("id"), _csv_destination(entry)
+                else:
+                    dest = json.loads(entry)
+                    dest_id = dest.pop("id", None) if isinstance(dest, dict) else None
+                if not isinstance(dest_id, str) or not dest_id:
+                    raise ValueError("id must be a non-empty string")
+                validate_destination(dest)
+            except ValueError as e:
+                raise CatalogError(path, line_no, str(e)) from None
+            yield line_no, dest_id, dest
+
+
+def _digest(dest):
+    return hashlib.sha1(json.dumps(dest, sort_keys=True).encode()).digest()
+
+
+class CatalogSource:
+    """A catalog file plus the digest of every entry last read from it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+        self._failed_stamp = None
+        self._digests = {}
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def changed(self):
+        """True if the file differs from the last read (and from the last rejected version)."""
+        try:
+            stamp = self._stat()
+        except FileNotFoundError:
+            return False
+        return stamp != self._stamp and stamp != self._failed_stamp
+
+    def load(self):
+        """Read the whole catalog and return it as a destinations dict."""
+        stamp = self._stat()
+        destinations, digests = {}, {}
+        for line_no, dest_id, dest in iter_destinations(self.path):
+            if dest_id in destinations:
+                raise CatalogError(self.path, line_no, f"duplicate id {dest_id!r}")
+            destinations[dest_id] = dest
+            digests[dest_id] = _digest(dest)
+        self._stamp, self._digests = stamp, digests
+        return destinations
+
+    def diff(self):
+        """Re-read the file; return ``(upserts, removed)`` against the last read.
+
+        ``upserts`` maps the ids of new and modified entries to their
+        destination dicts; ``removed`` lists the ids that disappeared. Nothing
+        is recorded unless the whole file is valid.
+        """
+        stamp = self._stat()
+        upserts, digests = {}, {}
+        try:
+            for line_no, dest_id, dest in iter_destinations(self.path):
+                if dest_id in digests:
+                    raise CatalogError(self.path, line_no, f"duplicate id {dest_id!r}")
+                digest = digests[dest_id] = _digest(dest)
+                if self._digests.get(dest_id) != digest:
+                    upserts[dest_id] = dest
+        except CatalogError:
+            self._failed_stamp = stamp
+            raise
+        removed = [dest_id for dest_id in self._digests if dest_id not in digests]
+        self._stamp, self._digests = stamp, digests
+        return upserts, removed
+
+
+def start_watcher(reload, interval=2.0):
+    """Call ``reload()`` every ``interval`` seconds on a daemon thread.
+
+    Errors are reported on stderr and the previous catalog stays in place.
+    Returns an Event; set it to stop the watcher.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                reload()
+            except (OSError, ValueError) as e:
+                print(f"Catalog reload failed: {e}", file=sys.stderr)
+
+    threading.Thread(target=run, name="catalog-watcher", daemon=True).start()
+    return stop
@@ -0,0 +1,275 @@
+import threading
+
+import numpy as np
+
+from user_store import iter_ratings
+
+
+class ItemNeighbors:
+    """Item-item cosine neighbours over a sparse user x destination matrix.
+
+    ``fit`` builds the rating matrix from the users' ``ratings`` dicts and
+    keeps, for every destination, the ``n_neighbors`` destinations with the
+    highest cosine similarity. Dot products are computed in blocks of
+    destinations through sparse products, so no dense matrix is ever built.
+
+    Neighbour lists store raw dot products; cosines are derived on read from
+    the current column norms. ``update`` applies a single new rating against
+    the rater's other destinations only: stored dot products are adjusted by
+    the rating delta, and pairs that were not neighbours yet are computed
+    exactly from the two sparse columns. Changed entries are kept in a small
+    delta buffer that is merged into the matrix every ``merge_every``
+    updates.
+
+    ``fit``, ``update`` and ``merge`` change the neighbour arrays in place,
+    so they and the reads in ``predict`` are serialized by one lock; a
+    prediction never sees half an update.
+
+    The fitted matrix holds every rating and ``user_of`` every rater, so
+    memory grows with the ratings whichever store they are read from.
+
+    SciPy is imported by ``fit`` and ``merge`` only, and the ids passed in
+    are numbered, and the per-item arrays allocated, by the first ``fit``
+    or ``update``, so an unfitted instance costs nothing at startup.
+    """
+
+    def __init__(self, dest_ids, n_neighbors=20, block_size=1024, merge_every=10000):
+        self._initial_ids = dest_ids
+        self.dest_ids = None
+        self.item_of = None
+        self.n_neighbors = n_neighbors
+        self.block_size = block_size
+        self.merge_every = merge_every
+        self._lock = threading.Lock()
+        self.user_of = {}
+        self._columns = None
+        self._delta = {}
+        self._delta_count = 0
+        self.norm2 = None
+        self.neighbor_items = None
+        self.neighbor_dots = None
+
+    def _ensure_items(self):
+        """Number the destinations and allocate the per-item arrays, on first use."""
+        if self.item_of is not None:
+            return
+        dest_ids = list(self._initial_ids)
+        n_items = len(dest_ids)
+        self.norm2 = np.zeros(n_items)
+        self.neighbor_items = np.full((n_items, self.n_neighbors), -1, dtype=np.int64)
+        self.neighbor_dots = np.zeros((n_items, self.n_neighbors))
+        self.dest_ids = dest_ids
+        # Set last: readers take a set item_of to mean everything else is there.
+        self.item_of = {dest_id: i for i, dest_id in enumerate(dest_ids)}
+        self._initial_ids = None
+
+    # ---- building ----
+
+    def fit(self, users):
+        from scipy import sparse
+
+        with self._lock:
+            self._ensure_items()
+            n_items = len(self.dest_ids)
+            self.user_of = {}
+            rows, cols, vals = [], [], []
+            for username, dest_id, rating in iter_ratings(users):
+                i = self.item_of.get(dest_id)
+                if i is not None:
+                    rows.append(self.user_of.setdefault(username, len(self.user_of)))
+                    cols.append(i)
+                    vals.append(rating)
+            matrix = sparse.csr_matrix(
+                (np.array(vals, dtype=np.float64), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+                shape=(len(self.user_of), n_items))
+            self._columns = matrix.tocsc()
+            self._delta = {}  # item -> {user: rating change not yet merged}
+            self._delta_count = 0
+            self.norm2 = np.asarray(self._columns.multiply(self._columns).sum(axis=0)).ravel()
+
+            self.neighbor_items = np.full((n_items, self.n_neighbors), -1, dtype=np.int64)
+            self.neighbor_dots = np.zeros((n_items, self.n_neighbors))
+            by_item = self._columns.T.tocsr()
+            for start in range(0, n_items, self.block_size):
+                dots = (by_item[start:start + self.block_size] @ matrix).tocsr()
+                for offset in range(dots.shape[0]):
+                    i = start + offset
+                    lo, hi = dots.indptr[offset], dots.indptr[offset + 1]
+                    items, item_dots = dots.indices[lo:hi], dots.data[lo:hi]
+                    keep = (items != i) & (item_dots > 0)
+                    self._set_neighbors(i, items[keep], item_dots[keep])
+        return self
+
+    def _cosines(self, i, items, dots):
+        return dots / np.sqrt(self.norm2[i] * self.norm2[items])
+
+    def _set_neighbors(self, i, items, dots):
+        if len(items) > self.n_neighbors:
+            best = np.argpartition(self._cosines(i, items, dots), len(items) - self.n_neighbors)
+            best = best[len(items) - self.n_neighbors:]
+            items, dots = items[best], dots[best]
+        self.neighbor_items[i] = -1
+        self.neighbor_dots[i] = 0.0
+        self.neighbor_items[i, :len(items)] = items
+        self.neighbor_dots[i, :len(items)] = dots
+
+    def extend(self, dest_ids):
+        """Append destinations that have no ratings yet."""
+        with self._lock:
+            self._extend(dest_ids)
+
+    def _extend(self, dest_ids):
+        self._ensure_items()
+        new = [dest_id for dest_id in dest_ids if dest_id not in self.item_of]
+        if not new:
+            return
+        n_old, n = len(self.dest_ids), len(self.dest_ids) + len(new)
+        norm2 = np.zeros(n)
+        norm2[:n_old] = self.norm2
+        neighbor_items = np.full((n, self.n_neighbors), -1, dtype=np.int64)
+        neighbor_items[:n_old] = self.neighbor_items
+        neighbor_dots = np.zeros((n, self.n_neighbors))
+        neighbor_dots[:n_old] = self.neighbor_dots
+        if self._columns is not None:
+            from scipy import sparse
+
+            columns = self._columns
+            indptr = np.concatenate([columns.indptr, np.full(len(new), columns.indptr[-1])])
+            self._columns = sparse.csc_matrix((columns.data, columns.indices, indptr), shape=(columns.shape[0], n))
+        # Existing items keep their numbers, so readers mixing old and new arrays stay consistent.
+        self.norm2, self.neighbor_items, self.neighbor_dots = norm2, neighbor_items, neighbor_dots
+        for dest_id in new:
+            self.item_of[dest_id] = len(self.dest_ids)
+            self.dest_ids.append(dest_id)
+
+    # ---- incremental updates ----
+
+    def _column(self, i):
+        """Users and ratings of item ``i``, including unmerged changes."""
+        column = {}
+        if self._columns is not None:
+            lo, hi = self._columns.indptr[i], self._columns.indptr[i + 1]
+            column = dict(zip(self._columns.indices[lo:hi].tolist(), self._columns.data[lo:hi].tolist()))
+        for u, change in self._delta.get(i, {}).items():
+            column[u] = column.get(u, 0.0) + change
+        return column
+
+    def _dot(self, i, j):
+        a, b = self._column(i), self._column(j)
+        if len(a) > len(b):
+            a, b = b, a
+        return sum(rating * b[u] for u, rating in a.items() if u in b)
+
+    def _offer(self, i, j, change):
+        """Adjust the stored dot of pair (i, j), or insert j if it now qualifies."""
+        slots = np.flatnonzero(self.neighbor_items[i] == j)
+        if slots.size:
+            self.neighbor_dots[i, slots[0]] += change
+            return
+        dot = self._dot(i, j)
+        if dot <= 0:
+            return
+        free = np.flatnonzero(self.neighbor_items[i] < 0)
+        if free.size:
+            self.neighbor_items[i, free[0]] = j
+            self.neighbor_dots[i, free[0]] = dot
+            return
+        cosines = self._cosines(i, self.neighbor_items[i], self.neighbor_dots[i])
+        weakest = int(np.argmin(cosines))
+        if self._cosines(i, np.array([j]), np.array([dot]))[0] > cosines[weakest]:
+            self.neighbor_items[i, weakest] = j
+            self.neighbor_dots[i, weakest] = dot
+
+    def update(self, username, dest_id, rating, previous, user_ratings):
+        """Apply one stored rating. ``user_ratings`` is the user's ratings dict."""
+        with self._lock:
+            self._update(username, dest_id, rating, previous, user_ratings)
+
+    def _update(self, username, dest_id, rating, previous, user_ratings):
+        self._ensure_items()
+        i = self.item_of.get(dest_id)
+        if i is None:
+            return
+        u = self.user_of.setdefault(username, len(self.user_of))
+        change = rating - (previous or 0)
+        if not change:
+            return
+        item_delta = self._delta.setdefault(i, {})
+        item_delta[u] = item_delta.get(u, 0.0) + change
+        self._delta_count += 1
+        self.norm2[i] += rating * rating - (previous or 0) ** 2
+
+        for other_id, other_rating in user_ratings.items():
+            j = self.item_of.get(other_id)
+            if j is None or j == i:
+                continue
+            pair_change = change * other_rating
+            self._offer(i, j, pair_change)
+            self._offer(j, i, pair_change)
+
+        if self._delta_count >= self.merge_every:
+            self._merge()
+
+    def merge(self):
+        """Fold buffered changes into the sparse matrix."""
+        with self._lock:
+            self._merge()
+
+    def _merge(self):
+        from scipy import sparse
+
+        self._ensure_items()
+        base = self._columns
+        if base is None:
+            base = sparse.csc_matrix((0, len(self.dest_ids)))
+        shape = (max(len(self.user_of), base.shape[0]), len(self.dest_ids))
+        rows, cols, vals = [], [], []
+        for i, changes in self._delta.items():
+            for u, change in changes.items():
+                rows.append(u)
+                cols.append(i)
+                vals.append(change)
+        if base.shape != shape:
+            base = sparse.csc_matrix((base.data, base.indices, base.indptr), shape=(shape[0], shape[1]))
+        delta = sparse.csc_matrix((vals, (rows, cols)), shape=shape)
+        self._columns = (base + delta).tocsc()
+        self._columns.eliminate_zeros()
+        self._delta = {}
+        self._delta_count = 0
+
+    # ---- prediction ----
+
+    def predict(self, user_ratings):
+        """Predicted star ratings (dest_id -> float) for the neighbours of the user's rated items.
+
+        Each prediction is the similarity-weighted average of the user's own
+        ratings of the neighbouring destinations. Destinations the user
+        rated themselves are not included.
+        """
+        item_of = self.item_of
+        if item_of is None:
+            return {}
+        rated = [(item_of[dest_id], rating) for dest_id, rating in (user_ratings or {}).items()
+                 if dest_id in item_of]
+        if not rated:
+            return {}
+        items, weights, weighted = [], [], []
+        with self._lock:
+            # Copies of the user's few neighbour rows; the rest needs no lock.
+            for j, rating in rated:
+                neighbors = self.neighbor_items[j]
+                valid = neighbors >= 0
+                neighbors = neighbors[valid]
+                sims = self._cosines(j, neighbors, self.neighbor_dots[j][valid])
+                items.append(neighbors)
+                weights.append(sims)
+                weighted.append(sims * rating)
+        items = np.concatenate(items)
+        if not len(items):
+            return {}
+        unique, inverse = np.unique(items, return_inverse=True)
+        num = np.bincount(inverse, weights=np.concatenate(weighted))
+        den = np.bincount(inverse, weights=np.concatenate(weights))
+        own = {j for j, _ in rated}
+        return {self.dest_ids[i]: float(n / d) for i, n, d in zip(unique.tolist(), num, den)
+                if d > 0 and i not in own}
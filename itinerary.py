@@ -0,0 +1,233 @@
+"""Budget-constrained multi-stop itineraries.
+
+Given scored candidates (integer match scores, prices and optional
+regions), ``plan`` picks at most ``max_stops`` of them with the highest
+total score whose prices sum to no more than ``budget``. With
+``distinct_regions`` no two stops share a region. Among equally scored
+plans the one with fewer stops, then the cheaper one, wins.
+
+The solver is a knapsack dynamic program over (stops, budget). Budget is
+counted in cells of ``unit`` dollars, with prices rounded up, so every
+plan it returns fits the budget. It is exact when the budget fits in
+``max_cells`` one-dollar cells and every price is a whole dollar amount.
+Otherwise the cells are widened until the table fits. The plan is then
+the best one under the rounded prices and may miss a better plan that
+only fits at full resolution. The result records which of the two it is.
+
+Before the program runs, candidates that can never be needed are pruned
+exactly. A candidate beaten (no cheaper and no lower score) by
+``max_stops`` others can be swapped for one of them in any plan. With
+``distinct_regions``, one such candidate in the same region is enough.
+Match scores are integers from 0 to 100, so at most ``max_stops``
+candidates survive per score value (per region and score value with
+``distinct_regions``), however many candidates there are. The dynamic
+program's size is therefore bounded by the stop count and the budget
+resolution, not by the catalog size.
+
+Usage (latency at several candidate counts, checked against brute force):
+    python itinerary.py --candidates 30 1000 100000 1000000 --stops 3
+"""
+import argparse
+import itertools
+import math
+import statistics
+import sys
+import time
+
+import numpy as np
+
+MAX_SCORE = 100
+
+
+def _histogram_filter(scores, prices, groups, limit, n_groups, top_price):
+    """Indices that can survive ``prune``, found without sorting.
+
+    Prices are binned over ``[0, top_price]`` and candidates counted per
+    (group, score, bin). A candidate is certainly pruned once ``limit``
+    candidates of its group with at least its score sit in cheaper bins.
+    """
+    n_bins = int(max(2, min(1024, (1 << 20) // (n_groups * (MAX_SCORE + 1)))))
+    bins = np.minimum((prices * (n_bins / max(top_price, 1e-9))).astype(np.int64), n_bins - 1)
+    cells = (groups * (MAX_SCORE + 1) + scores) * n_bins + bins
+    counts = np.bincount(cells, minlength=n_groups * (MAX_SCORE + 1) * n_bins)
+    counts = counts.reshape(n_groups, MAX_SCORE + 1, n_bins)
+    # Candidates with at least each score, in strictly cheaper bins.
+    at_least = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+    cheaper = np.cumsum(at_least, axis=2) - at_least
+    return np.flatnonzero(cheaper.ravel()[cells] < limit)
+
+
+def prune(scores, prices, max_stops, groups=None):
+    """Indices of the candidates that some optimal plan may need, in rank order.
+
+    Candidates are ordered by price, then score (descending), then index.
+    A candidate is dropped when ``max_stops`` earlier candidates with at
+    least its score exist, or, with ``groups``, one such candidate in its
+    group.
+    """
+    scores = np.asarray(scores, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    if len(scores) > 4096:
+        # Filter in linear time first, then sort only the survivors.
+        if groups is None:
+            survivors = _histogram_filter(scores, prices, np.zeros(len(scores), dtype=np.int64), max_stops, 1,
+                                          prices.max())
+        else:
+            groups = np.asarray(groups, dtype=np.int64)
+            survivors = _histogram_filter(scores, prices, groups, 1, int(groups.max()) + 1, prices.max())
+            groups = groups[survivors]
+        return survivors[prune(scores[survivors], prices[survivors], max_stops, groups)]
+    if groups is None:
+        groups, limit = np.zeros(len(scores), dtype=np.int64), max_stops
+    else:
+        groups, limit = np.asarray(groups, dtype=np.int64), 1
+    order = np.lexsort((np.arange(len(scores)), -scores, prices))
+    keep = []
+    # Per group, the positions (in ``order``) of the first ``limit``
+    # candidates scoring at least the current level, from the best level down.
+    firsts = {}
+    by_level = np.lexsort((np.arange(len(order)), groups[order], -scores[order]))
+    levels = scores[order][by_level]
+    level_groups = groups[order][by_level]
+    bounds = np.flatnonzero(np.diff(levels) | np.diff(level_groups)) + 1
+    for chunk in np.split(by_level, bounds):
+        if not len(chunk):
+            continue
+        group = int(groups[order[chunk[0]]])
+        positions = np.sort(np.concatenate([firsts.get(group, np.zeros(0, dtype=np.int64)), chunk]))[:limit]
+        firsts[group] = positions
+        keep.append(np.intersect1d(positions, chunk, assume_unique=True))
+    if not keep:
+        return np.zeros(0, dtype=np.int64)
+    kept = order[np.concatenate(keep)]
+    return kept[np.lexsort((kept, prices[kept], -scores[kept]))]
+
+
+def plan(scores, prices, budget, max_stops=3, groups=None, max_cells=4_000_000):
+    """Best plan as ``(indices, exact)``; ``indices`` are in rank order.
+
+    ``groups`` (a small non-negative integer per candidate, such as a
+    region code) forbids two stops in one group.
+    ``max_cells`` bounds the size of the dynamic-programming table, and
+    with it the latency.
+    """
+    scores = np.asarray(scores, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    if max_stops < 1 or budget < 0 or not len(scores):
+        return [], True
+    affordable = np.flatnonzero(prices <= budget)
+    kept = affordable[prune(scores[affordable], prices[affordable], max_stops,
+                            None if groups is None else np.asarray(groups)[affordable])]
+    if not len(kept):
+        return [], True
+    kept_groups = np.arange(len(kept)) if groups is None else np.asarray(groups)[kept]
+
+    # One-dollar cells if the table fits, wider ones otherwise.
+    states = (max_stops + 1) * len(kept)
+    unit = max(1, math.ceil((math.floor(budget) + 1) * states / max_cells))
+    cells = int(budget // unit) + 1
+    costs = np.ceil(prices[kept] / unit).astype(np.int64)
+    exact = unit == 1 and bool(np.all(prices[kept] == np.floor(prices[kept])))
+    item_scores = scores[kept]
+
+    # best[j, b]: highest total score of exactly j stops costing at most b
+    # cells (-1 if none). choice[g, j, b]: the item group g contributed there.
+    best = np.full((max_stops + 1, cells), -1, dtype=np.int64)
+    best[0] = 0
+    group_ids, group_start = np.unique(kept_groups, return_index=True)
+    members = [np.flatnonzero(kept_groups == g) for g in group_ids[np.argsort(group_start)]]
+    choice = np.full((len(members), max_stops + 1, cells), -1,
+                     dtype=np.int16 if len(kept) < 2 ** 15 else np.int32)
+    for g, items in enumerate(members):
+        # A group's items extend the table as it was before the group, so
+        # at most one of them is taken.
+        before = best.copy() if len(items) > 1 else best
+        for i in items.tolist():
+            cost, score = costs[i], item_scores[i]
+            if cost >= cells:
+                continue
+            for j in range(max_stops, 0, -1):
+                prev = before[j - 1, :cells - cost]
+                extended = np.where(prev >= 0, prev + score, -1)
+                better = extended > best[j, cost:]
+                best[j, cost:][better] = extended[better]
+                choice[g, j, cost:][better] = i
+
+    top = best[:, -1].max()
+    stops = int(np.argmax(best[:, -1] == top))
+    b = int(np.argmax(best[stops] == top))
+    picked = []
+    for g in range(len(members) - 1, -1, -1):
+        if not stops:
+            break
+        i = int(choice[g, stops, b])
+        if i >= 0:
+            picked.append(i)
+            stops -= 1
+            b -= costs[i]
+    picked = kept[sorted(picked)]
+    return picked.tolist(), exact
+
+
+# ---- benchmark ----
+
+def brute_force(scores, prices, budget, max_stops, groups=None):
+    """Best ``(total score, -stops, -total price)`` over every combination (small inputs only)."""
+    best = (0, 0, 0.0)
+    for n in range(1, max_stops + 1):
+        for combo in itertools.combinations(range(len(scores)), n):
+            if groups is not None and len({groups[i] for i in combo}) < n:
+                continue
+            cost = sum(prices[i] for i in combo)
+            if cost <= budget:
+                best = max(best, (sum(scores[i] for i in combo), -n, -cost))
+    return best
+
+
+def _random_candidates(rng, n, n_groups=6):
+    scores = rng.integers(30, MAX_SCORE + 1, size=n)
+    prices = rng.integers(30, 1500, size=n).astype(np.float64)
+    groups = rng.integers(n_groups, size=n)
+    return scores, prices, groups
+
+
+def run_benchmark(sizes, max_stops=3, budget=2000, repeat=20, seed=0):
+    rng = np.random.default_rng(seed)
+    # Exactness against brute force on small inputs, with and without regions.
+    for _ in range(50):
+        scores, prices, groups = _random_candidates(rng, 16)
+        for g in (None, groups):
+            indices, exact = plan(scores, prices, budget, max_stops, g)
+            got = (int(scores[indices].sum()), -len(indices), -float(prices[indices].sum()))
+            if exact and got != brute_force(scores.tolist(), prices.tolist(), budget, max_stops, g):
+                raise AssertionError("dynamic program disagrees with brute force")
+    results = []
+    for n in sizes:
+        scores, prices, groups = _random_candidates(rng, n)
+        for label, g in (("any", None), ("distinct", groups)):
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                indices, exact = plan(scores, prices, budget, max_stops, g)
+                times.append(time.perf_counter() - start)
+            results.append({"candidates": n, "regions": label, "stops": len(indices), "exact": exact,
+                            "median_ms": statistics.median(times) * 1000, "max_ms": max(times) * 1000})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the itinerary planner.")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[30, 1000, 100_000])
+    parser.add_argument("--stops", type=int, default=3)
+    parser.add_argument("--budget", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    for row in run_benchmark(args.candidates, args.stops, args.budget, args.repeat, args.seed):
+        print(f"  {row['candidates']:>8} candidates, {row['regions']:8s} regions: {row['stops']} stops, "
+              f"median {row['median_ms']:.2f} ms, max {row['max_ms']:.2f} ms"
+              f"{'' if row['exact'] else ' (rounded prices)'}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Top-rated and trending leaderboards, kept up to date one rating at a time.
+
+``Leaderboards`` keeps two rankings per board, where a board is a key such
+as (trip type, region, budget bucket) given by the caller:
+
+* top rated: a damped average, ``(total + PRIOR_MEAN * PRIOR_WEIGHT) /
+  (count + PRIOR_WEIGHT)``, so one five-star rating does not outrank
+  hundreds of good ones;
+* trending: popularity that halves every ``half_life_days``; each rating
+  adds ``stars / 5`` at the time it was made.
+
+Each ranking is a skip list, so a rating re-files its destination in
+O(log n) expected time and the best N are the first N nodes. A query may
+leave parts of the key open (None); the matching boards' lists are
+merged lazily, so reading N entries costs O(N) plus a heap over the
+boards, never a scan of a ranking or of the ratings.
+
+Decay scales every popularity by the same factor, so it never changes
+the order. Popularity is therefore stored as ``log(sum(w * exp(λ t)))``
+with ``λ = ln 2 / half-life`` and ``t`` in Unix seconds: a rating adds one
+term to one destination with logaddexp, nothing changes as time passes,
+and the current value is ``exp(stored - λ now)``. Kept in log space the
+terms never overflow.
+
+Writers must be serialized by the caller; readers need no lock.
+"""
+import heapq
+import math
+import random
+import time
+
+import numpy as np
+
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 2.0
+KINDS = ("top_rated", "trending")
+
+
+class _Node:
+    __slots__ = ("key", "next")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+
+
+class SkipList:
+    """Keys in ascending order, with O(log n) expected insert and remove.
+
+    A node is linked in bottom level first and unlinked top level first,
+    so a reader walking the bottom level always sees a consistent list.
+    """
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self, rng=None):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._level = 1
+        self._len = 0
+        self._rng = rng or random.Random()
+
+    @classmethod
+    def from_sorted(cls, keys, rng=None):
+        """A skip list of ``keys``, which must already be in ascending order, built in O(n)."""
+        skiplist = cls(rng)
+        tails = [skiplist._head] * cls.MAX_LEVEL
+        for key in keys:
+            node = _Node(key, skiplist._random_level())
+            for i in range(len(node.next)):
+                tails[i].next[i] = node
+                tails[i] = node
+            skiplist._level = max(skiplist._level, len(node.next))
+            skiplist._len += 1
+        return skiplist
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and self._rng.random() < self.P:
+            level += 1
+        return level
+
+    def _predecessors(self, key):
+        path = [self._head] * self.MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            following = node.next[i]
+            while following is not None and following.key < key:
+                node, following = following, following.next[i]
+            path[i] = node
+        return path
+
+    def insert(self, key):
+        path = self._predecessors(key)
+        node = _Node(key, self._random_level())
+        for i in range(len(node.next)):
+            node.next[i] = path[i].next[i]
+            path[i].next[i] = node
+        self._level = max(self._level, len(node.next))
+        self._len += 1
+
+    def remove(self, key):
+        path = self._predecessors(key)
+        node = path[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(len(node.next) - 1, -1, -1):
+            path[i].next[i] = node.next[i]
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._len -= 1
+
+
+def _logaddexp(a, b):
+    if a < b:
+        a, b = b, a
+    return a if b == -math.inf else a + math.log1p(math.exp(b - a))
+
+
+class Leaderboards:
+    """Top-rated and trending rankings of destinations per board.
+
+    ``boards_of(dest_id)`` gives the boards a destination is listed on (an
+    empty sequence for ids missing from the catalog, whose ratings are
+    still counted in case they come back). Board keys are tuples of equal
+    length.
+    """
+
+    def __init__(self, boards_of, half_life_days=7.0, seed=0):
+        self.boards_of = boards_of
+        self.half_life_days = half_life_days
+        self.decay = math.log(2) / (half_life_days * 86400)
+        self._rng = random.Random(seed)
+        self._lists = {kind: {} for kind in KINDS}  # kind -> board -> SkipList
+        self._stats = {}  # dest_id -> [total stars, count, log popularity]
+        self._filed = {}  # dest_id -> (boards, top-rated key, trending key or None)
+
+    def __len__(self):
+        return len(self._filed)
+
+    @staticmethod
+    def _damped(total, count):
+        return (total + PRIOR_MEAN * PRIOR_WEIGHT) / (count + PRIOR_WEIGHT)
+
+    def _keys(self, dest_id):
+        total, count, log_popularity = self._stats[dest_id]
+        rated = (-self._damped(total, count), -count, dest_id) if count else None
+        trending = (-log_popularity, dest_id) if log_popularity > -math.inf else None
+        return rated, trending
+
+    def _file(self, dest_id):
+        previous = self._filed.pop(dest_id, None)
+        if previous is not None:
+            boards, rated, trending = previous
+            for board in boards:
+                if rated is not None:
+                    self._lists["top_rated"][board].remove(rated)
+                if trending is not None:
+                    self._lists["trending"][board].remove(trending)
+        boards = tuple(self.boards_of(dest_id))
+        rated, trending = self._keys(dest_id)
+        if not boards or (rated is None and trending is None):
+            return
+        for board in boards:
+            if rated is not None:
+                self._list("top_rated", board).insert(rated)
+            if trending is not None:
+                self._list("trending", board).insert(trending)
+        self._filed[dest_id] = (boards, rated, trending)
+
+    def _list(self, kind, board):
+        lists = self._lists[kind]
+        if board not in lists:
+            lists[board] = SkipList(self._rng)
+        return lists[board]
+
+    def record(self, dest_id, stars, previous=None, ts=None):
+        """Count a rating made at Unix time ``ts`` (None if unknown), replacing ``previous`` stars.
+
+        The average counts each user once, but a replaced rating keeps its
+        share of the popularity, as a second rating event. ``rebuild`` sees
+        only the ratings stored now, so it starts from each user's latest.
+        """
+        stats = self._stats.setdefault(dest_id, [0, 0, -math.inf])
+        stats[0] += stars - (previous or 0)
+        stats[1] += previous is None
+        if ts:
+            stats[2] = _logaddexp(stats[2], math.log(stars / 5) + self.decay * ts)
+        self._file(dest_id)
+
+    def refile(self, dest_ids=None):
+        """Re-read the boards of ``dest_ids`` (default: every rated destination) after a catalog change."""
+        for dest_id in list(self._stats) if dest_ids is None else dest_ids:
+            if dest_id in self._stats:
+                self._file(dest_id)
+
+    def rebuild(self, dest_ids, items, stars, times):
+        """Replace all state with the given ratings (see ``user_store.rating_events``)."""
+        items, stars = np.asarray(items, dtype=np.int64), np.asarray(stars, dtype=np.int64)
+        times = np.asarray(times, dtype=np.float64)
+        n = len(dest_ids)
+        totals = np.bincount(items, weights=stars, minlength=n).astype(np.int64)
+        counts = np.bincount(items, minlength=n)
+        # Per-destination logsumexp of log(stars / 5) + decay * t over timed ratings.
+        timed = times > 0
+        terms = np.log(stars[timed] / 5) + self.decay * times[timed]
+        peak = np.full(n, -np.inf)
+        np.maximum.at(peak, items[timed], terms)
+        sums = np.bincount(items[timed], weights=np.exp(terms - peak[items[timed]]), minlength=n)
+        with np.errstate(divide="ignore"):
+            log_popularity = peak + np.log(sums)
+        self._stats = {dest_ids[d]: [int(totals[d]), int(counts[d]), float(log_popularity[d])]
+                       for d in np.flatnonzero(counts).tolist()}
+        self._filed = {}
+        keys = {kind: {} for kind in KINDS}
+        for dest_id in self._stats:
+            boards = tuple(self.boards_of(dest_id))
+            rated, trending = self._keys(dest_id)
+            if not boards:
+                continue
+            for board in boards:
+                keys["top_rated"].setdefault(board, []).append(rated)
+                if trending is not None:
+                    keys["trending"].setdefault(board, []).append(trending)
+            self._filed[dest_id] = (boards, rated, trending)
+        self._lists = {kind: {board: SkipList.from_sorted(sorted(board_keys), self._rng)
+                              for board, board_keys in keys[kind].items()}
+                       for kind in KINDS}
+
+    def _top(self, kind, pattern, n):
+        lists = [skiplist for board, skiplist in list(self._lists[kind].items())
+                 if all(want is None or want == value for want, value in zip(pattern, board))]
+        seen, top = set(), []
+        # A destination on several matching boards (say, two budget buckets) is listed once.
+        for key in heapq.merge(*lists):
+            if key[-1] in seen:
+                continue
+            seen.add(key[-1])
+            top.append(key)
+            if len(top) == n:
+                break
+        return top
+
+    def top_rated(self, pattern, n=10):
+        """``[(dest_id, average stars, count)]`` for the best ``n`` on boards matching ``pattern``."""
+        results = []
+        for _, _, dest_id in self._top("top_rated", pattern, n):
+            total, count, _ = self._stats[dest_id]
+            results.append((dest_id, total / count, count))
+        return results
+
+    def trending(self, pattern, n=10, now=None):
+        """``[(dest_id, popularity at now)]`` for the ``n`` most popular on boards matching ``pattern``."""
+        offset = self.decay * (time.time() if now is None else now)
+        return [(dest_id, math.exp(-minus_log - offset)) for minus_log, dest_id in self._top("trending", pattern, n)]
@@ -0,0 +1,187 @@
+"""Low-overhead counters and stage timers, plus a sampling profiler.
+
+``METRICS`` is the process-wide registry. When it is disabled (call
+``METRICS.disable()`` or set ``TRAVEL_METRICS=0``), ``stage`` hands back a
+shared no-op context manager and ``count`` returns at once, so instrumented
+code pays one attribute check per call site.
+
+Snapshots can be exported as Prometheus text (``prometheus()``) or as a
+dict ready for JSON (``snapshot()``).
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    def __init__(self, prefix="travel", enabled=True):
+        self.prefix = prefix
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.counters = collections.Counter()
+            self.timers = {}  # stage -> [count, total seconds, max seconds]
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def stage(self, name):
+        """Context manager timing one execution of the stage ``name``."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "stages": {name: {"count": count, "total_s": total, "max_s": longest}
+                           for name, (count, total, longest) in self.timers.items()},
+            }
+
+    def prometheus(self):
+        """Current values in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            metric = f"{self.prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        if snap["stages"]:
+            metric = f"{self.prefix}_stage_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for name, stage in sorted(snap["stages"].items()):
+                lines.append(f'{metric}_count{{stage="{name}"}} {stage["count"]}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {stage["total_s"]:.9f}')
+            lines.append(f"# TYPE {metric}_max gauge")
+            for name, stage in sorted(snap["stages"].items()):
+                lines.append(f'{metric}_max{{stage="{name}"}} {stage["max_s"]:.9f}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics(enabled=os.environ.get("TRAVEL_METRICS", "1") != "0")
+
+
+class SamplingProfiler:
+    """Samples the stack of the thread that enters it, every ``interval`` seconds.
+
+    Use it around a single request::
+
+        with SamplingProfiler() as profiler:
+            app.recommend(prefs)
+        print(profiler.collapsed())
+
+    ``collapsed()`` returns stacks in the folded ``frame;frame count`` format
+    understood by flame graph tools; ``top()`` gives the hottest functions.
+
+    While any profiler runs, the interpreter's switch interval is lowered
+    to the shortest sampling interval; the last one to exit restores it.
+    """
+
+    _lock = threading.Lock()
+    _running = []  # intervals of the profilers running now, in any thread
+    _saved_switch_interval = None
+
+    def __init__(self, interval=0.0005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        # Let the sampler thread get the GIL often enough to keep up.
+        with SamplingProfiler._lock:
+            if not SamplingProfiler._running:
+                SamplingProfiler._saved_switch_interval = sys.getswitchinterval()
+            SamplingProfiler._running.append(self.interval)
+            sys.setswitchinterval(min([SamplingProfiler._saved_switch_interval] + SamplingProfiler._running))
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        with SamplingProfiler._lock:
+            SamplingProfiler._running.remove(self.interval)
+            sys.setswitchinterval(min([SamplingProfiler._saved_switch_interval] + SamplingProfiler._running))
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def top(self, n=10):
+        """``(function, self samples, total samples)`` for the ``n`` hottest leaf functions."""
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(frame, count, total[frame]) for frame, count in own.most_common(n)]
@@ -0,0 +1,333 @@
+"""Array-backed storage for every user's destination ratings.
+
+Ratings are kept in CSR form: ``indptr`` gives each user's slice of
+``items`` (interned destination indices, sorted within the slice),
+``stars`` (uint8) and ``times`` (uint32 Unix seconds of the rating, 0
+where unknown). That is nine bytes per rating plus eight per user,
+instead of a dict entry and a key string per rating.
+
+Fresh writes go to a small per-user buffer, which is merged into the
+arrays every ``merge_every`` writes. Lookups consult the buffer first.
+
+Writers must be serialized by the caller; readers need no lock.
+"""
+from collections.abc import Mapping, MutableMapping
+
+import numpy as np
+
+
+class RatingMatrix:
+    def __init__(self, merge_every=10000):
+        self.merge_every = merge_every
+        self.dest_ids = []
+        self.dest_of = {}
+        self.usernames = []
+        self._user_of = None  # built on the first lookup by username
+        # (indptr, items, stars, times), swapped as one value so readers see a consistent set
+        self._csr = (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint8),
+                     np.zeros(0, dtype=np.uint32))
+        self._buffer = {}  # user -> {dest: stars}; 0 stars marks a deleted rating
+        self._buffer_times = {}  # (user, dest) -> seconds, for buffered ratings with a known time
+        self._buffered = 0
+
+    # ---- interning ----
+
+    def add_user(self, username):
+        """Add a row for a new user and return a view of it."""
+        if self._user_of is not None:
+            self._user_of[username] = len(self.usernames)
+        self.usernames.append(username)
+        return UserRatings(self, len(self.usernames) - 1)
+
+    @property
+    def user_of(self):
+        if self._user_of is None:
+            self._user_of = {username: u for u, username in enumerate(self.usernames)}
+        return self._user_of
+
+    def user(self, username):
+        """Index of ``username``, adding the user if needed."""
+        u = self.user_of.get(username)
+        if u is None:
+            u = self.add_user(username).u
+        return u
+
+    def dest(self, dest_id):
+        d = self.dest_of.get(dest_id)
+        if d is None:
+            d = self.dest_of[dest_id] = len(self.dest_ids)
+            self.dest_ids.append(dest_id)
+        return d
+
+    # ---- building ----
+
+    @classmethod
+    def from_ratings(cls, ratings_by_user, merge_every=10000):
+        """Build from ``(username, {dest_id: stars})`` pairs in one pass.
+
+        A pair may carry a third item, ``{dest_id: seconds}``, with the
+        times of those ratings.
+        """
+        matrix = cls(merge_every)
+        counts, items, stars, times = [], [], [], []
+        for username, ratings, *rated_at in ratings_by_user:
+            rated_at = rated_at[0] if rated_at and rated_at[0] else {}
+            matrix.usernames.append(username)
+            counts.append(len(ratings))
+            for dest_id, rating in ratings.items():
+                items.append(matrix.dest(dest_id))
+                stars.append(rating)
+                times.append(rated_at.get(dest_id) or 0)
+        indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        items = np.array(items, dtype=np.int32)
+        stars = np.array(stars, dtype=np.uint8)
+        times = np.array(times, dtype=np.float64).astype(np.uint32)
+        # Sort every user's slice by destination for binary search.
+        users = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+        order = np.lexsort((items, users))
+        matrix._csr = (indptr, items[order], stars[order], times[order])
+        return matrix
+
+    # ---- lookups ----
+
+    def _slice(self, u, csr=None):
+        indptr, items, stars, _ = csr or self._csr
+        if u + 1 >= len(indptr):
+            return items[:0], stars[:0]
+        lo, hi = indptr[u], indptr[u + 1]
+        return items[lo:hi], stars[lo:hi]
+
+    def get_index(self, u, d):
+        buffered = self._buffer.get(u)
+        if buffered is not None and d in buffered:
+            return buffered[d] or None
+        items, stars = self._slice(u)
+        pos = np.searchsorted(items, d)
+        if pos < len(items) and items[pos] == d:
+            return int(stars[pos])
+        return None
+
+    def get(self, username, dest_id):
+        u, d = self.user_of.get(username), self.dest_of.get(dest_id)
+        if u is None or d is None:
+            return None
+        return self.get_index(u, d)
+
+    def time_index(self, u, d):
+        """Unix seconds of user ``u``'s rating of ``d``, or None if unrated or the time is unknown."""
+        buffered = self._buffer.get(u)
+        if buffered is not None and d in buffered:
+            return self._buffer_times.get((u, d)) if buffered[d] else None
+        csr = self._csr
+        items, _ = self._slice(u, csr)
+        pos = np.searchsorted(items, d)
+        if pos < len(items) and items[pos] == d:
+            seconds = int(csr[3][csr[0][u] + pos])
+            return seconds or None
+        return None
+
+    def user_ratings(self, u):
+        """``{dest_index: stars}`` for user index ``u``."""
+        buffered = dict(self._buffer.get(u, {}))
+        items, stars = self._slice(u)
+        ratings = dict(zip(items.tolist(), stars.tolist()))
+        for d, rating in buffered.items():
+            if rating:
+                ratings[d] = rating
+            else:
+                ratings.pop(d, None)
+        return ratings
+
+    def rows(self):
+        """Views of every user's ratings, in row order."""
+        return [UserRatings(self, u) for u in range(len(self.usernames))]
+
+    def _buffered_entries(self):
+        # Read the buffer before the arrays: a merge in between only moves
+        # these entries into the arrays, where the buffered copies agree.
+        return [(u, d, rating) for u, buffered in list(self._buffer.items())
+                for d, rating in list(buffered.items())]
+
+    # ---- writes ----
+
+    def set_index(self, u, d, rating, seconds=None):
+        """Store ``rating`` (0 deletes), rated at ``seconds`` if known; return the previous stars, or None."""
+        previous = self.get_index(u, d)
+        if seconds:
+            self._buffer_times[(u, d)] = int(seconds)
+        else:
+            self._buffer_times.pop((u, d), None)
+        self._buffer.setdefault(u, {})[d] = rating
+        self._buffered += 1
+        if self._buffered >= self.merge_every:
+            self.merge()
+        return previous
+
+    def set(self, username, dest_id, rating, seconds=None):
+        return self.set_index(self.user(username), self.dest(dest_id), rating, seconds)
+
+    def merge(self):
+        """Fold the write buffer into the CSR arrays."""
+        buffer = self._buffer
+        if not buffer:
+            return
+        indptr, items, stars, times = self._csr
+        n_users, n_dests = len(self.usernames), max(len(self.dest_ids), 1)
+        old_users = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+        new = self._buffered_entries()
+        new_users = np.array([u for u, _, _ in new], dtype=np.int64)
+        new_items = np.array([d for _, d, _ in new], dtype=np.int32)
+        new_stars = np.array([rating for _, _, rating in new], dtype=np.uint8)
+        new_times = np.array([self._buffer_times.get((u, d), 0) for u, d, _ in new], dtype=np.uint32)
+
+        keys = np.concatenate([old_users * n_dests + items, new_users * n_dests + new_items])
+        all_stars = np.concatenate([stars, new_stars])
+        all_times = np.concatenate([times, new_times])
+        # Stable sort keeps buffered values after the stored ones they replace.
+        order = np.argsort(keys, kind="stable")
+        keys, all_stars, all_times = keys[order], all_stars[order], all_times[order]
+        last = np.append(keys[1:] != keys[:-1], True)
+        keep = last & (all_stars > 0)
+        keys, all_stars, all_times = keys[keep], all_stars[keep], all_times[keep]
+
+        merged_users = keys // n_dests
+        merged_indptr = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(merged_users, minlength=n_users), out=merged_indptr[1:])
+        # Swap the arrays in before dropping the buffer, so readers never miss a rating.
+        self._csr = (merged_indptr, (keys % n_dests).astype(np.int32), all_stars, all_times)
+        self._buffer = {}
+        self._buffer_times = {}
+        self._buffered = 0
+
+    # ---- aggregates ----
+
+    def totals(self):
+        """``dest_id -> (total stars, count)`` over all ratings."""
+        buffered = self._buffered_entries()
+        indptr, items, stars, _ = self._csr
+        n = len(self.dest_ids)
+        totals = np.bincount(items, weights=stars, minlength=n).astype(np.int64)
+        counts = np.bincount(items, minlength=n)
+        for u, d, rating in buffered:
+            lo, hi = (indptr[u], indptr[u + 1]) if u + 1 < len(indptr) else (0, 0)
+            pos = lo + np.searchsorted(items[lo:hi], d)
+            if pos < hi and items[pos] == d:
+                totals[d] -= stars[pos]
+                counts[d] -= 1
+            if rating:
+                totals[d] += rating
+                counts[d] += 1
+        return {self.dest_ids[d]: (int(totals[d]), int(counts[d])) for d in np.flatnonzero(counts).tolist()}
+
+    def iter_ratings(self):
+        """``(username, dest_id, stars)`` for every rating."""
+        buffered = self._buffered_entries()
+        indptr, items, stars, _ = self._csr
+        overridden = {(u, d) for u, d, _ in buffered}
+        users = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+        for u, d, rating in zip(users.tolist(), items.tolist(), stars.tolist()):
+            if (u, d) not in overridden:
+                yield self.usernames[u], self.dest_ids[d], rating
+        for u, d, rating in buffered:
+            if rating:
+                yield self.usernames[u], self.dest_ids[d], rating
+
+    def events(self):
+        """``(items, stars, times)`` arrays over every rating; ``items`` index ``dest_ids``."""
+        buffered = self._buffered_entries()
+        buffered_times = dict(self._buffer_times)
+        indptr, items, stars, times = self._csr
+        if not buffered:
+            return items, stars, times
+        n_dests = max(len(self.dest_ids), 1)
+        users = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+        overridden = np.array([u * n_dests + d for u, d, _ in buffered], dtype=np.int64)
+        keep = ~np.isin(users * n_dests + items, overridden)
+        fresh = [(u, d, rating) for u, d, rating in buffered if rating]
+        return (np.concatenate([items[keep], np.array([d for _, d, _ in fresh], dtype=np.int32)]),
+                np.concatenate([stars[keep], np.array([rating for _, _, rating in fresh], dtype=np.uint8)]),
+                np.concatenate([times[keep], np.array([buffered_times.get((u, d), 0) for u, d, _ in fresh],
+                                                      dtype=np.uint32)]))
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._csr)
+
+
+class UserRatings(MutableMapping):
+    """``dest_id -> stars`` view of one user's row in a RatingMatrix."""
+
+    __slots__ = ("matrix", "u")
+
+    def __init__(self, matrix, u):
+        self.matrix = matrix
+        self.u = u
+
+    def __getitem__(self, dest_id):
+        d = self.matrix.dest_of.get(dest_id)
+        rating = None if d is None else self.matrix.get_index(self.u, d)
+        if rating is None:
+            raise KeyError(dest_id)
+        return rating
+
+    def get(self, dest_id, default=None):
+        d = self.matrix.dest_of.get(dest_id)
+        rating = None if d is None else self.matrix.get_index(self.u, d)
+        return default if rating is None else rating
+
+    def __setitem__(self, dest_id, rating):
+        self.rate(dest_id, rating)
+
+    def rate(self, dest_id, rating, seconds=None):
+        """Store ``rating`` (made at Unix time ``seconds``, if known) and return the previous one, or None."""
+        if not 1 <= rating <= 255:
+            raise ValueError("ratings must be between 1 and 255")
+        return self.matrix.set_index(self.u, self.matrix.dest(dest_id), rating, seconds)
+
+    def __delitem__(self, dest_id):
+        if self.get(dest_id) is None:
+            raise KeyError(dest_id)
+        self.matrix.set_index(self.u, self.matrix.dest_of[dest_id], 0)
+
+    def items(self):
+        dest_ids = self.matrix.dest_ids
+        return [(dest_ids[d], rating) for d, rating in self.matrix.user_ratings(self.u).items()]
+
+    def __iter__(self):
+        return iter([dest_id for dest_id, _ in self.items()])
+
+    def __len__(self):
+        return len(self.matrix.user_ratings(self.u))
+
+    def __eq__(self, other):
+        return isinstance(other, (dict, UserRatings)) and dict(self.items()) == dict(other.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class RatingTimes(Mapping):
+    """``dest_id -> Unix seconds`` view of one user's rating times, for ratings whose time is known."""
+
+    __slots__ = ("matrix", "u")
+
+    def __init__(self, matrix, u):
+        self.matrix = matrix
+        self.u = u
+
+    def __getitem__(self, dest_id):
+        d = self.matrix.dest_of.get(dest_id)
+        seconds = None if d is None else self.matrix.time_index(self.u, d)
+        if seconds is None:
+            raise KeyError(dest_id)
+        return seconds
+
+    def __iter__(self):
+        return iter([dest_id for dest_id in UserRatings(self.matrix, self.u) if dest_id in self])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,90 @@
+"""Build the precomputed score tables (``ScoreTables``) for the active catalog.
+
+The tables hold the non-rating part of the score for every preference
+combination the questionnaire can produce, pruned to the rows that can
+reach the top ``--depth``. Point ``TRAVEL_SCORE_TABLES`` at the output and
+``recommend`` answers covered queries from them, applying only the rating
+term. Build time, size and lookup latency (against scoring the catalog
+directly) are reported on stderr.
+
+Usage:
+    python score_tables.py tables.npz
+    TRAVEL_CATALOG=catalog.bin python score_tables.py tables.npz --depth 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import smart_travel_app as app
+
+
+def sample_preferences(n, seed=0):
+    """``n`` random ``(prefs, weather)`` queries the questionnaire could produce."""
+    rng = random.Random(seed)
+    seasons = [season.lower() for season in app.TRAVEL_SEASONS]
+    queries = []
+    for _ in range(n):
+        trip_type = rng.choice(app.TRIP_TYPES).lower()
+        i = rng.randrange(len(app.BUDGET_CHOICES))
+        activities = [act.lower() for act in app.ACTIVITY_GROUPS[trip_type]]
+        cuisines = [c.lower() for c in app.CUISINES]
+        prefs = {
+            "trip_type": trip_type,
+            "budget": {"choice": app.BUDGET_CHOICES[i].lower(), "price_range": app.BUDGET_RANGES[i]},
+            "activities": rng.sample(activities, rng.randint(1, len(activities))),
+            "accommodation": rng.choice(app.ACCOMMODATIONS).lower(),
+            "cuisine": rng.sample(cuisines, rng.randint(1, len(cuisines))),
+            "travel_season": rng.choice(seasons),
+        }
+        queries.append((prefs, app.travel_weather(prefs)[1]))
+    return queries
+
+
+def _median_us(func, queries):
+    times = []
+    for prefs, weather in queries:
+        start = time.perf_counter()
+        func(prefs, weather)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def report(tables, build_seconds, path, k=3, samples=500):
+    """Print build time, size and lookup latency, checking lookups against the catalog."""
+    catalog, scores = tables.catalog, app.RATING_INDEX.scores
+    queries = sample_preferences(samples)
+    for prefs, weather in queries:
+        if tables.top_k(prefs, weather, scores, k=k) != catalog.top_k(prefs, weather, scores, k=k):
+            raise AssertionError(f"score tables disagree with the catalog for {prefs}")
+    table_us = _median_us(lambda prefs, weather: tables.top_k(prefs, weather, scores, k=k), queries)
+    catalog_us = _median_us(lambda prefs, weather: catalog.top_k(prefs, weather, scores, k=k), queries)
+    rows = len(tables.rows)
+    print(f"Built {len(tables)} preference tables for {len(catalog)} destinations in {build_seconds:.2f} s",
+          file=sys.stderr)
+    print(f"  rows kept       {rows} ({rows / max(1, len(tables)):.1f} per table, depth {tables.depth})",
+          file=sys.stderr)
+    print(f"  size            {tables.nbytes / 1e6:.2f} MB in memory, "
+          f"{os.path.getsize(path) / 1e6:.2f} MB on disk", file=sys.stderr)
+    print(f"  top-{k} lookup    median {table_us:.1f} us (catalog scoring {catalog_us:.1f} us)", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute non-rating scores for every preference combination.")
+    parser.add_argument("output", help="table file to write (.npz)")
+    parser.add_argument("--depth", type=int, default=10, help="largest k answered from the tables")
+    parser.add_argument("--samples", type=int, default=500, help="queries used to check and time lookups")
+    args = parser.parse_args(argv)
+
+    app.ensure_users()
+    start = time.perf_counter()
+    tables = app.ScoreTables.build(app.CATALOG, args.depth)
+    build_seconds = time.perf_counter() - start
+    tables.save(args.output)
+    report(tables, build_seconds, args.output, samples=args.samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Session tokens and off-thread password checks.
+
+``SessionTable`` hands out opaque random tokens after a successful login or
+registration, so later requests are authenticated by one dict lookup
+instead of hashing the password again. A token expires ``ttl`` seconds
+after it was issued or last renewed; using it in the second half of that
+window renews it. Expiry times sit in a min-heap; expired tokens are
+dropped a few at a time whenever the table is used, and heap entries made
+stale by a renewal are skipped when they surface.
+
+``PasswordVerifier`` runs hashing on a fixed number of worker threads.
+Callers get a future, so an event loop can wait for the result without
+blocking. At most ``max_pending`` checks are queued or running at once;
+beyond that ``submit`` raises ``VerifierBusy`` rather than letting the
+queue grow without bound.
+"""
+import heapq
+import hmac
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SessionTable:
+    """Token -> value map whose entries expire unless used within ``ttl`` seconds."""
+
+    def __init__(self, ttl=1800.0, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = {}  # token -> [expires_at, value]
+        self._expiry = []  # (expires_at, token); may hold stale entries
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def issue(self, value):
+        """Store ``value`` under a new token and return the token."""
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            now = self._clock()
+            self._evict(now)
+            expires = now + self.ttl
+            self._entries[token] = [expires, value]
+            heapq.heappush(self._expiry, (expires, token))
+        return token
+
+    def get(self, token):
+        """The value stored under ``token`` (renewing its lifetime), or None if unknown or expired."""
+        with self._lock:
+            now = self._clock()
+            self._evict(now)
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            # The old heap entry goes stale; a new one marks the new deadline.
+            if entry[0] - now < self.ttl / 2:
+                entry[0] = now + self.ttl
+                heapq.heappush(self._expiry, (entry[0], token))
+            return entry[1]
+
+    def revoke(self, token):
+        with self._lock:
+            return self._entries.pop(token, [None, None])[1]
+
+    def evict_expired(self):
+        """Drop every expired token; returns how many were dropped."""
+        with self._lock:
+            return self._evict(self._clock(), limit=None)
+
+    def _evict(self, now, limit=64):
+        evicted = 0
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now and (limit is None or evicted < limit):
+            expires, token = heapq.heappop(expiry)
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] == expires:
+                del self._entries[token]
+                evicted += 1
+        # Renewals leave stale heap entries behind; rebuild once they dominate.
+        if len(expiry) > 2 * len(self._entries) + 1024:
+            self._expiry = [(entry[0], token) for token, entry in self._entries.items()]
+            heapq.heapify(self._expiry)
+        return evicted
+
+
+class VerifierBusy(RuntimeError):
+    pass
+
+
+class PasswordVerifier:
+    """Password hashing and comparison on a bounded pool of worker threads."""
+
+    def __init__(self, hash_password, max_workers=4, max_pending=1024):
+        self.hash_password = hash_password
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise VerifierBusy("too many password checks in flight")
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _check(self, stored_hash, password):
+        # Hash even for unknown users so the response time does not reveal them.
+        computed = self.hash_password(password)
+        return stored_hash is not None and hmac.compare_digest(stored_hash, computed)
+
+    def submit(self, stored_hash, password):
+        """Future resolving to whether ``password`` matches ``stored_hash`` (None never matches)."""
+        return self._submit(self._check, stored_hash, password)
+
+    def hash(self, password):
+        """Future resolving to the hash of ``password``."""
+        return self._submit(self.hash_password, password)
+
+    def verify(self, stored_hash, password):
+        return self.submit(stored_hash, password).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -1,7 +1,26 @@
-import json
+import copy
+import difflib
 import hashlib
-from sklearn.metrics.pairwise import cosine_similarity
+import heapq
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+
+import catalog_file
+import catalog_source
+import itinerary
+from geo import SpatialIndex
+from item_cf import ItemNeighbors
+from leaderboards import KINDS as LEADERBOARD_KINDS, Leaderboards
+from metrics import METRICS
+from sessions import PasswordVerifier, SessionTable
+from tag_index import TagIndex
+from user_store import JournaledUserStore, SQLiteUserStore, rating_events, rating_totals
 
 # ========================
 # 1. DATA INITIALIZATION
@@ -15,6 +34,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "asia",
         "location": "Phuket, Thailand",
+        "lat": 7.8804,
+        "lon": 98.3923,
         "price": 80,
         "tags": {"beach": 0.9, "backpacking": 0.8},
         "ideal_weather": ["sunny", "warm"],
@@ -27,6 +48,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "asia",
         "location": "Bali, Indonesia",
+        "lat": -8.6905,
+        "lon": 115.1683,
         "price": 350,
         "tags": {"beach": 0.9, "luxury": 0.7},
         "ideal_weather": ["sunny", "warm"],
@@ -39,6 +62,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "asia",
         "location": "Maldives",
+        "lat": 4.1755,
+        "lon": 73.5093,
         "price": 800,
         "tags": {"beach": 0.95, "luxury": 0.9},
         "ideal_weather": ["sunny", "warm"],
@@ -53,6 +78,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "europe",
         "location": "Portugal",
+        "lat": 37.1028,
+        "lon": -8.6742,
         "price": 70,
         "tags": {"beach": 0.8, "surfing": 0.9},
         "ideal_weather": ["sunny", "warm"],
@@ -65,6 +92,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "europe",
         "location": "Greece",
+        "lat": 36.4618,
+        "lon": 25.3753,
         "price": 350,
         "tags": {"beach": 0.85, "romantic": 0.9},
         "ideal_weather": ["sunny", "warm"],
@@ -77,6 +106,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "europe",
         "location": "France",
+        "lat": 43.7102,
+        "lon": 7.262,
         "price": 900,
         "tags": {"beach": 0.9, "luxury": 0.95},
         "ideal_weather": ["sunny", "warm"],
@@ -91,6 +122,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "africa",
         "location": "Tanzania",
+        "lat": -6.1659,
+        "lon": 39.2026,
         "price": 60,
         "tags": {"beach": 0.85, "cultural": 0.7},
         "ideal_weather": ["sunny", "warm"],
@@ -103,6 +136,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "africa",
         "location": "Kenya",
+        "lat": -4.3167,
+        "lon": 39.5833,
         "price": 350,
         "tags": {"beach": 0.9, "wildlife": 0.6},
         "ideal_weather": ["sunny", "warm"],
@@ -115,6 +150,8 @@ DESTINATIONS = {
         "type": "beach",
         "region": "africa",
         "location": "Seychelles",
+        "lat": -4.6796,
+        "lon": 55.492,
         "price": 1200,
         "tags": {"beach": 0.95, "exclusive": 0.9},
         "ideal_weather": ["sunny", "warm"],
@@ -130,6 +167,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "asia",
         "location": "Nepal",
+        "lat": 28.2096,
+        "lon": 83.9856,
         "price": 40,
         "tags": {"mountain": 0.9, "trekking": 0.8},
         "ideal_weather": ["cool", "dry"],
@@ -142,6 +181,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "asia",
         "location": "Bhutan",
+        "lat": 27.4287,
+        "lon": 89.4164,
         "price": 320,
         "tags": {"mountain": 0.9, "spiritual": 0.7},
         "ideal_weather": ["cool", "dry"],
@@ -154,6 +195,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "asia",
         "location": "Japan",
+        "lat": 36.1461,
+        "lon": 137.2522,
         "price": 500,
         "tags": {"mountain": 0.9, "luxury": 0.8},
         "ideal_weather": ["snowy", "cold"],
@@ -168,6 +211,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "europe",
         "location": "Slovakia",
+        "lat": 49.1794,
+        "lon": 20.0881,
         "price": 50,
         "tags": {"mountain": 0.8, "hiking": 0.9},
         "ideal_weather": ["cool", "sunny"],
@@ -180,6 +225,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "europe",
         "location": "Austria",
+        "lat": 47.2692,
+        "lon": 11.4041,
         "price": 400,
         "tags": {"mountain": 0.9, "skiing": 0.8},
         "ideal_weather": ["snowy", "cold"],
@@ -192,6 +239,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "europe",
         "location": "Switzerland",
+        "lat": 46.0207,
+        "lon": 7.7491,
         "price": 1000,
         "tags": {"mountain": 0.95, "luxury": 0.9},
         "ideal_weather": ["snowy", "cold"],
@@ -206,6 +255,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "africa",
         "location": "Morocco",
+        "lat": 31.137,
+        "lon": -7.9192,
         "price": 60,
         "tags": {"mountain": 0.8, "cultural": 0.7},
         "ideal_weather": ["cool", "dry"],
@@ -218,6 +269,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "africa",
         "location": "Kenya",
+        "lat": -0.1521,
+        "lon": 37.3084,
         "price": 450,
         "tags": {"mountain": 0.85, "wildlife": 0.6},
         "ideal_weather": ["cool", "dry"],
@@ -230,6 +283,8 @@ DESTINATIONS = {
         "type": "mountain",
         "region": "africa",
         "location": "Tanzania",
+        "lat": -3.0674,
+        "lon": 37.3556,
         "price": 700,
         "tags": {"mountain": 0.9, "luxury": 0.8},
         "ideal_weather": ["cool", "dry"],
@@ -245,6 +300,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "asia",
         "location": "Vietnam",
+        "lat": 21.0285,
+        "lon": 105.8542,
         "price": 175,
         "tags": {"city": 0.8, "cultural": 0.9},
         "ideal_weather": ["warm", "humid"],
@@ -257,6 +314,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "asia",
         "location": "Thailand",
+        "lat": 13.7563,
+        "lon": 100.5018,
         "price": 420,
         "tags": {"city": 0.85, "shopping": 0.8},
         "ideal_weather": ["warm", "humid"],
@@ -269,6 +328,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "asia",
         "location": "Japan",
+        "lat": 35.6762,
+        "lon": 139.6503,
         "price": 850,
         "tags": {"city": 0.95, "luxury": 0.9},
         "ideal_weather": ["mild", "seasonal"],
@@ -283,6 +344,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "europe",
         "location": "Poland",
+        "lat": 50.0647,
+        "lon": 19.945,
         "price": 100,
         "tags": {"city": 0.8, "historical": 0.9},
         "ideal_weather": ["mild", "seasonal"],
@@ -295,6 +358,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "europe",
         "location": "Spain",
+        "lat": 41.3874,
+        "lon": 2.1686,
         "price": 470,
         "tags": {"city": 0.9, "cultural": 0.8},
         "ideal_weather": ["warm", "sunny"],
@@ -307,6 +372,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "europe",
         "location": "France",
+        "lat": 48.8566,
+        "lon": 2.3522,
         "price": 850,
         "tags": {"city": 0.95, "luxury": 0.9},
         "ideal_weather": ["mild", "seasonal"],
@@ -321,6 +388,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "africa",
         "location": "Morocco",
+        "lat": 31.6295,
+        "lon": -7.9811,
         "price": 40,
         "tags": {"city": 0.8, "cultural": 0.9},
         "ideal_weather": ["warm", "dry"],
@@ -333,6 +402,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "africa",
         "location": "South Africa",
+        "lat": -33.9249,
+        "lon": 18.4241,
         "price": 180,
         "tags": {"city": 0.85, "scenic": 0.8},
         "ideal_weather": ["warm", "sunny"],
@@ -345,6 +416,8 @@ DESTINATIONS = {
         "type": "city",
         "region": "asia",
         "location": "UAE",
+        "lat": 25.2048,
+        "lon": 55.2708,
         "price": 900,
         "tags": {"city": 0.95, "luxury": 0.9},
         "ideal_weather": ["warm", "dry"],
@@ -355,26 +428,2067 @@ DESTINATIONS = {
 }
 
 
-def load_users():
-    if os.path.exists('users.json'):
+# Choices offered by the preferences questionnaire
+TRIP_TYPES = ["Beach", "Mountain", "City"]
+BUDGET_CHOICES = ["Low ($0-$300)", "Medium ($300-$500)", "High ($500+)"]
+BUDGET_RANGES = [(0, 300), (300, 500), (500, 9999)]
+# Short names of the budget choices, as used by facets and leaderboards
+BUDGET_KEYS = [choice.split()[0].lower() for choice in BUDGET_CHOICES]
+ACTIVITY_GROUPS = {
+    "beach": ["Surfing", "Snorkeling", "Spa"],
+    "mountain": ["Skiing", "Snowboarding", "Mountain climbing"],
+    "city": ["Shopping", "Museums", "City tours"]
+}
+ACCOMMODATIONS = ["Hotel", "Villa", "Apartment"]
+CUISINES = [
+    "Local", "Vegetarian", "Seafood",
+    "Street food", "Meat", "Vegan"
+]
+TRAVEL_SEASONS = ["Summer", "Winter", "Spring", "Fall"]
+
+# ========================
+# 2. SCORING ENGINE
+# ========================
+
+SEASON_WEATHER = {
+    "summer": "sunny",
+    "winter": "snowy",
+    "spring": "mild",
+    "fall": "rainy"
+}
+
+# Weights of the five score terms, applied in this order.
+SCORE_WEIGHTS = (0.25, 0.25, 0.2, 0.15, 0.15)
+
+# Ways to combine group members' scores (see CompiledCatalog.group_top_k).
+GROUP_STRATEGIES = ("average", "least_misery", "most_pleasure")
+
+# Share of a nearby query's score given to proximity: full at the point, none at the radius.
+PROXIMITY_WEIGHT = 0.2
+
+# Candidates scored per array pass when streaming a query.
+CHUNK_SIZE = 65536
+
+
+# Bit positions are assigned to the questionnaire's own vocabularies first,
+# so the common terms keep the same bits whatever the catalog holds.
+ACTIVITY_TERMS = [act.lower() for group in ACTIVITY_GROUPS.values() for act in group]
+CUISINE_TERMS = [c.lower() for c in CUISINES]
+WEATHER_TERMS = list(SEASON_WEATHER.values()) + ["mild"]
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        bytes_ = words.view(np.uint8).reshape(words.shape + (8,))
+        return _BYTE_POPCOUNT[bytes_].sum(axis=-1, dtype=np.uint8)
+
+
+def _bitmasks(values_per_row, known=()):
+    """Intern row values into bit positions and return ``(vocab, masks)``.
+
+    ``masks`` is a ``(rows, words)`` uint64 array; vocabulary term ``i`` is
+    bit ``i % 64`` of word ``i // 64``. Terms in ``known`` come first.
+    """
+    vocab = {}
+    for value in known:
+        vocab.setdefault(value, len(vocab))
+    row_bits = []
+    for values in values_per_row:
+        bits = 0
+        for value in values:
+            bits |= 1 << vocab.setdefault(value, len(vocab))
+        row_bits.append(bits)
+    words = max(1, (len(vocab) + 63) // 64)
+    masks = np.zeros((len(row_bits), words), dtype=np.uint64)
+    for word in range(words):
+        shift = 64 * word
+        masks[:, word] = [(bits >> shift) & 0xFFFFFFFFFFFFFFFF for bits in row_bits]
+    return vocab, masks
+
+
+def _set_bitmasks(masks, vocab, n, rows, values_per_row):
+    """Copies of ``vocab`` and ``masks`` (grown to ``n`` rows) with ``rows`` re-encoded."""
+    vocab = dict(vocab)
+    row_bits = []
+    for values in values_per_row:
+        bits = 0
+        for value in values:
+            bits |= 1 << vocab.setdefault(value, len(vocab))
+        row_bits.append(bits)
+    words = max(masks.shape[1], (len(vocab) + 63) // 64)
+    grown = np.zeros((n, words), dtype=np.uint64)
+    grown[:len(masks), :masks.shape[1]] = masks
+    for row, bits in zip(rows, row_bits):
+        grown[row] = [(bits >> (64 * word)) & 0xFFFFFFFFFFFFFFFF for word in range(words)]
+    return vocab, grown
+
+
+def _grown(array, n, dtype=None):
+    """Copy of ``array`` with ``n`` rows; added rows are zero."""
+    grown = np.zeros((n,) + array.shape[1:], dtype=dtype or array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _coordinates(records):
+    """``(lat, lon)`` columns of ``records``; NaN where a destination has no coordinates."""
+    coords = np.array([(dest.get("lat", np.nan), dest.get("lon", np.nan)) for dest in records], dtype=np.float64)
+    coords = coords.reshape(-1, 2)
+    return coords[:, 0].copy(), coords[:, 1].copy()
+
+
+def _query_mask(vocab, values, words):
+    """Mask of the ``values`` present in ``vocab``, one uint64 per word."""
+    bits = 0
+    for value in values:
+        if value in vocab:
+            bits |= 1 << vocab[value]
+    return np.array([(bits >> (64 * word)) & 0xFFFFFFFFFFFFFFFF for word in range(words)], dtype=np.uint64)
+
+
+class CatalogIndex:
+    """Posting lists over a compiled catalog for candidate pre-filtering.
+
+    ``postings[field][value]`` is the sorted array of rows carrying that
+    value, for ``type``, ``region``, ``activities``, ``cuisines`` and
+    ``accommodation`` (activities and cuisines lowercased, as in matching).
+    For every type the qualifying rows are also kept sorted by price, so a
+    budget window is located by bisection and costs O(log n + matches).
+    Destinations without activities can never be recommended and are left
+    out of the price lists.
+    """
+
+    FIELDS = ("type", "region", "activities", "cuisines", "accommodation")
+
+    def __init__(self, catalog):
+        postings = {field: {} for field in self.FIELDS}
+        for row, dest in enumerate(catalog.records):
+            for field, field_values in self._values(dest).items():
+                for value in set(field_values):
+                    postings[field].setdefault(value, []).append(row)
+        self.postings = {
+            field: {value: np.array(rows, dtype=np.int64) for value, rows in by_value.items()}
+            for field, by_value in postings.items()
+        }
+
+        self.by_price = {}
+        for trip_type, rows in self.postings["type"].items():
+            rows = rows[catalog.has_activities[rows]]
+            order = np.argsort(catalog.price[rows], kind="stable")
+            self.by_price[trip_type] = (catalog.price[rows][order], rows[order])
+
+    @staticmethod
+    def _values(dest):
+        return {
+            "type": [dest["type"]],
+            "region": [dest["region"]],
+            "activities": [act.lower() for act in dest["activities"]],
+            "cuisines": [c.lower() for c in dest["cuisines"]],
+            "accommodation": dest["accommodation"],
+        }
+
+    def updated(self, catalog, previous, rows):
+        """A copy re-indexed for ``rows`` of ``catalog`` only.
+
+        ``previous`` maps the rows that were live before to their old records;
+        rows whose id no longer maps to them in ``catalog`` are dropped.
+        """
+        index = copy.copy(self)
+        index.postings = {field: dict(by_value) for field, by_value in self.postings.items()}
+        index.by_price = dict(self.by_price)
+        drops, adds = {}, {}
+        for row in rows:
+            if row in previous:
+                for field, values in self._values(previous[row]).items():
+                    for value in set(values):
+                        drops.setdefault((field, value), []).append(row)
+            if catalog.row_of.get(catalog.ids[row]) == row:
+                for field, values in self._values(catalog.records[row]).items():
+                    for value in set(values):
+                        adds.setdefault((field, value), []).append(row)
+        for field, value in drops.keys() | adds.keys():
+            current = index.postings[field].get(value, np.zeros(0, dtype=np.int64))
+            current = np.setdiff1d(current, drops.get((field, value), []), assume_unique=True)
+            current = np.union1d(current, np.array(adds.get((field, value), []), dtype=np.int64))
+            if len(current):
+                index.postings[field][value] = current
+            else:
+                index.postings[field].pop(value, None)
+
+        rows = np.array(sorted(rows), dtype=np.int64)
+        for trip_type in {value for field, value in drops.keys() | adds.keys() if field == "type"}:
+            _, type_rows = self.by_price.get(trip_type, (None, np.zeros(0, dtype=np.int64)))
+            type_rows = type_rows[~np.isin(type_rows, rows)]
+            new_rows = np.array(adds.get(("type", trip_type), []), dtype=np.int64)
+            new_rows = new_rows[catalog.has_activities[new_rows]]
+            if len(new_rows):
+                # Insert in (price, row) order, the order of a fresh build.
+                new_rows = new_rows[np.lexsort((new_rows, catalog.price[new_rows]))]
+                prices = catalog.price[type_rows]
+                positions = []
+                for row in new_rows.tolist():
+                    lo = np.searchsorted(prices, catalog.price[row], side="left")
+                    hi = np.searchsorted(prices, catalog.price[row], side="right")
+                    positions.append(lo + np.searchsorted(type_rows[lo:hi], row))
+                type_rows = np.insert(type_rows, positions, new_rows)
+            if len(type_rows):
+                index.by_price[trip_type] = (catalog.price[type_rows], type_rows)
+            else:
+                index.by_price.pop(trip_type, None)
+        return index
+
+    @classmethod
+    def from_file(cls, source):
+        """The index stored in a ``catalog_file.CatalogFile``, as views of its arrays."""
+        index = cls.__new__(cls)
+        arrays = source.arrays
+        index.postings = {}
+        for field, values in source.header["postings"].items():
+            indptr, rows = arrays[f"postings.{field}.indptr"], arrays[f"postings.{field}.rows"]
+            index.postings[field] = {value: rows[indptr[i]:indptr[i + 1]] for i, value in enumerate(values)}
+        index.by_price = {trip_type: (arrays[f"by_price.{i}.prices"], arrays[f"by_price.{i}.rows"])
+                          for i, trip_type in enumerate(source.header["by_price"])}
+        return index
+
+    def rows(self, field, value):
+        return self.postings[field].get(value, np.zeros(0, dtype=np.int64))
+
+    def candidates(self, trip_type, budget_min, budget_max):
+        """Rows of ``trip_type`` priced within the budget, cheapest first.
+
+        The result is a view into the price list, so no copy is made.
+        """
+        if trip_type not in self.by_price:
+            return np.zeros(0, dtype=np.int64)
+        prices, rows = self.by_price[trip_type]
+        lo = np.searchsorted(prices, budget_min, side="left")
+        hi = np.searchsorted(prices, budget_max, side="right")
+        return rows[lo:hi]
+
+
+class CompiledCatalog:
+    """Column-oriented copy of a destinations dict, scored in one array pass.
+
+    The comparisons mirror the original per-destination loop: activities and
+    cuisines are matched on lowercased destination values, while
+    accommodation and weather are exact string matches.
+
+    Each of the four vocabularies is interned into bit positions, and every
+    destination carries one bitmask per vocabulary, so matching a query is an
+    AND plus a popcount. Query masks are memoized per preference tuple.
+    """
+
+    MAX_QUERY_MASKS = 4096
+
+    def __init__(self, destinations):
+        self.destinations = destinations
+        self.source = None
+        self.ids = list(destinations)
+        self.records = [destinations[dest_id] for dest_id in self.ids]
+        self.row_of = {dest_id: row for row, dest_id in enumerate(self.ids)}
+
+        self.price = np.array([dest["price"] for dest in self.records])
+        self.lat, self.lon = _coordinates(self.records)
+        self.type_vocab = {}
+        self.type_code = np.array(
+            [self.type_vocab.setdefault(dest["type"], len(self.type_vocab)) for dest in self.records],
+            dtype=np.int32
+        )
+        self.activity_vocab, self.activities = _bitmasks(
+            [[act.lower() for act in dest["activities"]] for dest in self.records], ACTIVITY_TERMS)
+        self.has_activities = np.array([bool(dest["activities"]) for dest in self.records], dtype=bool)
+        self.cuisine_vocab, self.cuisines = _bitmasks(
+            [[c.lower() for c in dest["cuisines"]] for dest in self.records], CUISINE_TERMS)
+        self.accommodation_vocab, self.accommodation = _bitmasks(
+            [dest["accommodation"] for dest in self.records], ACCOMMODATIONS)
+        self.weather_vocab, self.weather = _bitmasks(
+            [dest["ideal_weather"] for dest in self.records], WEATHER_TERMS)
+        self._query_masks = {}
+        self.index = CatalogIndex(self)
+
+    @classmethod
+    def from_file(cls, path):
+        """Open a catalog compiled by ``catalog_file.write_catalog_file``.
+
+        Columns and index are views of the mapped file; ids, records and the
+        id lookup decode on demand, so opening costs the same at any size.
+        """
+        source = catalog_file.CatalogFile(path)
+        arrays = source.arrays
+        catalog = cls.__new__(cls)
+        catalog.source = source
+        catalog.destinations = catalog_file.MappedDestinations(source)
+        catalog.ids = catalog_file.MappedIds(source)
+        catalog.records = catalog_file.MappedRecords(source)
+        catalog.row_of = catalog_file.MappedRows(source)
+        catalog.price = arrays["price"]
+        if "lat" in arrays:
+            catalog.lat, catalog.lon = arrays["lat"], arrays["lon"]
+        else:  # written before coordinates were part of the schema
+            catalog.lat = catalog.lon = np.full(len(source), np.nan)
+        catalog.type_vocab = {trip_type: code for code, trip_type in enumerate(source.header["type_vocab"])}
+        catalog.type_code = arrays["type_code"]
+        catalog.has_activities = arrays["has_activities"]
+        for field, attribute in catalog_file.MASK_ATTRIBUTES.items():
+            vocab = source.header["vocab"][field]
+            setattr(catalog, f"{field}_vocab", {value: bit for bit, value in enumerate(vocab)})
+            setattr(catalog, attribute, arrays[f"mask.{field}"])
+        catalog._query_masks = {}
+        catalog.index = CatalogIndex.from_file(source)
+        return catalog
+
+    def updated(self, upserts, removed=()):
+        """A copy with ``upserts`` (dest_id -> destination) applied and ``removed`` ids dropped.
+
+        Only the affected rows are re-encoded and re-indexed. Row numbers are
+        stable: modified entries are rewritten in place, new ones appended,
+        and removed ones left behind as rows that are never candidates, so
+        row-keyed state like the rating index carries over. The original
+        catalog is not modified.
+        """
+        if self.source is not None:
+            raise ValueError("a catalog opened from a file is updated by recompiling the file")
+        catalog = copy.copy(self)
+        catalog.ids = list(self.ids)
+        catalog.records = list(self.records)
+        catalog.row_of = dict(self.row_of)
+        catalog.destinations = dict(self.destinations)
+        previous = {}  # row -> record before the update, for rows that were live
+        dead = []
+        for dest_id in removed:
+            row = catalog.row_of.pop(dest_id, None)
+            if row is not None:
+                previous[row] = catalog.records[row]
+                del catalog.destinations[dest_id]
+                dead.append(row)
+        changed = []
+        for dest_id, dest in upserts.items():
+            row = catalog.row_of.get(dest_id)
+            if row is None:
+                row = catalog.row_of[dest_id] = len(catalog.ids)
+                catalog.ids.append(dest_id)
+                catalog.records.append(dest)
+            else:
+                previous[row] = catalog.records[row]
+                catalog.records[row] = dest
+            catalog.destinations[dest_id] = dest
+            changed.append(row)
+
+        n = len(catalog.ids)
+        records = [catalog.records[row] for row in changed]
+        prices = [dest["price"] for dest in records]
+        catalog.price = _grown(self.price, n, np.result_type(self.price, *prices))
+        catalog.price[changed] = prices
+        catalog.lat, catalog.lon = _grown(self.lat, n), _grown(self.lon, n)
+        catalog.lat[changed], catalog.lon[changed] = _coordinates(records)
+        catalog.lat[dead] = catalog.lon[dead] = np.nan
+        catalog.type_vocab = dict(self.type_vocab)
+        catalog.type_code = _grown(self.type_code, n)
+        catalog.type_code[changed] = [catalog.type_vocab.setdefault(dest["type"], len(catalog.type_vocab))
+                                      for dest in records]
+        catalog.has_activities = _grown(self.has_activities, n)
+        catalog.has_activities[changed] = [bool(dest["activities"]) for dest in records]
+        catalog.has_activities[dead] = False
+        catalog.activity_vocab, catalog.activities = _set_bitmasks(
+            self.activities, self.activity_vocab, n, changed,
+            [[act.lower() for act in dest["activities"]] for dest in records])
+        catalog.cuisine_vocab, catalog.cuisines = _set_bitmasks(
+            self.cuisines, self.cuisine_vocab, n, changed, [[c.lower() for c in dest["cuisines"]] for dest in records])
+        catalog.accommodation_vocab, catalog.accommodation = _set_bitmasks(
+            self.accommodation, self.accommodation_vocab, n, changed, [dest["accommodation"] for dest in records])
+        catalog.weather_vocab, catalog.weather = _set_bitmasks(
+            self.weather, self.weather_vocab, n, changed, [dest["ideal_weather"] for dest in records])
+        catalog._query_masks = {}
+        catalog.index = self.index.updated(catalog, previous, changed + dead)
+        return catalog
+
+    def save(self, path):
+        """Compile this catalog into a memory-mappable file at ``path`` (replaced atomically)."""
+        catalog_file.write_catalog_file(self, path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def query_masks(self, prefs, weather):
+        """``(activities, cuisines, accommodation, weather)`` masks for a query, memoized."""
+        key = (tuple(prefs["activities"]), tuple(prefs["cuisine"]), prefs["accommodation"], weather)
+        masks = self._query_masks.get(key)
+        if masks is None:
+            if len(self._query_masks) >= self.MAX_QUERY_MASKS:
+                self._query_masks.clear()
+            masks = (
+                _query_mask(self.activity_vocab, [act.lower() for act in prefs["activities"]],
+                            self.activities.shape[1]),
+                _query_mask(self.cuisine_vocab, prefs["cuisine"], self.cuisines.shape[1]),
+                _query_mask(self.accommodation_vocab, [prefs["accommodation"]], self.accommodation.shape[1]),
+                _query_mask(self.weather_vocab, [weather], self.weather.shape[1]),
+            )
+            self._query_masks[key] = masks
+        return masks
+
+    @staticmethod
+    def _match_count(masks, query):
+        if len(query) == 1:
+            return _popcount(masks[:, 0] & query[0])
+        return _popcount(masks & query).sum(axis=1)
+
+    @staticmethod
+    def _flag(masks, query):
+        return (masks & query).any(axis=1)
+
+    def candidate_chunks(self, prefs, chunk_size=CHUNK_SIZE):
+        """Yield the rows passing the type and budget filters, ``chunk_size`` at a time."""
+        budget_min, budget_max = prefs["budget"]["price_range"]
+        with METRICS.stage("filter"):
+            rows = self.index.candidates(prefs["trip_type"], budget_min, budget_max)
+        METRICS.count("candidates_visited", len(rows))
+        # Rows outside the index's candidate set are never looked at.
+        METRICS.count("candidates_skipped", len(self.ids) - len(rows))
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+
+    def candidate_count(self, prefs):
+        budget_min, budget_max = prefs["budget"]["price_range"]
+        return len(self.index.candidates(prefs["trip_type"], budget_min, budget_max))
+
+    def are_candidates(self, rows, prefs):
+        """Which of ``rows`` pass the type and budget filters, checked on the columns."""
+        budget_min, budget_max = prefs["budget"]["price_range"]
+        price = self.price[rows]
+        return ((self.type_code[rows] == self.type_vocab.get(prefs["trip_type"], -1)) & self.has_activities[rows]
+                & (price >= budget_min) & (price <= budget_max))
+
+    def personal_scores(self, personal_ratings, predicted_ratings=None):
+        """Sorted catalog rows with a personal rating term and those terms.
+
+        The user's own ratings take precedence over ``predicted_ratings``
+        (dest_id -> predicted stars from collaborative filtering).
+        """
+        terms = {}
+        for ratings in (predicted_ratings, personal_ratings):
+            for dest_id, rating in (ratings or {}).items():
+                row = self.row_of.get(dest_id)
+                if row is not None:
+                    terms[row] = rating / 5.0
+        rows = sorted(terms)
+        return (np.array(rows, dtype=np.int64),
+                np.array([terms[row] for row in rows], dtype=np.float64))
+
+    def base_scores(self, rows, prefs, weather):
+        """Weighted activity, cuisine, weather and accommodation terms of ``rows``.
+
+        Adding the weighted rating term to this gives the exact total of the
+        original loop, which summed the five terms left to right.
+        """
+        METRICS.count("candidates_scored", len(rows))
+        with METRICS.stage("match"):
+            activity_query, cuisine_query, accom_query, weather_query = self.query_masks(prefs, weather)
+            activity_matches = self._match_count(self.activities[rows], activity_query)
+            # Destinations without a shared activity fall back to their first one.
+            activity_matches = np.maximum(activity_matches, 1)
+            cuisine_matches = self._match_count(self.cuisines[rows], cuisine_query)
+            matching_accom = self._flag(self.accommodation[rows], accom_query)
+            ideal_weather = self._flag(self.weather[rows], weather_query)
+
+            activity_score = activity_matches / max(1, len(prefs["activities"]))
+            cuisine_score = cuisine_matches / max(1, len(prefs["cuisine"]))
+            accom_score = np.where(matching_accom, 1.0, 0.5)
+            weather_boost = np.where(ideal_weather, 1.5, 0.8)
+
+            w_activity, w_cuisine, w_weather, w_accom, _ = SCORE_WEIGHTS
+            return (
+                    w_activity * activity_score +
+                    w_cuisine * cuisine_score +
+                    w_weather * weather_boost +
+                    w_accom * accom_score
+            )
+
+    def score(self, rows, prefs, weather, rating_scores, personal=None):
+        """Integer match scores of ``rows`` for ``prefs``.
+
+        ``rating_scores`` holds the global rating term for each catalog row;
+        ``personal`` is the result of ``personal_scores`` and overrides it for
+        destinations the user rated.
+        """
+        return final_scores(self.base_scores(rows, prefs, weather), self.rating_terms(rows, rating_scores, personal))
+
+    @staticmethod
+    def rating_terms(rows, rating_scores, personal=None):
+        """Rating term of ``rows``: the global one, overridden by ``personal`` where the user has one."""
+        rating_score = rating_scores[rows]
+        if personal is not None and len(personal[0]):
+            personal_rows, personal_terms = personal
+            pos = np.minimum(np.searchsorted(personal_rows, rows), len(personal_rows) - 1)
+            rated = personal_rows[pos] == rows
+            rating_score = np.where(rated, personal_terms[pos], rating_score)
+        return rating_score
+
+    def group_scores(self, rows, members, rating_scores):
+        """Integer match scores of ``rows`` for several members, one row per member.
+
+        ``members`` holds ``(prefs, weather, personal)`` per member, as for
+        ``score``. The members' query masks are stacked, so each term is one
+        broadcast over (members, rows) instead of a pass per member.
+        """
+        prefs_list = [prefs for prefs, _, _ in members]
+        METRICS.count("candidates_scored", len(rows) * len(members))
+        with METRICS.stage("match"):
+            activity_query, cuisine_query, accom_query, weather_query = (
+                np.stack(queries) for queries in zip(*(self.query_masks(prefs, weather)
+                                                       for prefs, weather, _ in members)))
+            activity_matches = np.maximum(self._group_match_count(self.activities[rows], activity_query), 1)
+            cuisine_matches = self._group_match_count(self.cuisines[rows], cuisine_query)
+            matching_accom = self._group_flag(self.accommodation[rows], accom_query)
+            ideal_weather = self._group_flag(self.weather[rows], weather_query)
+
+            activity_score = activity_matches / np.array([[max(1, len(p["activities"]))] for p in prefs_list])
+            cuisine_score = cuisine_matches / np.array([[max(1, len(p["cuisine"]))] for p in prefs_list])
+            accom_score = np.where(matching_accom, 1.0, 0.5)
+            weather_boost = np.where(ideal_weather, 1.5, 0.8)
+
+            w_activity, w_cuisine, w_weather, w_accom, _ = SCORE_WEIGHTS
+            base = (
+                    w_activity * activity_score +
+                    w_cuisine * cuisine_score +
+                    w_weather * weather_boost +
+                    w_accom * accom_score
+            )
+        rating_score = rating_scores[rows][None]
+        for member, (_, _, personal) in enumerate(members):
+            if personal is not None and len(personal[0]):
+                personal_rows, personal_terms = personal
+                pos = np.minimum(np.searchsorted(personal_rows, rows), len(personal_rows) - 1)
+                rated = personal_rows[pos] == rows
+                if rated.any():
+                    if len(rating_score) == 1:
+                        rating_score = np.repeat(rating_score, len(members), axis=0)
+                    rating_score[member] = np.where(rated, personal_terms[pos], rating_score[member])
+        return final_scores(base, rating_score)
+
+    @staticmethod
+    def _group_match_count(masks, queries):
+        if masks.shape[1] == 1:
+            return _popcount(masks[:, 0] & queries[:, :1])
+        return _popcount(masks[None] & queries[:, None]).sum(axis=2)
+
+    @staticmethod
+    def _group_flag(masks, queries):
+        if masks.shape[1] == 1:
+            return (masks[:, 0] & queries[:, :1]) != 0
+        return (masks[None] & queries[:, None]).any(axis=2)
+
+    def rank_keys(self, rows, scores):
+        """Unique sort keys: higher score first, then lower row (catalog order)."""
+        n = len(self.ids)
+        return scores * (n + 1) + (n - rows)
+
+    def scored_chunks(self, prefs, weather, rating_scores, personal=None):
+        """Yield ``(rows, scores, None)`` for the candidates of ``prefs``, a chunk at a time."""
+        for rows in self.candidate_chunks(prefs):
+            yield rows, self.score(rows, prefs, weather, rating_scores, personal), None
+
+    def cursor(self, prefs, weather, rating_scores, personal_ratings=None, predicted_ratings=None, head=None):
+        """A ``RecommendationCursor`` that scores the candidates afresh, chunk by chunk, for every page.
+
+        ``head`` is an optional shortcut for the first pages (see ``ScoreTables.head``).
+        """
+        with METRICS.stage("rating"):
+            personal = self.personal_scores(personal_ratings, predicted_ratings)
+        return RecommendationCursor(self, prefs, weather,
+                                    lambda: self.scored_chunks(prefs, weather, rating_scores, personal),
+                                    self.candidate_count(prefs), head)
+
+    def top_k(self, prefs, weather, rating_scores, personal_ratings=None, k=3, predicted_ratings=None):
+        """Best ``k`` recommendations, best first.
+
+        Candidates are scored chunk by chunk and merged into a bounded
+        min-heap, so memory stays O(k + chunk) and the full candidate set is
+        never sorted. Ties keep catalog order, like a stable sort of the
+        original loop.
+        """
+        return self.cursor(prefs, weather, rating_scores, personal_ratings, predicted_ratings).next_page(k)
+
+    def group_top_k(self, members, rating_scores, strategy="average", k=3):
+        """Best ``k`` destinations for a group as ``(row, member scores)``, best first.
+
+        Candidates are the destinations of any member's trip type priced
+        within every member's budget. Per-member scores are aggregated by
+        ``strategy``: their sum (``average``), minimum (``least_misery``)
+        or maximum (``most_pleasure``); ties go to the higher sum, then to
+        catalog order.
+        """
+        if strategy not in GROUP_STRATEGIES:
+            raise ValueError(f"strategy must be one of {', '.join(GROUP_STRATEGIES)}")
+        budget_min = max(prefs["budget"]["price_range"][0] for prefs, _, _ in members)
+        budget_max = min(prefs["budget"]["price_range"][1] for prefs, _, _ in members)
+        by_type = {}
+        for member, (prefs, _, _) in enumerate(members):
+            if budget_min <= budget_max:
+                by_type.setdefault(prefs["trip_type"], []).append(member)
+        best_rows, best_scores, best_keys = [], [], []
+        # Only members who chose a destination's trip type are scored on it;
+        # the others' zeros need no computing.
+        for trip_type, scored in by_type.items():
+            with METRICS.stage("filter"):
+                # Catalog order keeps the column gathers sequential.
+                rows = np.sort(self.index.candidates(trip_type, budget_min, budget_max))
+            METRICS.count("candidates_visited", len(rows))
+            # Chunks shrink with the group so the (members, rows) arrays stay bounded.
+            chunk_size = max(1, CHUNK_SIZE // len(scored))
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                scores = self.group_scores(chunk, [members[m] for m in scored], rating_scores)
+                if len(scored) < len(members):
+                    scores, partial = np.zeros((len(members), len(chunk)), dtype=np.int64), scores
+                    scores[scored] = partial
+                chunk, scores, keys = self._group_best(chunk, scores, strategy, k)
+                best_rows.append(chunk)
+                best_scores.append(scores)
+                best_keys.append(keys)
+        if not best_rows:
+            return []
+        rows, scores, keys = np.concatenate(best_rows), np.hstack(best_scores), np.concatenate(best_keys)
+        order = np.argsort(-keys)[:k]
+        METRICS.count("recommendations_returned", len(order))
+        return [(int(rows[i]), scores[:, i].tolist()) for i in order]
+
+    def _group_best(self, rows, scores, strategy, k):
+        """The ``k`` best of ``rows`` as ``(rows, scores, keys)``, unordered."""
+        with METRICS.stage("rank"):
+            total = scores.sum(axis=0)
+            primary = {"average": total, "least_misery": scores.min(axis=0),
+                       "most_pleasure": scores.max(axis=0)}[strategy]
+            keys = self.rank_keys(rows, primary * (100 * len(scores) + 1) + total)
+            if len(keys) > k:
+                best = np.argpartition(keys, len(keys) - k)[len(keys) - k:]
+                rows, scores, keys = rows[best], scores[:, best], keys[best]
+            return rows, scores, keys
+
+    def score_candidates(self, prefs, weather, rating_scores):
+        """Score every candidate once with the global rating term."""
+        rows = np.sort(np.concatenate([np.zeros(0, dtype=np.int64)] + list(self.candidate_chunks(prefs))))
+        base = np.concatenate([np.zeros(0)] + [self.base_scores(rows[start:start + CHUNK_SIZE], prefs, weather)
+                                               for start in range(0, len(rows), CHUNK_SIZE)])
+        return ScoredCandidates(self, prefs, weather, rows, base, rating_scores[rows])
+
+    def recommendation(self, row, score, prefs, weather):
+        dest = self.records[row]
+        user_activities = set(act.lower() for act in prefs["activities"])
+        matched_activities = []
+        for act in dest["activities"]:
+            act = act.lower()
+            if act in user_activities and act not in matched_activities:
+                matched_activities.append(act)
+        if not matched_activities:
+            matched_activities = [dest["activities"][0].lower()]
+
+        user_cuisines = set(prefs["cuisine"])
+        matched_cuisines = []
+        for c in dest["cuisines"]:
+            c = c.lower()
+            if c in user_cuisines and c not in matched_cuisines:
+                matched_cuisines.append(c)
+
+        return {
+            "id": self.ids[row],
+            "name": dest["name"],
+            "location": dest["location"],
+            "score": score,
+            "price": dest["price"],
+            "weather": "Ideal" if weather in dest["ideal_weather"] else "Good",
+            "matched_activities": matched_activities,
+            "matched_cuisines": matched_cuisines,
+            "accommodation": dest["accommodation"]
+        }
+
+
+def final_scores(base, rating_score):
+    """Integer match scores from the base terms and the (unweighted) rating term."""
+    total_score = base + SCORE_WEIGHTS[4] * rating_score
+    return np.minimum(100, np.rint(total_score * 100)).astype(np.int64)
+
+
+class ScoredCandidates:
+    """All candidates of one query, scored with the global rating term.
+
+    The non-rating part of each score is kept, so a user's own ratings can
+    be swapped in for the few destinations they rated without re-scoring.
+    That is what makes an instance shareable between users with the same
+    preferences.
+    """
+
+    def __init__(self, catalog, prefs, weather, rows, base, rating_terms):
+        self.catalog = catalog
+        self.prefs = prefs
+        self.weather = weather
+        self.rows = rows  # ascending
+        self.base = base
+        self.scores = final_scores(base, rating_terms)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _overrides(self, personal_ratings, predicted_ratings):
+        """Positions in ``rows`` of the user's own or predicted ratings (ascending) and their rating terms."""
+        with METRICS.stage("rating"):
+            personal_rows, personal_terms = self.catalog.personal_scores(personal_ratings, predicted_ratings)
+            if not len(personal_rows) or not len(self.rows):
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            pos = np.minimum(np.searchsorted(self.rows, personal_rows), len(self.rows) - 1)
+            hit = self.rows[pos] == personal_rows
+            return pos[hit], personal_terms[hit]
+
+    def personalized(self, personal_ratings=None, predicted_ratings=None):
+        """Scores with the user's own or predicted ratings overriding the global term."""
+        pos, terms = self._overrides(personal_ratings, predicted_ratings)
+        if not len(pos):
+            return self.scores
+        scores = self.scores.copy()
+        scores[pos] = final_scores(self.base[pos], terms)
+        return scores
+
+    def chunks(self, overrides, chunk_size=CHUNK_SIZE):
+        """Yield ``(rows, scores, None)`` a chunk at a time, with ``overrides`` from ``_overrides`` applied."""
+        pos, terms = overrides
+        for start in range(0, len(self.rows), chunk_size):
+            end = start + chunk_size
+            rows, scores = self.rows[start:end], self.scores[start:end]
+            lo, hi = np.searchsorted(pos, [start, end])
+            if hi > lo:
+                scores = scores.copy()
+                scores[pos[lo:hi] - start] = final_scores(self.base[pos[lo:hi]], terms[lo:hi])
+            yield rows, scores, None
+
+    def cursor(self, personal_ratings=None, predicted_ratings=None):
+        """A ``RecommendationCursor`` paging through this pool in place, without copying it."""
+        overrides = self._overrides(personal_ratings, predicted_ratings)
+        return RecommendationCursor(self.catalog, self.prefs, self.weather, lambda: self.chunks(overrides),
+                                    len(self.rows))
+
+
+class RecommendationCache:
+    """LRU/TTL cache of ``ScoredCandidates`` keyed by preference fingerprint.
+
+    Entries hold global rating terms only; personal ratings are applied per
+    request. A new rating for a destination invalidates just the entries
+    whose trip type and budget window include it. Size is bounded both by
+    entry count and by the total number of cached candidate rows.
+
+    A pool is scored and cached the second time its fingerprint is asked
+    for within ``ttl``. One-off queries, and pools over ``max_rows``, are
+    left to the caller to score chunk by chunk, so they never hold their
+    whole pool.
+
+    Scoring runs outside the lock, so every invalidation bumps a
+    generation counter; a pool scored while the generation changed may
+    predate the rating that caused it and is returned without being cached.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300.0, max_rows=5_000_000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._generation = 0
+        self._entries = OrderedDict()  # key -> (expires_at, trip_type, price_range, candidates, catalog)
+        self._seen = OrderedDict()  # key -> expires_at, for fingerprints asked for once
+        self._by_type = {}
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(prefs, weather):
+        """Canonical hash of everything in ``prefs`` that affects scoring."""
+        canonical = {
+            "trip_type": prefs["trip_type"],
+            "price_range": list(prefs["budget"]["price_range"]),
+            # Activities match case-insensitively, but their count (including
+            # repeats) divides the activity score.
+            "activities": sorted(act.lower() for act in prefs["activities"]),
+            "accommodation": prefs["accommodation"],
+            "cuisine": sorted(prefs["cuisine"]),
+            "weather": weather,
+        }
+        return hashlib.sha1(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+    def get_or_score(self, catalog, prefs, weather, rating_scores):
+        """The cached ``ScoredCandidates`` of a query, scoring them if they are worth caching, else None."""
+        key = self.fingerprint(prefs, weather)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now and entry[4] is catalog:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                METRICS.count("cache_hits")
+                return entry[3]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            generation = self._generation
+            seen = self._seen.pop(key, 0) > now
+            if not seen:
+                self._seen[key] = now + self.ttl
+                while len(self._seen) > self.max_entries:
+                    self._seen.popitem(last=False)
+        METRICS.count("cache_misses")
+        if not seen or catalog.candidate_count(prefs) > self.max_rows:
+            return None
+
+        candidates = catalog.score_candidates(prefs, weather, rating_scores)
+        with self._lock:
+            if self._generation != generation:
+                return candidates
+            if key in self._entries:
+                self._remove(key)
+            trip_type, price_range = prefs["trip_type"], tuple(prefs["budget"]["price_range"])
+            self._entries[key] = (now + self.ttl, trip_type, price_range, candidates, catalog)
+            self._by_type.setdefault(trip_type, set()).add(key)
+            self._rows += len(candidates)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return candidates
+
+    def _remove(self, key):
+        _, trip_type, _, candidates, _ = self._entries.pop(key)
+        self._by_type[trip_type].discard(key)
+        self._rows -= len(candidates)
+
+    def invalidate_destination(self, dest):
+        """Drop the entries whose candidate set can contain ``dest``."""
+        with self._lock:
+            self._invalidate(dest)
+
+    def _invalidate(self, dest):
+        self._generation += 1
+        for key in list(self._by_type.get(dest["type"], ())):
+            budget_min, budget_max = self._entries[key][2]
+            if budget_min <= dest["price"] <= budget_max:
+                self._remove(key)
+                self.invalidations += 1
+
+    def catalog_updated(self, previous, catalog, changed):
+        """Carry entries scored on ``previous`` over to ``catalog``, its ``updated`` version.
+
+        Entries that any of the ``changed`` destination dicts (old or new
+        versions) can affect are dropped; the rest stay valid because rows
+        keep their numbers across updates.
+        """
+        with self._lock:
+            for dest in changed:
+                self._invalidate(dest)
+            for key, entry in self._entries.items():
+                if entry[4] is previous:
+                    self._entries[key] = entry[:4] + (catalog,)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._seen.clear()
+            self._by_type.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "rows": self._rows, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+class RecommendationCursor:
+    """Pages through one query, best first, keeping only the page being built.
+
+    ``chunks`` is called once per page and yields the candidates as
+    ``(rows, scores, distances or None)`` arrays, a chunk at a time. A page
+    is the best ``size`` candidates not returned yet: each chunk is cut down
+    by a partial selection and merged into a bounded min-heap, so a page
+    costs one pass over the candidates and O(size + chunk) memory. Only the
+    rows already returned are remembered, and never returned again. Scores
+    are read afresh for every page, so ratings made in between count.
+    Pages of one cursor are taken one at a time.
+
+    ``head`` is an optional ``(depth, chunks)`` pair whose chunks hold every
+    candidate that can rank among the first ``depth``, whatever the rating
+    terms; pages that end within ``depth`` are picked from those instead.
+    """
+
+    def __init__(self, catalog, prefs, weather, chunks, total, head=None):
+        self.catalog = catalog
+        self.prefs = prefs
+        self.weather = weather
+        self._chunks = chunks
+        self._total = total
+        self._head = head
+        self._returned = np.zeros(0, dtype=np.int64)  # ascending
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._total
+
+    @property
+    def remaining(self):
+        return self._total - len(self._returned)
+
+    def next_page(self, size=3):
+        with self._lock:
+            size = min(size, self.remaining)
+            chunks = self._chunks
+            if self._head is not None and len(self._returned) + size <= self._head[0]:
+                chunks = self._head[1]
+            page = self._best(chunks, size)
+            self._returned = np.union1d(self._returned, np.array([row for _, row, _, _ in page], dtype=np.int64))
+        METRICS.count("recommendations_returned", len(page))
+        recommendations = []
+        for _, row, score, distance in page:
+            recommendation = self.catalog.recommendation(row, score, self.prefs, self.weather)
+            if distance is not None:
+                recommendation["distance_km"] = round(distance, 1)
+            recommendations.append(recommendation)
+        return recommendations
+
+    def _best(self, chunks, size):
+        """``(rank key, row, score, distance)`` of the best ``size`` candidates not returned yet, best first."""
+        heap = []
+        for rows, scores, distances in (chunks() if size > 0 else ()):
+            with METRICS.stage("rank"):
+                if len(self._returned):
+                    fresh = ~np.isin(rows, self._returned, assume_unique=True)
+                    rows, scores = rows[fresh], scores[fresh]
+                    distances = None if distances is None else distances[fresh]
+                keys = self.catalog.rank_keys(rows, scores)
+                best = np.arange(len(keys))
+                if len(keys) > size:
+                    best = np.argpartition(keys, len(keys) - size)[len(keys) - size:]
+                for i, key in zip(best.tolist(), keys[best].tolist()):
+                    if len(heap) == size and key <= heap[0][0]:
+                        continue
+                    item = (key, int(rows[i]), int(scores[i]), None if distances is None else float(distances[i]))
+                    if len(heap) < size:
+                        heapq.heappush(heap, item)
+                    else:
+                        heapq.heapreplace(heap, item)
+        return sorted(heap, reverse=True)
+
+    def __iter__(self):
+        while self.remaining:
+            page = self.next_page()
+            if not page:
+                return
+            yield from page
+
+
+def budget_keys(price):
+    """Keys of the budget choices whose range holds ``price``; bounds are inclusive."""
+    return [key for key, (lo, hi) in zip(BUDGET_KEYS, BUDGET_RANGES) if lo <= price <= hi]
+
+
+class FacetIndex:
+    """Per-value row bitsets for counting destinations under a partial selection.
+
+    Every value of a facet (trip type, region, budget bucket, activity,
+    cuisine or accommodation, all lowercased) has a bitset over catalog
+    rows, 64 rows per uint64 word; a facet's bitsets are stacked into one
+    (values, words) array. A selection ORs the chosen values within a facet
+    and ANDs across facets. Each facet is counted under the other facets'
+    filters only, so its counts show what picking another value would give.
+    Budget buckets are the questionnaire's ranges under their short keys
+    (low, medium, high), bounds included, so a $300 destination counts as
+    both low and medium.
+
+    Counting ANDs and popcounts every value's bitset, so its cost grows with
+    the catalog; results are cached per selection until the next ``update``,
+    which re-files changed rows in place. Readers and writers share a lock.
+    """
+
+    FIELDS = ("type", "region", "budget", "activities", "cuisines", "accommodation")
+    MAX_CACHED = 1024
+
+    def __init__(self, catalog):
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.values = {field: {} for field in self.FIELDS}  # field -> value -> position in its stack
+        words = (len(catalog) + 63) // 64
+        self._bits = {field: np.zeros((0, words), dtype=np.uint64) for field in self.FIELDS}
+        self._sizes = {field: np.zeros(0, dtype=np.int64) for field in self.FIELDS}
+        self._alive = np.zeros(words, dtype=np.uint64)
+        # Start from the posting lists, which already hold every live row.
+        postings = dict(catalog.index.postings)
+        alive_rows = np.concatenate([np.zeros(0, dtype=np.int64)] + list(postings["type"].values()))
+        postings["budget"] = {
+            key: alive_rows[(catalog.price[alive_rows] >= lo) & (catalog.price[alive_rows] <= hi)]
+            for key, (lo, hi) in zip(BUDGET_KEYS, BUDGET_RANGES)
+        }
+        self._alive = self._bitset(alive_rows, words)
+        # Every questionnaire answer is a known value, even if no destination carries it yet.
+        for field, values in (("type", TRIP_TYPES), ("budget", BUDGET_KEYS), ("accommodation", ACCOMMODATIONS),
+                              ("activities", [act for group in ACTIVITY_GROUPS.values() for act in group]),
+                              ("cuisines", CUISINES)):
+            for value in values:
+                self._position(field, value.lower())
+        for field in self.FIELDS:
+            for value, rows in postings[field].items():
+                bits = self._bitset(rows, words)
+                position = self._position(field, str(value).lower())
+                self._bits[field][position] |= bits
+            self._sizes[field] = _popcount(self._bits[field]).sum(axis=1).astype(np.int64)
+
+    @staticmethod
+    def _bitset(rows, words):
+        flags = np.zeros(words * 64, dtype=bool)
+        flags[rows] = True
+        return np.packbits(flags, bitorder="little").view(np.uint64)
+
+    def _position(self, field, value):
+        position = self.values[field].get(value)
+        if position is None:
+            position = self.values[field][value] = len(self.values[field])
+            bits = self._bits[field]
+            self._bits[field] = np.vstack([bits, np.zeros((1, bits.shape[1]), dtype=np.uint64)])
+            self._sizes[field] = np.append(self._sizes[field], 0)
+        return position
+
+    @staticmethod
+    def _row_values(dest):
+        values = {field: {str(value).lower() for value in field_values}
+                  for field, field_values in CatalogIndex._values(dest).items()}
+        values["budget"] = set(budget_keys(dest["price"]))
+        return values
+
+    def update(self, catalog, rows):
+        """Re-file ``rows`` of ``catalog``; rows whose id no longer maps to them are dropped."""
+        with self._lock:
+            self._cache.clear()
+            words = (len(catalog) + 63) // 64
+            if words > len(self._alive):
+                grow = max(words, 2 * len(self._alive)) - len(self._alive)
+                self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=np.uint64)])
+                for field in self.FIELDS:
+                    self._bits[field] = np.hstack([self._bits[field],
+                                                   np.zeros((len(self._bits[field]), grow), dtype=np.uint64)])
+            for row in rows:
+                word, bit = divmod(row, 64)
+                bit = np.uint64(1 << bit)
+                for field in self.FIELDS:
+                    column = self._bits[field][:, word]
+                    self._sizes[field] -= ((column & bit) != 0).astype(np.int64)
+                    self._bits[field][:, word] = column & ~bit
+                self._alive[word] &= ~bit
+                if catalog.row_of.get(catalog.ids[row]) != row:
+                    continue
+                self._alive[word] |= bit
+                for field, values in self._row_values(catalog.records[row]).items():
+                    for value in values:
+                        position = self._position(field, value)
+                        self._bits[field][position, word] |= bit
+                        self._sizes[field][position] += 1
+
+    def counts(self, selection=None):
+        """``(total, {facet: {value: count}})`` for a ``{facet: [values]}`` selection.
+
+        Values no live destination carries are left out of the counts.
+        Raises ValueError for an unknown facet or value.
+        """
+        selection = {field: frozenset(str(value).lower() for value in values)
+                     for field, values in (selection or {}).items()}
+        unknown = set(selection) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"unknown facets: {', '.join(sorted(unknown))}")
+        key = frozenset(selection.items())
+        with self._lock:
+            unknown = sorted(f"{field}={value}" for field, values in selection.items()
+                             for value in values if value not in self.values[field])
+            if unknown:
+                raise ValueError(f"unknown facet values: {', '.join(unknown)}")
+            cached = self._cache.get(key)
+            if cached is None:
+                cached = self._cache[key] = self._count(selection)
+                if len(self._cache) > self.MAX_CACHED:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(key)
+            total, counts = cached
+            return total, {field: dict(by_value) for field, by_value in counts.items()}
+
+    def _count(self, selection):
+        masks = {}
+        for field, values in selection.items():
+            positions = [self.values[field][value] for value in values]
+            masks[field] = np.bitwise_or.reduce(self._bits[field][positions], axis=0) if positions \
+                else np.zeros_like(self._alive)
+        matching = self._alive.copy()
+        for mask in masks.values():
+            matching &= mask
+        counts = {}
+        for field in self.FIELDS:
+            others = [mask for other, mask in masks.items() if other != field]
+            if not others:
+                field_counts = self._sizes[field]  # unfiltered: every live row counts
+            else:
+                among = self._alive.copy()
+                for mask in others:
+                    among &= mask
+                bits = self._bits[field]
+                words = np.flatnonzero(among)
+                # Narrow selections leave most words empty; count only the rest.
+                if len(words) < len(among) // 2:
+                    bits, among = bits[:, words], among[words]
+                field_counts = _popcount(bits & among).sum(axis=1)
+            counts[field] = {value: int(field_counts[position])
+                             for value, position in self.values[field].items() if self._sizes[field][position]}
+        return int(_popcount(matching).sum()), counts
+
+
+class ScoreTables:
+    """Non-rating scores precomputed for every questionnaire answer.
+
+    The questionnaire allows a finite set of preferences: a trip type, a
+    budget bucket, a non-empty subset of that trip type's activities, an
+    accommodation, a non-empty subset of the cuisines and a season (one of
+    four weathers). For each combination the table keeps only the rows that
+    can still make the top ``depth`` once a rating term is added: a row is
+    dropped when its score with the best possible rating term is below the
+    ``depth``-th best score with the worst one. Queries then apply the
+    rating term to those few rows. Through ``head`` the tables answer the
+    first ``depth`` results of every recommendation cursor they cover.
+
+    Base scores take only a few hundred distinct values across all tables,
+    so they are stored once and every kept row carries a uint16 code.
+    """
+
+    FORMAT_VERSION = 1
+    WEATHERS = ("sunny", "snowy", "mild", "rainy")
+
+    def __init__(self, catalog, depth, indptr, rows, codes, values):
+        self.catalog = catalog
+        self.depth = depth
+        self.indptr = indptr
+        self.rows = rows
+        self.codes = codes
+        self.values = values
+        self.trip_types = [t.lower() for t in TRIP_TYPES]
+        self.budgets = [tuple(r) for r in BUDGET_RANGES]
+        self.accommodations = [a.lower() for a in ACCOMMODATIONS]
+        self.cuisine_bits = {c.lower(): 1 << i for i, c in enumerate(CUISINES)}
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.indptr, self.rows, self.codes, self.values))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @staticmethod
+    def catalog_digest(catalog):
+        """Hash of everything in ``catalog`` that the tables depend on."""
+        digest = hashlib.sha1("\0".join(catalog.ids).encode())
+        for array in (catalog.price, catalog.type_code, catalog.has_activities, catalog.activities,
+                      catalog.cuisines, catalog.accommodation, catalog.weather):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(json.dumps([list(catalog.type_vocab), list(catalog.activity_vocab),
+                                  list(catalog.cuisine_vocab), list(catalog.accommodation_vocab),
+                                  list(catalog.weather_vocab)]).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _subsets(values):
+        """Non-empty subsets of ``values`` in bitmask order (subset ``i`` has mask ``i + 1``)."""
+        return [[value for bit, value in enumerate(values) if mask >> bit & 1]
+                for mask in range(1, 1 << len(values))]
+
+    def combo(self, prefs, weather):
+        """Table number of a query, or None if the questionnaire cannot produce it."""
         try:
-            with open('users.json', 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            print("Warning: Corrupted user file. Starting fresh.")
-    return {}
+            t = self.trip_types.index(prefs["trip_type"])
+            b = self.budgets.index(tuple(prefs["budget"]["price_range"]))
+            h = self.accommodations.index(prefs["accommodation"])
+            w = self.WEATHERS.index(weather)
+        except (ValueError, TypeError):
+            return None
+        group = [act.lower() for act in ACTIVITY_GROUPS[TRIP_TYPES[t].lower()]]
+        activities = [act.lower() for act in prefs["activities"]]
+        cuisines = prefs["cuisine"]
+        # Repeated answers change the divisor of a term, so they are not tabulated.
+        if (not activities or not cuisines or len(set(activities)) != len(activities)
+                or len(set(cuisines)) != len(cuisines)
+                or not set(activities) <= set(group) or not set(cuisines) <= set(self.cuisine_bits)):
+            return None
+        a = sum(1 << group.index(act) for act in activities) - 1
+        c = sum(self.cuisine_bits[cuisine] for cuisine in cuisines) - 1
+        n_activities, n_cuisines = (1 << len(group)) - 1, (1 << len(CUISINES)) - 1
+        return (((((t * len(self.budgets) + b) * n_activities + a) * len(self.accommodations) + h)
+                 * len(self.WEATHERS) + w) * n_cuisines + c)
+
+    @classmethod
+    def build(cls, catalog, depth=10):
+        indptr, rows_out, base_out = [0], [], []
+        w_activity, w_cuisine, w_weather, w_accom, _ = SCORE_WEIGHTS
+        cuisine_sets = cls._subsets([c.lower() for c in CUISINES])
+        for trip_type in (t.lower() for t in TRIP_TYPES):
+            group = [act.lower() for act in ACTIVITY_GROUPS[trip_type]]
+            for budget_min, budget_max in BUDGET_RANGES:
+                rows = np.sort(catalog.index.candidates(trip_type, budget_min, budget_max))
+                n = len(rows)
+                # The same element-wise operations as base_scores, broadcast
+                # over every cuisine subset at once, so the sums are identical.
+                cuisine_score = np.zeros((len(cuisine_sets), n))
+                for i, cuisines in enumerate(cuisine_sets):
+                    cuisine_query = _query_mask(catalog.cuisine_vocab, cuisines, catalog.cuisines.shape[1])
+                    cuisine_score[i] = catalog._match_count(catalog.cuisines[rows], cuisine_query) / len(cuisines)
+                for activities in cls._subsets(group):
+                    activity_query = _query_mask(catalog.activity_vocab, activities, catalog.activities.shape[1])
+                    activity_score = (np.maximum(catalog._match_count(catalog.activities[rows], activity_query), 1)
+                                      / max(1, len(activities)))
+                    partial = w_activity * activity_score + w_cuisine * cuisine_score
+                    for accommodation in (a.lower() for a in ACCOMMODATIONS):
+                        accom_query = _query_mask(catalog.accommodation_vocab, [accommodation],
+                                                  catalog.accommodation.shape[1])
+                        accom_score = np.where(catalog._flag(catalog.accommodation[rows], accom_query), 1.0, 0.5)
+                        for weather in cls.WEATHERS:
+                            weather_query = _query_mask(catalog.weather_vocab, [weather], catalog.weather.shape[1])
+                            weather_boost = np.where(catalog._flag(catalog.weather[rows], weather_query), 1.5, 0.8)
+                            base = partial + w_weather * weather_boost + w_accom * accom_score
+                            keep = np.ones(base.shape, dtype=bool)
+                            if n > depth:
+                                # Stars run from 1 to 5, so the rating term is at least 1/5.
+                                worst = final_scores(base, 0.2)
+                                threshold = np.partition(worst, n - depth, axis=1)[:, n - depth]
+                                keep = final_scores(base, 1.0) >= threshold[:, None]
+                            for combo_base, combo_keep in zip(base, keep):
+                                rows_out.append(rows[combo_keep])
+                                base_out.append(combo_base[combo_keep])
+                                indptr.append(indptr[-1] + len(rows_out[-1]))
+        values, codes = np.unique(np.concatenate(base_out), return_inverse=True)
+        if len(values) > 1 << 16:
+            raise ValueError(f"{len(values)} distinct base scores do not fit uint16 codes")
+        return cls(catalog, depth, np.array(indptr, dtype=np.int64), np.concatenate(rows_out).astype(np.int32),
+                   codes.astype(np.uint16), values)
+
+    def candidates(self, combo):
+        """Ascending rows kept for table ``combo`` and their base scores."""
+        lo, hi = self.indptr[combo], self.indptr[combo + 1]
+        return self.rows[lo:hi].astype(np.int64), self.values[self.codes[lo:hi]]
+
+    def head(self, prefs, weather, rating_scores, personal_ratings=None, predicted_ratings=None):
+        """``(depth, chunks)`` for ``RecommendationCursor``, or None if the tables do not cover the query."""
+        combo = self.combo(prefs, weather)
+        if combo is None:
+            return None
+        METRICS.count("score_table_hits")
+        rows, base = self.candidates(combo)
+        personal = self.catalog.personal_scores(personal_ratings, predicted_ratings)
+        return self.depth, lambda: [(rows, final_scores(base, self.catalog.rating_terms(rows, rating_scores, personal)),
+                                     None)]
+
+    def top_k(self, prefs, weather, rating_scores, personal_ratings=None, k=3, predicted_ratings=None):
+        """Best ``k`` recommendations from the tables, or None if they do not cover the query."""
+        if k > self.depth:
+            return None
+        head = self.head(prefs, weather, rating_scores, personal_ratings, predicted_ratings)
+        if head is None:
+            return None
+        return self.catalog.cursor(prefs, weather, rating_scores, personal_ratings, predicted_ratings,
+                                   head).next_page(k)
+
+    def save(self, path):
+        header = {"version": self.FORMAT_VERSION, "depth": self.depth,
+                  "catalog": self.catalog_digest(self.catalog)}
+        with open(path, "wb") as f:
+            np.savez(f, header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+                     indptr=self.indptr, rows=self.rows, codes=self.codes, values=self.values)
+
+    @classmethod
+    def load(cls, path, catalog):
+        """Tables saved for ``catalog``; raises ValueError if they were built for another one."""
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes())
+            if header.get("version") != cls.FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported score table version {header.get('version')!r}")
+            if header["catalog"] != cls.catalog_digest(catalog):
+                raise ValueError(f"{path} was built for a different catalog")
+            return cls(catalog, header["depth"], data["indptr"], data["rows"], data["codes"], data["values"])
+
+
+# TRAVEL_CATALOG replaces the built-in DESTINATIONS with an external catalog:
+# a .jsonl or .csv source (see catalog_source.py), which reload_catalog()
+# re-reads incrementally, or a file compiled by catalog_file.py, mapped and
+# shared between processes.
+CATALOG_PATH = os.environ.get("TRAVEL_CATALOG")
+CATALOG_SOURCE = None
+if CATALOG_PATH and CATALOG_PATH.endswith((".jsonl", ".csv")):
+    CATALOG_SOURCE = catalog_source.CatalogSource(CATALOG_PATH)
+    CATALOG = CompiledCatalog(CATALOG_SOURCE.load())
+elif CATALOG_PATH:
+    CATALOG = CompiledCatalog.from_file(CATALOG_PATH)
+else:
+    CATALOG = CompiledCatalog(DESTINATIONS)
+DESTINATIONS = CATALOG.destinations
+# Held while the catalog and the state derived from it are swapped or updated.
+_CATALOG_LOCK = threading.Lock()
+_RELOAD_LOCK = threading.Lock()
+
+
+def travel_weather(prefs):
+    """Return the stored travel season and the weather searched for it."""
+    season = prefs.get("travel_season", "summer")  # default to summer if not set
+    return season, SEASON_WEATHER.get(season.lower(), "mild")
+
+
+class RatingIndex:
+    """Running rating sum and count per destination.
+
+    Kept in step with the users' ``ratings`` dicts so averages never require
+    a scan of all users. ``scores`` holds the rating term for each catalog
+    row: the average rating divided by 5, or 1.0 for unrated destinations.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.totals = np.zeros(len(catalog), dtype=np.int64)
+        self.counts = np.zeros(len(catalog), dtype=np.int64)
+        self.scores = np.ones(len(catalog))
+        # Ratings for ids missing from the catalog: dest_id -> [total, count]
+        self.others = {}
+
+    def rebuild(self, users):
+        self.totals[:] = 0
+        self.counts[:] = 0
+        self.scores[:] = 1.0
+        self.others = {}
+        for dest_id, (total, count) in rating_totals(users).items():
+            row = self.catalog.row_of.get(dest_id)
+            if row is None:
+                self.others[dest_id] = [total, count]
+                continue
+            self.totals[row], self.counts[row] = total, count
+            self.scores[row] = (int(total) / int(count)) / 5.0
+
+    def record(self, dest_id, rating, previous=None):
+        """Add a rating, replacing ``previous`` if the user had rated before."""
+        row = self.catalog.row_of.get(dest_id)
+        if row is None:
+            total_count = self.others.setdefault(dest_id, [0, 0])
+            total_count[0] += rating - (previous or 0)
+            total_count[1] += previous is None
+            return
+        self.totals[row] += rating - (previous or 0)
+        if previous is None:
+            self.counts[row] += 1
+        self.scores[row] = (int(self.totals[row]) / int(self.counts[row])) / 5.0
+
+    def for_catalog(self, catalog, added=(), removed=()):
+        """A copy for ``catalog``, an ``updated`` version of this index's catalog.
+
+        Totals of ``removed`` ids move to ``others`` and those of ``added``
+        ids move from ``others`` onto their new rows.
+        """
+        index = RatingIndex(catalog)
+        n = len(self.totals)
+        index.totals[:n] = self.totals
+        index.counts[:n] = self.counts
+        index.scores[:n] = self.scores
+        index.others = {dest_id: list(total_count) for dest_id, total_count in self.others.items()}
+        for dest_id in removed:
+            row = self.catalog.row_of.get(dest_id)
+            if row is not None and self.counts[row]:
+                index.others[dest_id] = [int(self.totals[row]), int(self.counts[row])]
+            if row is not None:
+                index.totals[row] = index.counts[row] = 0
+                index.scores[row] = 1.0
+        for dest_id in added:
+            total, count = index.others.pop(dest_id, (0, 0))
+            if count:
+                row = catalog.row_of[dest_id]
+                index.totals[row], index.counts[row] = total, count
+                index.scores[row] = (total / count) / 5.0
+        return index
+
+    def average(self, dest_id):
+        """Average star rating of a destination, or None if nobody rated it."""
+        row = self.catalog.row_of.get(dest_id)
+        if row is None:
+            total, count = self.others.get(dest_id, (0, 0))
+        else:
+            total, count = int(self.totals[row]), int(self.counts[row])
+        return total / count if count else None
+
+
+RATING_INDEX = RatingIndex(CATALOG)
+
+
+RECOMMENDATION_CACHE = RecommendationCache()
+
+
+def scored_candidates(prefs):
+    """Every candidate for ``prefs`` scored, served from RECOMMENDATION_CACHE when possible."""
+    ensure_users()
+    _, weather = travel_weather(prefs)
+    catalog, rating_scores = CATALOG, RATING_INDEX.scores
+    candidates = RECOMMENDATION_CACHE.get_or_score(catalog, prefs, weather, rating_scores)
+    return candidates if candidates is not None else catalog.score_candidates(prefs, weather, rating_scores)
+
+
+ITEM_NEIGHBORS = ItemNeighbors(CATALOG.ids)
+
+
+def _leaderboard_boards(dest_id):
+    """The ``(type, region, budget bucket)`` boards listing ``dest_id``; bucket bounds are inclusive."""
+    catalog = CATALOG
+    row = catalog.row_of.get(dest_id)
+    if row is None:
+        return ()
+    dest = catalog.records[row]
+    return [(dest["type"].lower(), dest["region"].lower(), key) for key in budget_keys(dest["price"])]
+
+
+# Top-rated and trending boards, rebuilt by load_users and updated by apply_rating.
+LEADERBOARDS = Leaderboards(_leaderboard_boards)
+
+
+def predicted_ratings(personal_ratings):
+    ensure_users()
+    with METRICS.stage("rating"):
+        return ITEM_NEIGHBORS.predict(personal_ratings)
+
+
+# TRAVEL_SCORE_TABLES names tables written by score_tables.py for the active catalog.
+SCORE_TABLES_PATH = os.environ.get("TRAVEL_SCORE_TABLES")
+SCORE_TABLES = None
+
+
+def score_tables():
+    """The precomputed score tables if they match the active catalog, else None."""
+    global SCORE_TABLES, SCORE_TABLES_PATH
+    if SCORE_TABLES is None and SCORE_TABLES_PATH:
+        try:
+            SCORE_TABLES = ScoreTables.load(SCORE_TABLES_PATH, CATALOG)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Score tables not used: {e}")
+            SCORE_TABLES_PATH = None
+    if SCORE_TABLES is not None and SCORE_TABLES.catalog is CATALOG:
+        return SCORE_TABLES
+    return None
+
+
+# Held while one of the indexes below is built on first use.
+_INDEX_BUILD_LOCK = threading.Lock()
+
+
+def _lazy_index(name, build):
+    """The module-level index ``name``, built by ``build(catalog)`` on first use.
+
+    A built index is read without locking. Builds read one catalog version,
+    which reloads never change, so they do not hold up reload_catalog; the
+    index is installed only if that version is still the active one, and
+    is then kept in step by reload_catalog.
+    """
+    index = globals()[name]
+    if index is not None:
+        return index
+    with _INDEX_BUILD_LOCK:
+        index = globals()[name]
+        if index is None:
+            catalog = CATALOG
+            with METRICS.stage(f"{name.lower()}_build"):
+                index = build(catalog)
+            with _CATALOG_LOCK:
+                if catalog is CATALOG:
+                    globals()[name] = index
+    return index
+
+
+# Tag-similarity index, built on the first similarity query and kept in step by reload_catalog.
+TAG_INDEX = None
+
+
+def tag_index():
+    return _lazy_index("TAG_INDEX", TagIndex.from_catalog)
+
+
+def _similar_results(rows, sims):
+    # The catalog is read after the query, so it is at least as new as the
+    # index; rows are stable across reloads, but removed ones are skipped.
+    catalog = CATALOG
+    results = []
+    for row, sim in zip(rows.tolist(), sims.tolist()):
+        dest_id = catalog.ids[row] if row < len(catalog.ids) else None
+        if catalog.row_of.get(dest_id) != row:
+            continue
+        dest = catalog.records[row]
+        results.append({"id": dest_id, "name": dest["name"], "location": dest["location"],
+                        "tags": dest["tags"], "similarity": round(sim, 4)})
+    return results
+
+
+def similar_destinations(dest_id, k=5):
+    """Up to ``k`` destinations whose tags are most like those of ``dest_id``, most similar first."""
+    index = tag_index()
+    row = CATALOG.row_of.get(dest_id)
+    if row is None:
+        raise KeyError(dest_id)
+    with METRICS.stage("similar"):
+        return _similar_results(*index.similar(row, k))
+
+
+def search_by_tags(tags, k=5):
+    """Up to ``k`` destinations nearest (by cosine) to a ``{tag: weight}`` query."""
+    if not isinstance(tags, dict) or not tags:
+        raise ValueError("tags must be a non-empty {tag: weight} object")
+    for tag, weight in tags.items():
+        if not isinstance(tag, str) or isinstance(weight, bool) or not isinstance(weight, (int, float)) \
+                or weight < 0:
+            raise ValueError("tag weights must be non-negative numbers")
+    index = tag_index()
+    with METRICS.stage("similar"):
+        return _similar_results(*index.query({tag.lower(): weight for tag, weight in tags.items()}, k))
+
+
+# Facet bitsets for catalog browsing, built on the first count and kept in step by reload_catalog.
+FACET_INDEX = None
+
+
+def facet_index():
+    return _lazy_index("FACET_INDEX", FacetIndex)
+
+
+def facet_counts(selection=None):
+    """Destinations matching a partial ``{facet: [values]}`` selection, and per-value counts.
+
+    Returns ``{"total": n, "facets": {facet: {value: count}}}``; see
+    ``FacetIndex`` for how selections combine.
+    """
+    index = facet_index()
+    with METRICS.stage("facets"):
+        total, counts = index.counts(selection)
+    return {"total": total, "facets": counts}
+
+
+# Spatial index over destination coordinates, built on the first nearby query and kept in step by reload_catalog.
+GEO_INDEX = None
+
+
+def geo_index():
+    return _lazy_index("GEO_INDEX", SpatialIndex.from_catalog)
+
+
+def _near_query(near, radius_required=False):
+    """``(lat, lon, radius_km, row)`` of a ``near`` query; ``row`` is the dest_id's own row, if given."""
+    if not isinstance(near, dict):
+        raise ValueError("near must be an object")
+    row = None
+    if near.get("exclude") is not None:
+        row = CATALOG.row_of.get(near["exclude"])
+    if near.get("dest_id") is not None:
+        row = CATALOG.row_of.get(near["dest_id"])
+        if row is None:
+            raise KeyError(near["dest_id"])
+        lat, lon = float(CATALOG.lat[row]), float(CATALOG.lon[row])
+        if np.isnan(lat) or np.isnan(lon):
+            raise ValueError(f"destination {near['dest_id']} has no coordinates")
+    else:
+        lat, lon = near.get("lat"), near.get("lon")
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+                   for value in (lat, lon)):
+            raise ValueError("near needs a dest_id or finite numeric lat and lon")
+    radius_km = near.get("radius_km")
+    if radius_km is None and radius_required:
+        raise ValueError("radius_km is required")
+    if radius_km is not None and (isinstance(radius_km, bool) or not isinstance(radius_km, (int, float))
+                                  or not 0 < radius_km <= 20_000):
+        raise ValueError("radius_km must be a number between 0 and 20000")
+    return lat, lon, radius_km, row
+
+
+def resolve_near(near, radius_required=False):
+    """``near`` as a point: a dest_id is replaced by its coordinates.
+
+    The dest_id is kept as ``exclude``, so it is still left out of the
+    results, but a query with the resolved ``near`` no longer fails if the
+    destination is removed in the meantime. Raises KeyError for an unknown
+    dest_id and ValueError for a malformed query.
+    """
+    lat, lon, radius_km, _ = _near_query(near, radius_required)
+    resolved = {"lat": lat, "lon": lon, "radius_km": radius_km}
+    if near.get("dest_id") is not None:
+        resolved["exclude"] = near["dest_id"]
+    return resolved
+
+
+def nearby_destinations(near, k=5):
+    """Up to ``k`` destinations nearest to a point, nearest first.
+
+    ``near`` is ``{"dest_id": ...}`` or ``{"lat": ..., "lon": ...}`` in
+    degrees, optionally with ``radius_km`` to leave out anything farther.
+    A dest_id's own entry is not returned. Raises KeyError for an unknown
+    dest_id and ValueError for a malformed query.
+    """
+    lat, lon, radius_km, own_row = _near_query(near)
+    index = geo_index()
+    with METRICS.stage("nearby"):
+        if radius_km is None:
+            rows, km = index.nearest(lat, lon, k + (own_row is not None))
+        else:
+            rows, km = index.radius(lat, lon, radius_km)
+    # As in _similar_results, rows removed by a concurrent reload are skipped.
+    catalog = CATALOG
+    results = []
+    for row, distance in zip(rows.tolist(), km.tolist()):
+        dest_id = catalog.ids[row] if row < len(catalog.ids) else None
+        if row == own_row or catalog.row_of.get(dest_id) != row:
+            continue
+        dest = catalog.records[row]
+        results.append({"id": dest_id, "name": dest["name"], "location": dest["location"],
+                        "lat": dest["lat"], "lon": dest["lon"], "distance_km": round(distance, 1)})
+        if len(results) == k:
+            break
+    return results
+
+
+def recommendation_cursor(prefs, personal_ratings=None, near=None):
+    """A ``RecommendationCursor`` over every candidate for ``prefs``, best first.
+
+    The first pages come from the score tables when they cover ``prefs``.
+    Otherwise a pool held by RECOMMENDATION_CACHE is paged in place, or
+    each page is scored from the catalog chunk by chunk, so a query holds
+    no more than a page and a chunk.
+
+    With ``near`` (as for ``nearby_destinations``, but ``radius_km`` is
+    required) only candidates within the radius qualify, and
+    PROXIMITY_WEIGHT of each score goes to how close they are. Those rows
+    are scored once, when the cursor is made.
+    """
+    ensure_users()
+    _, weather = travel_weather(prefs)
+    catalog, rating_scores = CATALOG, RATING_INDEX.scores
+    predicted = predicted_ratings(personal_ratings)
+    if near is None:
+        tables, head = score_tables(), None
+        if tables is not None and tables.catalog is catalog:
+            head = tables.head(prefs, weather, rating_scores, personal_ratings, predicted)
+        # Pages past the tables' depth are rare enough to stream rather than cache.
+        if head is None:
+            candidates = RECOMMENDATION_CACHE.get_or_score(catalog, prefs, weather, rating_scores)
+            if candidates is not None:
+                return candidates.cursor(personal_ratings, predicted)
+        return catalog.cursor(prefs, weather, rating_scores, personal_ratings, predicted, head)
+    lat, lon, radius_km, own_row = _near_query(near, radius_required=True)
+    index = geo_index()
+    with METRICS.stage("rating"):
+        personal = catalog.personal_scores(personal_ratings, predicted)
+    with METRICS.stage("nearby"):
+        rows, km = index.radius(lat, lon, radius_km)
+        # The index may already hold rows a concurrent reload appended.
+        keep = (rows != own_row) & (rows < len(catalog))
+        rows, km = rows[keep], km[keep]
+        keep = catalog.are_candidates(rows, prefs)
+        rows, km = rows[keep], km[keep]
+    scores = catalog.score(rows, prefs, weather, rating_scores, personal)
+    with METRICS.stage("nearby"):
+        scores = (1 - PROXIMITY_WEIGHT) * scores + PROXIMITY_WEIGHT * 100 * (1 - km / radius_km)
+        scores = np.minimum(100, np.rint(scores)).astype(np.int64)
+    return RecommendationCursor(catalog, prefs, weather, lambda: [(rows, scores, km)], len(rows))
+
+
+def group_recommendations(usernames, strategy="average", k=3):
+    """Top ``k`` destinations for a group of users, without any console I/O.
+
+    All members' preferences and ratings are scored in one batched pass
+    (see ``CompiledCatalog.group_top_k``). Each result's ``member_scores``
+    reveals how well it fits every member, so callers serving several users
+    should show members only their own. Raises KeyError for an unknown
+    user, ValueError for a member without preferences or an unknown
+    strategy.
+    """
+    ensure_users()
+    usernames = list(dict.fromkeys(usernames))
+    if not usernames:
+        raise ValueError("a group needs at least one member")
+    catalog = CATALOG
+    members = []
+    for username in usernames:
+        user = USERS[username]
+        prefs = user.get("preferences")
+        if not prefs:
+            raise ValueError(f"{username} has not set preferences yet")
+        ratings = dict(user["ratings"])
+        _, weather = travel_weather(prefs)
+        members.append((prefs, weather, catalog.personal_scores(ratings, predicted_ratings(ratings))))
+    with METRICS.stage("group_recommend"):
+        picks = catalog.group_top_k(members, RATING_INDEX.scores, strategy, k)
+    aggregate = {"average": lambda scores: round(sum(scores) / len(scores), 1),
+                 "least_misery": min, "most_pleasure": max}[strategy]
+    results = []
+    for row, scores in picks:
+        dest = catalog.records[row]
+        results.append({
+            "id": catalog.ids[row],
+            "name": dest["name"],
+            "location": dest["location"],
+            "type": dest["type"],
+            "price": dest["price"],
+            "score": aggregate(scores),
+            "member_scores": dict(zip(usernames, scores)),
+        })
+    return results
+
+
+def top_destinations(kind="top_rated", trip_type=None, region=None, budget=None, n=10):
+    """The best ``n`` destinations of a leaderboard, without any console I/O.
+
+    ``kind`` is "top_rated" (damped average stars) or "trending"
+    (popularity with a one-week half-life). ``trip_type``, ``region`` and
+    ``budget`` (one of BUDGET_KEYS) narrow the board; None means
+    any. Reads only the leaderboards and the catalog, never the users.
+    """
+    if kind not in LEADERBOARD_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(LEADERBOARD_KINDS)}")
+    if budget is not None and budget.lower() not in BUDGET_KEYS:
+        raise ValueError(f"budget must be one of {', '.join(BUDGET_KEYS)}")
+    ensure_users()
+    pattern = tuple(None if value is None else value.lower() for value in (trip_type, region, budget))
+    with METRICS.stage("leaderboard"):
+        if kind == "top_rated":
+            entries = [(dest_id, {"average_rating": round(average, 2), "ratings": count})
+                       for dest_id, average, count in LEADERBOARDS.top_rated(pattern, n)]
+        else:
+            entries = [(dest_id, {"popularity": round(popularity, 4)})
+                       for dest_id, popularity in LEADERBOARDS.trending(pattern, n)]
+    catalog = CATALOG
+    results = []
+    for dest_id, fields in entries:
+        row = catalog.row_of.get(dest_id)
+        if row is None:  # removed by a reload since the read
+            continue
+        dest = catalog.records[row]
+        results.append({"id": dest_id, "name": dest["name"], "location": dest["location"], "type": dest["type"],
+                        "region": dest["region"], "price": dest["price"], **fields})
+    return results
+
+
+def plan_itinerary(prefs, personal_ratings=None, max_stops=3, distinct_regions=False, budget=None):
+    """Best multi-stop trip for ``prefs`` within a total budget, without any console I/O.
+
+    Stops are scored as in ``recommend``, but any destination up to the
+    budget qualifies: the lower end of the price range is for single
+    picks, not for a trip's total. ``budget`` defaults to the upper end.
+    With ``distinct_regions`` every stop is in a different region.
+    """
+    ensure_users()
+    budget = prefs["budget"]["price_range"][1] if budget is None else budget
+    trip_prefs = dict(prefs, budget=dict(prefs["budget"], price_range=[0, budget]))
+    with METRICS.stage("itinerary"):
+        candidates = scored_candidates(trip_prefs)
+        scores = candidates.personalized(personal_ratings, predicted_ratings(personal_ratings))
+        catalog, rows = candidates.catalog, candidates.rows
+        regions = None
+        if distinct_regions:
+            regions = np.zeros(len(rows), dtype=np.int64)
+            for code, region_rows in enumerate(catalog.index.postings["region"].values()):
+                regions[np.isin(rows, region_rows)] = code
+        picked, exact = itinerary.plan(scores, catalog.price[rows], budget, max_stops, regions)
+    stops = []
+    for i in picked:
+        stop = catalog.recommendation(int(rows[i]), int(scores[i]), prefs, candidates.weather)
+        stop["region"] = catalog.records[int(rows[i])]["region"]
+        stops.append(stop)
+    return {
+        "stops": stops,
+        "total_price": sum(stop["price"] for stop in stops),
+        "total_score": sum(stop["score"] for stop in stops),
+        "budget": budget,
+        # False when the budget was too fine-grained to plan at one-dollar resolution.
+        "exact": exact,
+    }
+
+
+def recommend(prefs, personal_ratings=None, k=3, near=None):
+    """Top ``k`` recommendations for a preferences dict, without any console I/O.
+
+    ``near`` limits them to a radius around a point and favours the closer
+    ones; see ``recommendation_cursor``.
+    """
+    with METRICS.stage("recommend"):
+        return recommendation_cursor(prefs, personal_ratings, near).next_page(k)
+
+
+def apply_rating(username, dest_id, rating, previous=None, ts=None):
+    """Propagate a stored rating (made at Unix time ``ts``) to the indexes, leaderboards and result cache."""
+    with _CATALOG_LOCK:
+        RATING_INDEX.record(dest_id, rating, previous)
+        LEADERBOARDS.record(dest_id, rating, previous, time.time() if ts is None else ts)
+        ITEM_NEIGHBORS.update(username, dest_id, rating, previous, USERS[username]["ratings"])
+        if dest_id in DESTINATIONS:
+            RECOMMENDATION_CACHE.invalidate_destination(DESTINATIONS[dest_id])
+
+
+def install_catalog(destinations, users=None):
+    """Make ``destinations`` the active catalog and rebuild what derives from it.
+
+    ``destinations`` is a destinations dict or an already compiled catalog
+    (such as ``CompiledCatalog.from_file``). Pass ``users`` to rebuild the
+    rating index and neighbours right away; otherwise ``load_users`` does it.
+    """
+    global DESTINATIONS, CATALOG, RATING_INDEX, ITEM_NEIGHBORS, TAG_INDEX, FACET_INDEX, GEO_INDEX
+    if not isinstance(destinations, CompiledCatalog):
+        destinations = CompiledCatalog(destinations)
+    with _CATALOG_LOCK:
+        CATALOG = destinations
+        DESTINATIONS = CATALOG.destinations
+        RATING_INDEX = RatingIndex(CATALOG)
+        ITEM_NEIGHBORS = ItemNeighbors(CATALOG.ids)
+        TAG_INDEX = None
+        FACET_INDEX = None
+        GEO_INDEX = None
+    RECOMMENDATION_CACHE.clear()
+    if users is not None:
+        RATING_INDEX.rebuild(users)
+        ITEM_NEIGHBORS.fit(users)
+        LEADERBOARDS.rebuild(*rating_events(users))
+    else:
+        LEADERBOARDS.refile()
+
+
+def refresh_catalog_file(users=None):
+    """Reopen the catalog file if it has been replaced since it was opened.
+
+    Returns True when a new version was installed. ``users`` defaults to the
+    loaded user store, so the rating index and neighbours follow.
+    """
+    if CATALOG.source is None or not CATALOG.source.changed():
+        return False
+    if users is None and not (isinstance(USERS, LazyUsers) and not USERS.loaded):
+        users = USERS
+    install_catalog(CompiledCatalog.from_file(CATALOG.source.path), users)
+    return True
+
+
+def reload_catalog():
+    """Apply changes made to the catalog source since it was last read.
+
+    Only added, modified and removed entries are re-encoded and re-indexed.
+    The new catalog is built next to the live one and swapped in by a few
+    reference assignments, so requests already running finish on the
+    version they started with. Returns the number of entries applied.
+    Destinations added here get neighbours from ratings made after they
+    appear; older ratings of them join at the next ``load_users``.
+    """
+    global CATALOG, DESTINATIONS, RATING_INDEX
+    if CATALOG_SOURCE is None:
+        return len(CATALOG) if refresh_catalog_file() else 0
+    with _RELOAD_LOCK:
+        if not CATALOG_SOURCE.changed():
+            return 0
+        upserts, removed = CATALOG_SOURCE.diff()
+        if not upserts and not removed:
+            return 0
+        previous = CATALOG
+        with METRICS.stage("catalog_reload"):
+            catalog = previous.updated(upserts, removed)
+        added = [dest_id for dest_id in upserts if dest_id not in previous.row_of]
+        changed = [previous.destinations[dest_id] for dest_id in removed]
+        changed += [previous.destinations[dest_id] for dest_id in upserts if dest_id in previous.row_of]
+        changed += list(upserts.values())
+        with _CATALOG_LOCK:
+            RATING_INDEX = RATING_INDEX.for_catalog(catalog, added, removed)
+            ITEM_NEIGHBORS.extend(added)
+            if TAG_INDEX is not None:
+                TAG_INDEX.remove([previous.row_of[dest_id] for dest_id in removed])
+                TAG_INDEX.add([catalog.row_of[dest_id] for dest_id in upserts],
+                              [dest["tags"] for dest in upserts.values()])
+            rows = [previous.row_of[dest_id] for dest_id in removed]
+            rows += [catalog.row_of[dest_id] for dest_id in upserts]
+            if FACET_INDEX is not None:
+                FACET_INDEX.update(catalog, rows)
+            if GEO_INDEX is not None:
+                GEO_INDEX.update(catalog, rows)
+            CATALOG, DESTINATIONS = catalog, catalog.destinations
+            LEADERBOARDS.refile(list(removed) + list(upserts))
+            RECOMMENDATION_CACHE.catalog_updated(previous, catalog, changed)
+        METRICS.count("catalog_entries_reloaded", len(upserts) + len(removed))
+        return len(upserts) + len(removed)
+
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+# Tokens of logged-in users (token -> username) and the threads that check passwords.
+SESSIONS = SessionTable()
+PASSWORDS = PasswordVerifier(hash_password)
+
+
+def validate_preferences(prefs):
+    """Check that ``prefs`` has the shape written by ``set_preferences``.
+
+    Raises ValueError describing the first problem found.
+    """
+    if not isinstance(prefs, dict):
+        raise ValueError("preferences must be an object")
+    for key, kind in (("trip_type", str), ("budget", dict), ("activities", list),
+                      ("accommodation", str), ("cuisine", list), ("travel_season", str)):
+        if not isinstance(prefs.get(key), kind):
+            raise ValueError(f"preferences.{key} must be a {kind.__name__}")
+    price_range = prefs["budget"].get("price_range")
+    if not (isinstance(price_range, (list, tuple)) and len(price_range) == 2
+            and all(isinstance(p, (int, float)) for p in price_range)):
+        raise ValueError("preferences.budget.price_range must be [min, max]")
+    if not all(isinstance(v, str) for v in prefs["activities"] + prefs["cuisine"]):
+        raise ValueError("activities and cuisines must be strings")
+
+
+def normalize_user(record):
+    """Bring a users.json record from an older version of the app to the current shape.
+
+    Old records keep their answers under ``prefs``, with the budget as a
+    bare "low"/"medium"/"high" and possibly a misspelt trip type, and lack
+    the fields added since. Current records are returned unchanged.
+    """
+    if "prefs" not in record:
+        return record
+    record = dict(record)
+    prefs = dict(record.pop("prefs") or {})
+    trip_type = str(prefs.get("trip_type", "")).lower()
+    known_types = [t.lower() for t in TRIP_TYPES]
+    match = difflib.get_close_matches(trip_type, known_types, n=1)
+    prefs["trip_type"] = match[0] if match else trip_type
+
+    budget = prefs.get("budget")
+    if not isinstance(budget, dict):
+        match = difflib.get_close_matches(str(budget or "").lower(), BUDGET_KEYS, n=1)
+        i = BUDGET_KEYS.index(match[0]) if match else BUDGET_KEYS.index("medium")
+        prefs["budget"] = {"choice": BUDGET_CHOICES[i].lower(), "price_range": list(BUDGET_RANGES[i])}
+
+    prefs["activities"] = [str(act).lower() for act in prefs.get("activities") or []]
+    prefs.setdefault("accommodation", "")
+    prefs["cuisine"] = [str(c).lower() for c in prefs.get("cuisine") or []]
+    prefs.setdefault("travel_season", "summer")
+    record["preferences"] = prefs
+    record.setdefault("ratings", {})
+    return record
+
+
+# Set TRAVEL_USERS_DB to keep users in SQLite instead of users.json.
+USERS_DB_PATH = os.environ.get("TRAVEL_USERS_DB")
+
+
+def open_user_store():
+    """The configured user store; a new SQLite store is first filled from users.json."""
+    if not USERS_DB_PATH:
+        return JournaledUserStore('users.json', 'users.journal', normalize=normalize_user)
+    store = SQLiteUserStore(USERS_DB_PATH)
+    pending = os.path.exists('users.journal') and os.path.getsize('users.journal')
+    if (os.path.exists('users.json') or pending) and not store.imported('users.json'):
+        if pending:
+            # Fold pending journal entries into users.json so the import sees them.
+            journaled = JournaledUserStore('users.json', 'users.journal', normalize=normalize_user)
+            journaled.compact()
+            journaled.close()
+        store.import_json('users.json', normalize_user)
+    return store
+
+
+def load_users():
+    """Open the user store and build the rating index and neighbours from it.
+
+    Each is one pass over the ratings. The rating index and leaderboards
+    keep per-destination state only, but the neighbours keep every rating
+    (see ``ItemNeighbors``), so even with a SQLite store their memory grows
+    with the number of ratings.
+    """
+    with METRICS.stage("load_users"):
+        users = open_user_store()
+        RATING_INDEX.rebuild(users)
+        ITEM_NEIGHBORS.fit(users)
+        LEADERBOARDS.rebuild(*rating_events(users))
+    return users
+
+
+class LazyUsers(Mapping):
+    """Stand-in for the user store that opens it on first use.
+
+    Startup stays fast no matter how large users.json is: nothing is parsed
+    until a user is looked up or a recommendation needs the rating index.
+    Attribute access (``register``, ``rate``, ...) is forwarded to the store.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._store = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._store is not None
+
+    def load(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = self._loader()
+        return self._store
 
+    def __getitem__(self, username):
+        return self.load()[username]
 
-USERS = load_users()
+    def __contains__(self, username):
+        return username in self.load()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+def ensure_users():
+    """Open the user store now if that hasn't happened yet; the rating index depends on it."""
+    if isinstance(USERS, LazyUsers):
+        USERS.load()
+
+
+USERS = LazyUsers(load_users)
 
 
 class TravelCompanion:
-    def __init__(self):
+    def __init__(self, top_k=3):
         self.current_user = None
+        self.top_k = top_k
         self.last_recommendations = []
+        self.cursor = None
+        self.session_token = None
 
     def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
+        return hash_password(password)
+
+    def _start_session(self, username):
+        self.current_user = username
+        self.session_token = SESSIONS.issue(username)
+
+    def resume_session(self, token):
+        """Log in with a token from an earlier login instead of the password."""
+        username = SESSIONS.get(token)
+        if username is None or username not in USERS:
+            return False
+        self.current_user = username
+        self.session_token = token
+        return True
+
+    def logout(self):
+        if self.session_token is not None:
+            SESSIONS.revoke(self.session_token)
+        self.current_user = None
+        self.session_token = None
+        self.last_recommendations = []
+        self.cursor = None
 
     def register_user(self):
         print("\n" + "=" * 20)
@@ -393,13 +2507,8 @@ class TravelCompanion:
 
         password = input("Choose a password: ").strip()
 
-        USERS[username] = {
-            "password": self.hash_password(password),
-            "preferences": None,
-            "ratings": {}
-        }
-        self.save_users()
-        self.current_user = username
+        USERS.register(username, PASSWORDS.hash(password).result())
+        self._start_session(username)
         print(f"\nWelcome, {username}! Let's set your travel preferences.")
         self.set_preferences()
         return True
@@ -412,14 +2521,14 @@ class TravelCompanion:
         username = input("Username: ").strip()
         password = input("Password: ").strip()
 
-        if username in USERS:
-            if USERS[username]["password"] == self.hash_password(password):
-                self.current_user = username
-                print(f"\nWelcome back, {username}!")
-                if not USERS[username]["preferences"]:
-                    print("Please complete your travel preferences first.")
-                    self.set_preferences()
-                return True
+        user = USERS.get(username)
+        if PASSWORDS.verify(user["password"] if user else None, password):
+            self._start_session(username)
+            print(f"\nWelcome back, {username}!")
+            if not user["preferences"]:
+                print("Please complete your travel preferences first.")
+                self.set_preferences()
+            return True
 
         print("\nInvalid credentials or user doesn't exist.")
         return False
@@ -431,18 +2540,17 @@ class TravelCompanion:
 
         print("We'll ask a few questions to personalize your experience:\n")
 
-        trip_type = self._ask_multichoice("What type of trip do you prefer?",
-                                          ["Beach", "Mountain", "City"])
+        trip_type = self._ask_multichoice("What type of trip do you prefer?", TRIP_TYPES)
 
         preferences = {
             "trip_type": trip_type,
             "budget": self._ask_multichoice("What's your budget range?",
-                                            ["Low ($0-$300)", "Medium ($300-$500)", "High ($500+)"],
-                                            prices=[(0, 300), (300, 500), (500, 9999)]),
+                                            BUDGET_CHOICES,
+                                            prices=BUDGET_RANGES),
             "activities": self._ask_activities(trip_type.lower()),
             "accommodation": self._ask_multichoice(
                 "Preferred accommodation type:",
-                ["Hotel", "Villa", "Apartment"]
+                ACCOMMODATIONS
             ),
             "cuisine": self._ask_cuisines(),
             "travel_season": None  # Will be set below
@@ -454,11 +2562,10 @@ class TravelCompanion:
         print("=" * 20 + "\n")
         preferences["travel_season"] = self._ask_multichoice(
             "When are you planning to travel?",
-            ["Summer", "Winter", "Spring", "Fall"]
+            TRAVEL_SEASONS
         ).lower()
 
-        USERS[self.current_user]["preferences"] = preferences
-        self.save_users()
+        USERS.set_preferences(self.current_user, preferences)
         print("\nPreferences saved successfully!")
 
     def _ask_multichoice(self, question, options, prices=None):
@@ -479,14 +2586,8 @@ class TravelCompanion:
                 print("Please enter a number.")
 
     def _ask_activities(self, trip_type):
-        activity_groups = {
-            "beach": ["Surfing", "Snorkeling", "Spa"],
-            "mountain": ["Skiing", "Snowboarding", "Mountain climbing"],
-            "city": ["Shopping", "Museums", "City tours"]
-        }
-
         print("\nSelect activities (enter numbers separated by spaces):")
-        activities = activity_groups[trip_type]
+        activities = ACTIVITY_GROUPS[trip_type]
 
         for i, activity in enumerate(activities, 1):
             print(f"{i}. {activity}")
@@ -503,10 +2604,7 @@ class TravelCompanion:
                 print("Invalid selection. Try again.")
 
     def _ask_cuisines(self):
-        cuisines = [
-            "Local", "Vegetarian", "Seafood",
-            "Street food", "Meat", "Vegan"
-        ]
+        cuisines = CUISINES
 
         print("\nSelect cuisines (enter numbers separated by spaces):")
         for i, cuisine in enumerate(cuisines, 1):
@@ -523,7 +2621,8 @@ class TravelCompanion:
             except (ValueError, IndexError):
                 print("Invalid selection. Try again.")
 
-    def get_recommendations(self):
+    def get_recommendations(self, near=None):
+        """Show the first page of recommendations, limited to ``near`` if given (see ``recommend``)."""
         print("\n" + "=" * 20)
         print(" TRAVEL RECOMMENDATIONS")
         print("=" * 20 + "\n")
@@ -533,106 +2632,41 @@ class TravelCompanion:
             return
 
         user_prefs = USERS[self.current_user]["preferences"]
-
-        # Get the stored travel season
-        season = user_prefs.get("travel_season", "summer")  # default to summer if not set
-
-        weather_map = {
-            "summer": "sunny",
-            "winter": "snowy",
-            "spring": "mild",
-            "fall": "rainy"
-        }
-        weather = weather_map.get(season.lower(), "mild")
+        season, weather = travel_weather(user_prefs)
 
         print(f"\nSearching for {weather} weather options (for {season.capitalize()} travel)...\n")
 
-        recommendations = []
-        budget_min, budget_max = user_prefs["budget"]["price_range"]
-
-        for dest_id, dest in DESTINATIONS.items():
-            # Initial filtering
-            if not (budget_min <= dest["price"] <= budget_max):
-                continue
-            if dest["type"] != user_prefs["trip_type"]:
-                continue
-
-            # ACTIVITY MATCHING
-            user_activities = set(act.lower() for act in user_prefs["activities"])
-            dest_activities = set(act.lower() for act in dest["activities"])
-            matched_activities = list(user_activities & dest_activities)
-
-            if not matched_activities and dest["activities"]:
-                matched_activities = [dest["activities"][0].lower()]
-            if not matched_activities:
-                continue
-
-            # Other preference matching
-            common_cuisines = set(user_prefs["cuisine"]) & set([c.lower() for c in dest["cuisines"]])
-            matching_accom = user_prefs["accommodation"] in dest["accommodation"]
-
-            # Must match at least one preference category
-            if not (matched_activities or common_cuisines or matching_accom):
-                continue
-
-            # Scoring
-            activity_score = len(matched_activities) / max(1, len(user_prefs["activities"]))
-            cuisine_score = len(common_cuisines) / max(1, len(user_prefs["cuisine"]))
-            accom_score = 1.0 if matching_accom else 0.5
-            weather_boost = 1.5 if weather in dest["ideal_weather"] else 0.8
-
-            # Rating score
-            rating_score = 1.0
-            if dest_id in USERS[self.current_user]["ratings"]:
-                rating_score = USERS[self.current_user]["ratings"][dest_id] / 5.0
-            elif any(dest_id in user["ratings"] for user in USERS.values()):
-                total_ratings = sum(user["ratings"].get(dest_id, 0) for user in USERS.values())
-                rating_count = sum(1 for user in USERS.values() if dest_id in user["ratings"])
-                rating_score = (total_ratings / rating_count) / 5.0
-
-            # Final score
-            total_score = (
-                    0.25 * activity_score +
-                    0.25 * cuisine_score +
-                    0.2 * weather_boost +
-                    0.15 * accom_score +
-                    0.15 * rating_score
-            )
-
-            recommendations.append({
-                "id": dest_id,
-                "name": dest["name"],
-                "location": dest["location"],
-                "score": min(100, round(total_score * 100)),
-                "price": dest["price"],
-                "weather": "Ideal" if weather in dest["ideal_weather"] else "Good",
-                "matched_activities": matched_activities,
-                "matched_cuisines": list(common_cuisines),
-                "accommodation": dest["accommodation"]
-            })
+        # The cursor remembers what was shown, so more pages can be shown later.
+        ratings = USERS[self.current_user]["ratings"]
+        with METRICS.stage("recommend"):
+            self.cursor = recommendation_cursor(user_prefs, ratings, near)
+            recommendations = self.cursor.next_page(self.top_k)
 
         if not recommendations:
             print("\nNo destinations match your criteria. Try adjusting preferences.")
             return
 
-        recommendations.sort(key=lambda x: x["score"], reverse=True)
-        self.last_recommendations = recommendations[:3]
+        self.last_recommendations = recommendations
 
         print("\n" + "=" * 20)
         print(" TOP RECOMMENDATIONS")
         print("=" * 20 + "\n")
 
-        for i, rec in enumerate(self.last_recommendations, 1):
-            ratings = [user["ratings"].get(rec["id"], 0) for user in USERS.values()
-                       if rec["id"] in user["ratings"]]
+        with METRICS.stage("render"):
+            self._print_recommendations(self.last_recommendations, season)
+
+    def _print_recommendations(self, recommendations, season, start=1):
+        for i, rec in enumerate(recommendations, start):
+            avg_rating = RATING_INDEX.average(rec["id"])
 
             print(f"{i}. {rec['name']} ({rec['location']})")
             print(f"   Match Score: {rec['score']}%")
             print(f"   Price: ${rec['price']}")
-            if ratings:
-                avg_rating = sum(ratings) / len(ratings)
+            if avg_rating is not None:
                 print(f"   Rating: {avg_rating:.1f}/5")
             print(f"   Weather: {rec['weather']} for {season.capitalize()}")
+            if "distance_km" in rec:
+                print(f"   Distance: {rec['distance_km']} km")
             print(f"   Activities: {', '.join(rec['matched_activities'])}")
             print(f"   Cuisines: {', '.join(rec['matched_cuisines']) if rec['matched_cuisines'] else '-'}")
             print(f"   Accommodation: {', '.join(rec['accommodation'])}")
@@ -656,7 +2690,10 @@ class TravelCompanion:
             print(f"{rec['id']}: {rec['name']} ({rec['location']})")
 
         while True:
-            dest_id = input("\nEnter destination ID to rate: ").strip()
+            dest_id = input("\nEnter destination ID to rate (or 'more' to see more destinations): ").strip()
+            if dest_id.lower() == "more":
+                self._show_more_recommendations()
+                continue
             if any(rec['id'] == dest_id for rec in self.last_recommendations):
                 break
             print("Invalid destination ID! Please choose from your recent recommendations.")
@@ -664,15 +2701,27 @@ class TravelCompanion:
         while True:
             rating = input("Your rating (1-5 stars): ").strip()
             if rating.isdigit() and 1 <= int(rating) <= 5:
-                USERS[self.current_user]["ratings"][dest_id] = int(rating)
-                self.save_users()
+                with METRICS.stage("rate"):
+                    rated_at = time.time()
+                    previous = USERS.rate(self.current_user, dest_id, int(rating), rated_at)
+                    apply_rating(self.current_user, dest_id, int(rating), previous, rated_at)
                 print("Rating saved successfully!")
                 return
             print("Please enter a number between 1-5")
 
+    def _show_more_recommendations(self):
+        page = self.cursor.next_page(self.top_k) if self.cursor else []
+        if not page:
+            print("No more destinations match your preferences.")
+            return
+        self.last_recommendations.extend(page)
+        for rec in page:
+            print(f"{rec['id']}: {rec['name']} ({rec['location']}) - Match Score: {rec['score']}%")
+
     def save_users(self):
-        with open('users.json', 'w') as f:
-            json.dump(USERS, f, indent=2)
+        # Mutations are journaled as they happen; this folds them into users.json.
+        with METRICS.stage("save_users"):
+            USERS.compact()
 
 
 def main():
@@ -718,6 +2767,7 @@ def main():
         elif choice == "3":
             app.rate_destination()
         elif choice == "4":
+            app.logout()
             print("\nLogged out successfully. Goodbye!")
             break
         else:
@@ -0,0 +1,162 @@
+"""Seeded synthetic catalogs and user bases in the app's own schemas.
+
+Destinations look like the entries of ``DESTINATIONS`` and users like the
+records in ``users.json``, so both can be fed straight into the app and the
+benchmarks. The same seed always produces the same data.
+
+Usage:
+    python synthetic_data.py --destinations 100000 --users 1000000 --out-dir data
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from smart_travel_app import (ACCOMMODATIONS, ACTIVITY_GROUPS, BUDGET_CHOICES, BUDGET_RANGES, CUISINES,
+                              TRAVEL_SEASONS, TRIP_TYPES)
+
+REGIONS = ["asia", "europe", "africa", "americas", "oceania"]
+COUNTRIES = {
+    "asia": ["Thailand", "Indonesia", "Japan", "Nepal", "Vietnam", "India"],
+    "europe": ["Portugal", "Greece", "France", "Austria", "Spain", "Poland"],
+    "africa": ["Tanzania", "Kenya", "Morocco", "South Africa", "Namibia"],
+    "americas": ["Mexico", "Peru", "Canada", "Brazil", "Chile"],
+    "oceania": ["Australia", "New Zealand", "Fiji"],
+}
+# Approximate centre (lat, lon) of each country; destinations scatter around it.
+COUNTRY_CENTRES = {
+    "Thailand": (15.9, 100.9), "Indonesia": (-2.5, 118.0), "Japan": (36.2, 138.3), "Nepal": (28.4, 84.1),
+    "Vietnam": (14.1, 108.3), "India": (20.6, 79.0), "Portugal": (39.4, -8.2), "Greece": (39.1, 21.8),
+    "France": (46.2, 2.2), "Austria": (47.5, 14.6), "Spain": (40.5, -3.7), "Poland": (51.9, 19.1),
+    "Tanzania": (-6.4, 34.9), "Kenya": (-0.02, 37.9), "Morocco": (31.8, -7.1), "South Africa": (-30.6, 22.9),
+    "Namibia": (-22.96, 18.5), "Mexico": (23.6, -102.6), "Peru": (-9.2, -75.0), "Canada": (56.1, -106.3),
+    "Brazil": (-14.2, -51.9), "Chile": (-35.7, -71.5), "Australia": (-25.3, 133.8),
+    "New Zealand": (-40.9, 174.9), "Fiji": (-17.7, 178.1),
+}
+IDEAL_WEATHER = {
+    "beach": [["sunny", "warm"]],
+    "mountain": [["cool", "dry"], ["snowy", "cold"], ["cool", "sunny"]],
+    "city": [["warm", "humid"], ["mild", "seasonal"], ["warm", "sunny"], ["warm", "dry"]],
+}
+EXTRA_TAGS = ["luxury", "backpacking", "cultural", "romantic", "wildlife", "historical", "scenic", "spiritual"]
+# Price bounds per budget tier: low, medium, high
+PRICE_TIERS = [(30, 299), (300, 500), (501, 1500)]
+
+
+def generate_catalog(n, seed=0):
+    """Return a destinations dict with ``n`` entries keyed ``d1`` .. ``dn``."""
+    rng = np.random.default_rng(seed)
+    # Coordinates come from their own stream, so the other fields match catalogs made without them.
+    geo_rng = np.random.default_rng([seed, 1])
+    types = [t.lower() for t in TRIP_TYPES]
+    destinations = {}
+    for i in range(1, n + 1):
+        trip_type = types[rng.integers(len(types))]
+        region = REGIONS[rng.integers(len(REGIONS))]
+        country = COUNTRIES[region][rng.integers(len(COUNTRIES[region]))]
+        low, high = PRICE_TIERS[rng.integers(len(PRICE_TIERS))]
+        group = ACTIVITY_GROUPS[trip_type]
+        extra_tag = EXTRA_TAGS[rng.integers(len(EXTRA_TAGS))]
+        weathers = IDEAL_WEATHER[trip_type]
+        lat, lon = np.array(COUNTRY_CENTRES[country]) + geo_rng.normal(0, 2.0, 2)
+        destinations[f"d{i}"] = {
+            "name": f"{country} {trip_type.capitalize()} Stay {i}",
+            "type": trip_type,
+            "region": region,
+            "location": country,
+            "lat": round(float(np.clip(lat, -90, 90)), 4),
+            "lon": round(float((lon + 180) % 360 - 180), 4),
+            "price": int(rng.integers(low, high + 1)),
+            "tags": {trip_type: round(float(rng.uniform(0.6, 1.0)), 2),
+                     extra_tag: round(float(rng.uniform(0.5, 1.0)), 2)},
+            "ideal_weather": list(weathers[rng.integers(len(weathers))]),
+            "activities": [group[j] for j in sorted(rng.choice(len(group), rng.integers(1, 3), replace=False))],
+            "accommodation": [ACCOMMODATIONS[j] for j in
+                              sorted(rng.choice(len(ACCOMMODATIONS), rng.integers(1, 3), replace=False))],
+            "cuisines": [CUISINES[j] for j in sorted(rng.choice(len(CUISINES), rng.integers(1, 3), replace=False))],
+        }
+    return destinations
+
+
+def _random_preferences(rng):
+    trip_type = TRIP_TYPES[rng.integers(len(TRIP_TYPES))].lower()
+    budget = int(rng.integers(len(BUDGET_CHOICES)))
+    group = ACTIVITY_GROUPS[trip_type]
+    return {
+        "trip_type": trip_type,
+        "budget": {"choice": BUDGET_CHOICES[budget].lower(), "price_range": list(BUDGET_RANGES[budget])},
+        "activities": [group[j].lower() for j in rng.choice(len(group), rng.integers(1, len(group) + 1),
+                                                             replace=False)],
+        "accommodation": ACCOMMODATIONS[rng.integers(len(ACCOMMODATIONS))].lower(),
+        "cuisine": [CUISINES[j].lower() for j in rng.choice(len(CUISINES), rng.integers(1, 4), replace=False)],
+        "travel_season": TRAVEL_SEASONS[rng.integers(len(TRAVEL_SEASONS))].lower(),
+    }
+
+
+def iter_users(n, dest_ids, ratings_per_user=5.0, popularity_skew=1.0, seed=0):
+    """Yield ``(username, record)`` pairs for ``n`` synthetic users.
+
+    Rating counts are Poisson distributed around ``ratings_per_user``; which
+    destinations get rated follows a Zipf-like popularity curve whose
+    steepness is ``popularity_skew`` (0 means uniform).
+    """
+    rng = np.random.default_rng(seed)
+    dest_ids = list(dest_ids)
+    popularity = 1.0 / np.arange(1, len(dest_ids) + 1) ** popularity_skew
+    popularity = rng.permutation(popularity / popularity.sum())
+    counts = np.minimum(rng.poisson(ratings_per_user, n), len(dest_ids))
+    rated = iter(rng.choice(len(dest_ids), int(counts.sum()), p=popularity).tolist())
+    stars = iter(rng.integers(1, 6, int(counts.sum())).tolist())
+    for i in range(n):
+        username = f"user{i}"
+        ratings = {}
+        for _ in range(counts[i]):
+            ratings[dest_ids[next(rated)]] = next(stars)
+        yield username, {
+            "password": hashlib.sha256(username.encode()).hexdigest(),
+            "preferences": _random_preferences(rng),
+            "ratings": ratings,
+        }
+
+
+def generate_users(n, dest_ids, ratings_per_user=5.0, popularity_skew=1.0, seed=0):
+    return dict(iter_users(n, dest_ids, ratings_per_user, popularity_skew, seed))
+
+
+def write_users(path, users):
+    """Stream ``(username, record)`` pairs into a users.json-style file."""
+    with open(path, "w") as f:
+        f.write("{")
+        for i, (username, record) in enumerate(users):
+            f.write(("," if i else "") + "\n" + json.dumps(username) + ": " + json.dumps(record))
+        f.write("\n}\n")
+
+
+def write_catalog(path, destinations):
+    """Write a catalog as JSON lines, one ``{"id": ..., **fields}`` object per destination."""
+    with open(path, "w") as f:
+        for dest_id, dest in destinations.items():
+            f.write(json.dumps({"id": dest_id, **dest}) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic catalog and user base.")
+    parser.add_argument("--destinations", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--ratings-per-user", type=float, default=5.0)
+    parser.add_argument("--popularity-skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-dir", default=".")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    destinations = generate_catalog(args.destinations, args.seed)
+    write_catalog(os.path.join(args.out_dir, "destinations.jsonl"), destinations)
+    write_users(os.path.join(args.out_dir, "users.json"),
+                iter_users(args.users, destinations, args.ratings_per_user, args.popularity_skew, args.seed))
+
+
+if __name__ == "__main__":
+    main()
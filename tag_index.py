@@ -0,0 +1,333 @@
+"""Approximate nearest-neighbour search over destination tag vectors.
+
+Each destination's ``tags`` dict is a sparse vector (one dimension per tag
+name), normalized to unit length so that a dot product is the cosine
+similarity. ``TagIndex`` hashes the vectors with random hyperplanes: in
+each of ``n_tables`` tables, a destination's signature is the sign pattern
+of its projections onto ``n_bits`` random directions. Vectors at a small
+angle agree on most signs, so the candidates for a query are the rows
+whose signature equals the query's in any table; only when that finds too
+few are signatures one bit away probed as well, and failing that every
+row is scanned. Probing stops early once ``max_candidates`` rows are
+found, which keeps queries in dense regions cheap. Candidates are then
+ranked by their exact cosine.
+
+A tag's hyperplane coefficients are drawn from a generator seeded by the
+tag name, so new tags extend the index without re-hashing existing rows.
+Rows added or changed since the last merge sit in a small buffer that is
+scanned directly; every ``merge_every`` changes the per-table sorted
+signature arrays are rebuilt.
+
+Usage (recall and latency against exact ``cosine_similarity``):
+    python tag_index.py --destinations 1000000 --queries 200
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+
+class TagIndex:
+    def __init__(self, n_tables=8, n_bits=64, seed=0, merge_every=4096, min_candidates=8, max_candidates=1024):
+        if not 1 <= n_bits <= 64:
+            raise ValueError("n_bits must be between 1 and 64")
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.seed = seed
+        self.merge_every = merge_every
+        self.min_candidates = min_candidates
+        self.max_candidates = max_candidates
+        self.vocab = {}
+        self._planes = np.zeros((0, n_tables * n_bits), dtype=np.float32)
+        self._sig_dtype = np.uint32 if n_bits <= 32 else np.uint64
+        self._bit_values = (np.uint64(1) << np.arange(n_bits, dtype=np.uint64)).astype(self._sig_dtype)
+        # Per row: up to ``width`` (tag column, weight) pairs, padded with column -1.
+        self._tag_ids = np.full((0, 1), -1, dtype=np.int32)
+        self._weights = np.zeros((0, 1), dtype=np.float32)
+        self._sigs = np.zeros((0, n_tables), dtype=self._sig_dtype)
+        self._alive = np.zeros(0, dtype=bool)
+        self._sorted = [(np.zeros(0, dtype=self._sig_dtype), np.zeros(0, dtype=np.int64))] * n_tables
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return int(self._alive.sum())
+
+    # ---- vectors ----
+
+    def _column(self, tag):
+        col = self.vocab.get(tag)
+        if col is None:
+            col = self.vocab[tag] = len(self.vocab)
+            rng = np.random.default_rng([self.seed, zlib.crc32(tag.encode())])
+            plane = rng.standard_normal(self._planes.shape[1]).astype(np.float32)
+            self._planes = np.vstack([self._planes, plane])
+        return col
+
+    def _signatures(self, tag_ids, weights):
+        """``(rows, n_tables)`` signatures of padded vectors."""
+        planes = np.vstack([self._planes, np.zeros((1, self._planes.shape[1]), dtype=np.float32)])
+        projections = np.einsum("rt,rtp->rp", weights, planes[tag_ids])  # column -1 hits the zero row
+        bits = (projections > 0).reshape(len(tag_ids), self.n_tables, self.n_bits)
+        return (bits * self._bit_values).sum(axis=2, dtype=self._sig_dtype)
+
+    def _encode(self, tags_list, width):
+        tag_ids = np.full((len(tags_list), width), -1, dtype=np.int32)
+        weights = np.zeros((len(tags_list), width), dtype=np.float32)
+        for i, tags in enumerate(tags_list):
+            items = [(self._column(tag), weight) for tag, weight in tags.items() if weight]
+            norm = sum(weight * weight for _, weight in items) ** 0.5
+            for j, (col, weight) in enumerate(items):
+                tag_ids[i, j] = col
+                weights[i, j] = weight / norm
+        return tag_ids, weights
+
+    # ---- updates ----
+
+    def add(self, rows, tags_list):
+        """Insert or replace the tag vectors of catalog ``rows``."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return
+        with self._lock:
+            width = max([self._tag_ids.shape[1]] + [len(tags) for tags in tags_list])
+            tag_ids, weights = self._encode(tags_list, width)
+            n = max(len(self._alive), int(rows.max()) + 1)
+            if n > len(self._alive) or width > self._tag_ids.shape[1]:
+                self._grow(max(n, 2 * len(self._alive)) if n > len(self._alive) else len(self._alive), width)
+            self._tag_ids[rows] = tag_ids
+            self._weights[rows] = weights
+            for lo in range(0, len(rows), 16384):
+                self._sigs[rows[lo:lo + 16384]] = self._signatures(tag_ids[lo:lo + 16384], weights[lo:lo + 16384])
+            self._alive[rows] = True
+            self._pending.update(rows.tolist())
+            if len(self._pending) >= self.merge_every:
+                self._merge()
+
+    def remove(self, rows):
+        with self._lock:
+            rows = [row for row in rows if row < len(self._alive)]
+            self._alive[rows] = False
+
+    def _grow(self, n, width):
+        old = len(self._alive)
+        tag_ids = np.full((n, width), -1, dtype=np.int32)
+        tag_ids[:old, :self._tag_ids.shape[1]] = self._tag_ids
+        weights = np.zeros((n, width), dtype=np.float32)
+        weights[:old, :self._weights.shape[1]] = self._weights
+        sigs = np.zeros((n, self.n_tables), dtype=self._sig_dtype)
+        sigs[:old] = self._sigs
+        alive = np.zeros(n, dtype=bool)
+        alive[:old] = self._alive
+        self._tag_ids, self._weights, self._sigs, self._alive = tag_ids, weights, sigs, alive
+
+    def _merge(self):
+        rows = np.flatnonzero(self._alive)
+        sorted_tables = []
+        for t in range(self.n_tables):
+            sigs = self._sigs[rows, t]
+            order = np.argsort(sigs, kind="stable")
+            sorted_tables.append((sigs[order], rows[order]))
+        self._sorted = sorted_tables
+        self._pending = set()
+
+    def merge(self):
+        with self._lock:
+            self._merge()
+
+    # ---- queries ----
+
+    def _probes(self, sig, radius):
+        """The signature itself and, for radius 1, every signature one bit away."""
+        sig = np.array([sig], dtype=self._sig_dtype)
+        return np.concatenate([sig, sig ^ self._bit_values]) if radius else sig
+
+    def _candidates(self, sigs, k):
+        """Rows sharing a bucket with ``sigs``; neighbouring buckets are probed if that finds too few.
+
+        Tables are probed in order until ``max_candidates`` hits are found.
+        A query that still has fewer than ``k`` candidates (an isolated
+        vector, or a small catalog) is answered by scanning every row.
+        """
+        rows = self._probe(sigs, 0)
+        if len(rows) < self.min_candidates * k:
+            rows = self._probe(sigs, 1)
+        if len(rows) < k:
+            rows = np.flatnonzero(self._alive)
+        return rows
+
+    def _probe(self, sigs, radius):
+        found = []
+        pending = np.fromiter(self._pending, dtype=np.int64, count=len(self._pending))
+        for t, (sorted_sigs, sorted_rows) in enumerate(self._sorted):
+            probes = self._probes(sigs[t], radius)
+            lo = np.searchsorted(sorted_sigs, probes, side="left")
+            hi = np.searchsorted(sorted_sigs, probes, side="right")
+            found.extend(sorted_rows[a:b] for a, b in zip(lo.tolist(), hi.tolist()) if b > a)
+            # Dense neighbourhoods fill the first tables' buckets with near
+            # duplicates; the remaining tables would only add more of them.
+            if sum(map(len, found)) >= self.max_candidates:
+                break
+        rows = np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+        if len(pending):
+            # Rows changed since the last merge are filed under their old
+            # signatures; match them on their current ones instead.
+            rows = rows[~np.isin(rows, pending)]
+            matched = np.zeros(len(pending), dtype=bool)
+            for t in range(self.n_tables):
+                matched |= np.isin(self._sigs[pending, t], self._probes(sigs[t], radius))
+            rows = np.union1d(rows, pending[matched])
+        return rows[self._alive[rows]]
+
+    def _query_vector(self, tags):
+        """Dense unit query over the known tags (plus a zero for padding) and its norm."""
+        q = np.zeros(len(self.vocab) + 1, dtype=np.float32)
+        norm = sum(weight * weight for weight in tags.values()) ** 0.5
+        if not norm:
+            return None
+        for tag, weight in tags.items():
+            col = self.vocab.get(tag)
+            if col is not None:
+                q[col] = weight / norm
+        return q
+
+    def _rank(self, q, rows, k, exclude):
+        if exclude is not None:
+            rows = rows[rows != exclude]
+        sims = (q[self._tag_ids[rows]] * self._weights[rows]).sum(axis=1)
+        # Rows sharing no tag with the query (or only opposed ones) are not similar at all.
+        similar = sims > 0
+        rows, sims = rows[similar], sims[similar]
+        if len(rows) > k:
+            kth = np.partition(sims, len(sims) - k)[len(sims) - k]
+            best = sims >= kth
+            rows, sims = rows[best], sims[best]
+        # Ties go to the lower row, like everywhere else in the app.
+        order = np.lexsort((rows, -sims))[:k]
+        return rows[order], sims[order].astype(np.float64)
+
+    def query(self, tags, k=10, exclude=None):
+        """``(rows, cosine similarities)`` of up to ``k`` rows nearest to a ``{tag: weight}`` query."""
+        with self._lock:
+            q = self._query_vector(tags)
+            if q is None or not q.any():
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            # Tags no row carries cannot change which rows are nearest.
+            known = {tag: weight for tag, weight in tags.items() if tag in self.vocab}
+            tag_ids, weights = self._encode([known], len(known))
+            sigs = self._signatures(tag_ids, weights)[0]
+            return self._rank(q, self._candidates(sigs, k), k, exclude)
+
+    def similar(self, row, k=10):
+        """Rows most similar to catalog ``row``, excluding the row itself."""
+        with self._lock:
+            if row >= len(self._alive) or not self._alive[row]:
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            q = np.zeros(len(self.vocab) + 1, dtype=np.float32)
+            valid = self._tag_ids[row] >= 0
+            q[self._tag_ids[row][valid]] = self._weights[row][valid]
+            return self._rank(q, self._candidates(self._sigs[row], k + 1), k, exclude=row)
+
+    def exact(self, tags, k=10):
+        """Exact top ``k`` by brute force over every live row (for checking recall)."""
+        with self._lock:
+            q = self._query_vector(tags)
+            if q is None:
+                return np.zeros(0, dtype=np.int64), np.zeros(0)
+            return self._rank(q, np.flatnonzero(self._alive), k, None)
+
+    @classmethod
+    def from_catalog(cls, catalog, **kwargs):
+        index = cls(**kwargs)
+        index.add(range(len(catalog)), [dest["tags"] for dest in catalog.records])
+        # Rows removed by CompiledCatalog.updated stay behind without activities.
+        dead = np.flatnonzero(~np.asarray(catalog.has_activities[:len(catalog)]))
+        index.remove([row for row in dead.tolist() if catalog.row_of.get(catalog.ids[row]) != row])
+        index.merge()
+        return index
+
+
+# ---- benchmark ----
+
+def _synthetic_tags(n, seed):
+    from synthetic_data import EXTRA_TAGS  # the generator's own tag vocabulary
+
+    rng = np.random.default_rng(seed)
+    types = ["beach", "mountain", "city"]
+    type_tags = rng.integers(len(types), size=n)
+    extra_tags = rng.integers(len(EXTRA_TAGS), size=n)
+    second = rng.integers(len(EXTRA_TAGS), size=n)
+    type_weights = np.round(rng.uniform(0.6, 1.0, n), 2)
+    extra_weights = np.round(rng.uniform(0.5, 1.0, n), 2)
+    second_weights = np.round(rng.uniform(0.0, 0.6, n), 2)
+    return [{types[a]: float(wa), EXTRA_TAGS[b]: float(wb), EXTRA_TAGS[c]: float(wc)}
+            for a, b, c, wa, wb, wc in zip(type_tags.tolist(), extra_tags.tolist(), second.tolist(),
+                                           type_weights.tolist(), extra_weights.tolist(), second_weights.tolist())]
+
+
+def run_benchmark(n, queries, k=10, n_tables=8, n_bits=64, seed=0):
+    """Build an index over ``n`` synthetic tag vectors and compare it with exact cosine similarity."""
+    from scipy import sparse
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    tags = _synthetic_tags(n, seed)
+    start = time.perf_counter()
+    index = TagIndex(n_tables=n_tables, n_bits=n_bits, seed=seed)
+    for lo in range(0, n, 100_000):
+        index.add(range(lo, min(n, lo + 100_000)), tags[lo:lo + 100_000])
+    index.merge()
+    build_s = time.perf_counter() - start
+
+    vocab = index.vocab
+    data, cols, indptr = [], [], [0]
+    for row_tags in tags:
+        for tag, weight in row_tags.items():
+            data.append(weight)
+            cols.append(vocab[tag])
+        indptr.append(len(data))
+    matrix = sparse.csr_matrix((data, cols, indptr), shape=(n, len(vocab)))
+
+    rng = np.random.default_rng(seed + 1)
+    recall, approx_times, exact_times = [], [], []
+    for row in rng.integers(n, size=queries).tolist():
+        start = time.perf_counter()
+        rows, sims = index.query(tags[row], k)
+        approx_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        exact = cosine_similarity(matrix[row], matrix).ravel()
+        kth = np.partition(exact, len(exact) - k)[len(exact) - k]
+        exact_times.append(time.perf_counter() - start)
+        # With many equal vectors the exact top k is not unique, so a hit is
+        # any returned row at least as similar as the k-th best.
+        recall.append(np.sum(exact[rows] >= kth - 1e-6) / k)
+    return {
+        "destinations": n,
+        "build_s": build_s,
+        "recall_at_k": statistics.fmean(recall),
+        "lsh_median_ms": statistics.median(approx_times) * 1000,
+        "lsh_p99_ms": float(np.percentile(approx_times, 99)) * 1000,
+        "exact_median_ms": statistics.median(exact_times) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tag-vector LSH against exact cosine similarity.")
+    parser.add_argument("--destinations", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--tables", type=int, default=8)
+    parser.add_argument("--bits", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    result = run_benchmark(args.destinations, args.queries, args.k, args.tables, args.bits, args.seed)
+    for name, value in result.items():
+        print(f"  {name:18s} {value:.4f}" if isinstance(value, float) else f"  {name:18s} {value}",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
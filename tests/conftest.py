@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import smart_travel_app as app  # noqa: E402
+from user_store import JournaledUserStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """An empty journaled user store in ``tmp_path``, installed as the app's users."""
+    monkeypatch.chdir(tmp_path)
+    users = JournaledUserStore(str(tmp_path / "users.json"))
+    monkeypatch.setattr(app, "USERS", users)
+    monkeypatch.setattr(app, "RATING_INDEX", app.RatingIndex(app.CATALOG))
+    app.RECOMMENDATION_CACHE.clear()
+    yield users
+    users.close()
+    app.RECOMMENDATION_CACHE.clear()
@@ -0,0 +1,34 @@
+import json
+
+import batch_recommend
+import smart_travel_app as app
+
+PREFS = {"trip_type": "beach", "budget": {"price_range": [0, 1000]}, "activities": ["surfing"],
+         "accommodation": "Hotel", "cuisine": ["local"], "travel_season": "summer"}
+
+
+def test_results_keep_input_order_and_ids(tmp_path):
+    lines = [
+        json.dumps(PREFS),
+        json.dumps({"id": "p2", "preferences": dict(PREFS, trip_type="city", activities=["museums"]),
+                    "ratings": {"d1": 5}}),
+        "",
+        "{not json",
+        json.dumps({"id": "p5", "preferences": {"trip_type": "beach"}}),
+        json.dumps([1, 2]),
+    ] + [json.dumps({"id": f"bulk{i}", "preferences": dict(PREFS, travel_season=season)})
+         for i, season in enumerate(["summer", "winter", "spring", "fall"] * 3)]
+    src, dst = tmp_path / "profiles.jsonl", tmp_path / "results.jsonl"
+    src.write_text("\n".join(lines) + "\n")
+
+    profiles, _ = batch_recommend.run_batch(str(src), str(dst), workers=2, top_k=2, chunk_size=3)
+
+    results = [json.loads(line) for line in dst.read_text().splitlines()]
+    assert profiles == len(results) == len(lines) - 1
+    assert [result["id"] for result in results] == [1, "p2", 4, "p5", 6] + [f"bulk{i}" for i in range(12)]
+    assert results[0]["recommendations"] == app.recommend(PREFS, None, 2)
+    assert results[1]["recommendations"] == app.recommend(dict(PREFS, trip_type="city", activities=["museums"]),
+                                                          {"d1": 5}, 2)
+    assert [("error" in result) for result in results[2:5]] == [True, True, True]
+    assert results[3]["error"].startswith("KeyError")
+    assert all(len(result["recommendations"]) == 2 for result in results[5:])
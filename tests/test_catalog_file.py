@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+import catalog_file
+import smart_travel_app as app
+from synthetic_data import generate_catalog, write_catalog
+
+PREFS = [
+    {"trip_type": trip_type, "budget": {"price_range": price_range}, "activities": activities,
+     "accommodation": "Hotel", "cuisine": ["local", "seafood"], "travel_season": "summer"}
+    for trip_type, activities in (("beach", ["surfing", "spa"]), ("mountain", ["skiing"]), ("city", ["museums"]))
+    for price_range in ([0, 300], [300, 500], [0, 9999])
+]
+
+
+def make_destinations():
+    destinations = generate_catalog(400, 3)
+    destinations["d7"]["activities"] = []
+    destinations["d8"]["best_months"] = ["may", "june"]  # fields outside the schema survive too
+    return destinations
+
+
+def test_mapped_catalog_round_trips(tmp_path):
+    destinations = make_destinations()
+    catalog = app.CompiledCatalog(destinations)
+    path = str(tmp_path / "catalog.bin")
+    catalog.save(path)
+    mapped = app.CompiledCatalog.from_file(path)
+
+    assert list(mapped.ids) == catalog.ids
+    assert list(mapped.records) == catalog.records
+    assert dict(mapped.destinations) == destinations
+    for dest_id in destinations:
+        assert mapped.row_of[dest_id] == catalog.row_of[dest_id]
+    for missing in ("d0", "d9999", "zzz", 5):
+        assert missing not in mapped.row_of
+    for attribute in ("price", "type_code", "has_activities", "activities", "cuisines", "accommodation",
+                      "weather"):
+        assert np.array_equal(getattr(mapped, attribute), getattr(catalog, attribute))
+    for attribute in ("lat", "lon"):
+        assert np.array_equal(getattr(mapped, attribute), getattr(catalog, attribute), equal_nan=True)
+    assert mapped.activity_vocab == catalog.activity_vocab
+    assert mapped.type_vocab == catalog.type_vocab
+    for field, postings in catalog.index.postings.items():
+        assert {value: rows.tolist() for value, rows in mapped.index.postings[field].items()} == \
+            {value: rows.tolist() for value, rows in postings.items()}
+
+    rating_index = app.RatingIndex(catalog)
+    for row, dest_id in enumerate(catalog.ids[:60]):
+        rating_index.record(dest_id, row % 5 + 1)
+    for prefs in PREFS:
+        assert np.array_equal(mapped.index.candidates(prefs["trip_type"], *prefs["budget"]["price_range"]),
+                              catalog.index.candidates(prefs["trip_type"], *prefs["budget"]["price_range"]))
+        expected = catalog.cursor(prefs, "sunny", rating_index.scores, {"d3": 1}).next_page(20)
+        assert mapped.cursor(prefs, "sunny", rating_index.scores, {"d3": 1}).next_page(20) == expected
+
+
+def test_replaced_file_is_noticed(tmp_path):
+    path = str(tmp_path / "catalog.bin")
+    app.CompiledCatalog(make_destinations()).save(path)
+    mapped = app.CompiledCatalog.from_file(path)
+    assert not mapped.source.changed()
+    destinations = make_destinations()
+    destinations["d1"]["price"] = 12345
+    app.CompiledCatalog(destinations).save(path)
+    assert mapped.source.changed()
+    # The old mapping keeps reading the version it opened.
+    assert mapped.records[mapped.row_of["d1"]]["price"] != 12345
+    assert app.CompiledCatalog.from_file(path).destinations["d1"]["price"] == 12345
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "catalog.bin"
+    path.write_bytes(b"not a catalog" * 10)
+    with pytest.raises(ValueError):
+        catalog_file.CatalogFile(str(path))
+
+
+def test_updated_catalog_is_saved_without_removed_rows(tmp_path):
+    destinations = make_destinations()
+    catalog = app.CompiledCatalog(destinations).updated({"extra": destinations["d1"]}, ["d2", "d5"])
+    path = str(tmp_path / "catalog.bin")
+    catalog.save(path)
+    mapped = app.CompiledCatalog.from_file(path)
+
+    assert len(mapped) == len(destinations) - 1
+    assert "d2" not in mapped.row_of and "d5" not in mapped.row_of
+    assert dict(mapped.destinations) == dict(catalog.destinations)
+    scores = app.RatingIndex(mapped).scores
+    for prefs in PREFS:
+        assert mapped.cursor(prefs, "sunny", scores).next_page(50) == \
+            catalog.cursor(prefs, "sunny", app.RatingIndex(catalog).scores).next_page(50)
+
+
+def test_main_compiles_a_catalog_source(tmp_path, capsys):
+    destinations = make_destinations()
+    source, path = str(tmp_path / "destinations.jsonl"), str(tmp_path / "catalog.bin")
+    write_catalog(source, destinations)
+    catalog_file.main([path, "--source", source])
+    assert dict(app.CompiledCatalog.from_file(path).destinations) == destinations
+    assert f"Wrote {len(destinations)} destinations" in capsys.readouterr().out
+
+    with open(source, "a") as f:
+        f.write('{"id": "broken"}\n')
+    with pytest.raises(SystemExit):
+        catalog_file.main([path, "--source", source])
+    assert "destinations.jsonl:401" in capsys.readouterr().err
@@ -0,0 +1,162 @@
+import copy
+import csv
+import json
+import os
+import time
+
+import pytest
+
+import catalog_source
+import smart_travel_app as app
+from synthetic_data import generate_catalog, write_catalog
+
+PREFS = {"trip_type": "beach", "budget": {"price_range": [0, 9999]}, "activities": ["surfing", "snorkeling"],
+         "accommodation": "Resort", "cuisine": ["seafood"], "travel_season": "summer"}
+
+
+def edit(destinations):
+    """A copy of ``destinations`` with one entry changed, one removed and one added."""
+    edited = copy.deepcopy(destinations)
+    edited["d2"]["price"] += 1
+    edited["d3"]["activities"] = ["hiking"]
+    del edited["d5"]
+    edited["new"] = dict(edited["d1"], name="New Beach Stay")
+    return edited
+
+
+def rewrite(path, destinations):
+    """Rewrite ``path`` so its size or mtime differs from the last read."""
+    stat = os.stat(path)
+    write_catalog(path, destinations)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_diff_reports_added_changed_and_removed(tmp_path):
+    path = str(tmp_path / "destinations.jsonl")
+    destinations = generate_catalog(50, 1)
+    write_catalog(path, destinations)
+    source = catalog_source.CatalogSource(path)
+    assert source.load() == destinations
+    assert not source.changed()
+
+    rewrite(path, edit(destinations))
+    assert source.changed()
+    upserts, removed = source.diff()
+    assert sorted(upserts) == ["d2", "d3", "new"]
+    assert upserts["d3"]["activities"] == ["hiking"]
+    assert removed == ["d5"]
+
+    rewrite(path, edit(destinations))
+    assert source.diff() == ({}, [])
+
+
+def test_csv_matches_jsonl(tmp_path):
+    destinations = generate_catalog(20, 2)
+    path = str(tmp_path / "destinations.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", *catalog_source.STRING_FIELDS, "price", "tags", *catalog_source.LIST_FIELDS,
+                         *catalog_source.GEO_FIELDS])
+        for dest_id, dest in destinations.items():
+            tags = "|".join(f"{name}:{weight}" for name, weight in dest["tags"].items())
+            writer.writerow([dest_id, *(dest[field] for field in catalog_source.STRING_FIELDS), dest["price"], tags,
+                             *("|".join(dest[field]) for field in catalog_source.LIST_FIELDS),
+                             *(dest.get(field, "") for field in catalog_source.GEO_FIELDS)])
+    assert catalog_source.CatalogSource(path).load() == destinations
+
+
+@pytest.mark.parametrize("field, value, message", [
+    ("name", "", "name must be a non-empty string"),
+    ("price", -1, "price must be a non-negative number"),
+    ("price", True, "price must be a non-negative number"),
+    ("tags", ["beach"], "tags must map names to numbers"),
+    ("activities", "surfing", "activities must be a list of strings"),
+    ("lat", 91.5, "lat must be a number between -90 and 90"),
+    ("lon", float("nan"), "lon must be a number between -180 and 180"),
+])
+def test_invalid_destinations_are_rejected(field, value, message):
+    dest = dict(generate_catalog(1)["d1"], **{field: value})
+    with pytest.raises(ValueError, match=message):
+        catalog_source.validate_destination(dest)
+
+
+def test_rejected_file_keeps_the_last_good_read(tmp_path):
+    path = str(tmp_path / "destinations.jsonl")
+    destinations = generate_catalog(10, 3)
+    write_catalog(path, destinations)
+    source = catalog_source.CatalogSource(path)
+    source.load()
+
+    with open(path, "a") as f:
+        f.write(json.dumps({"id": "bad", **dict(destinations["d1"], price="cheap")}) + "\n")
+    with pytest.raises(catalog_source.CatalogError, match=r"destinations\.jsonl:11: price"):
+        source.diff()
+    # The rejected version is not retried until the file changes again.
+    assert not source.changed()
+
+    rewrite(path, destinations)
+    with open(path, "a") as f:
+        f.write(json.dumps({"id": "d1", **destinations["d1"]}) + "\n")
+    assert source.changed()
+    with pytest.raises(catalog_source.CatalogError, match="duplicate id 'd1'"):
+        source.diff()
+
+    rewrite(path, destinations)
+    assert source.diff() == ({}, [])
+
+
+def test_updated_catalog_ranks_like_a_fresh_build():
+    destinations = generate_catalog(300, 4)
+    edited = edit(destinations)
+    catalog = app.CompiledCatalog(destinations)
+    updated = catalog.updated({dest_id: edited[dest_id] for dest_id in ("d2", "d3", "new")}, ["d5"])
+    fresh = app.CompiledCatalog(edited)
+
+    assert dict(updated.destinations) == edited
+    assert "d5" not in updated.row_of
+    scores = app.RatingIndex(fresh).scores
+    for prefs in (PREFS, dict(PREFS, trip_type="city", activities=["museums"]),
+                  dict(PREFS, budget={"price_range": [100, 300]})):
+        expected = fresh.cursor(prefs, "sunny", scores).next_page(len(fresh))
+        assert updated.cursor(prefs, "sunny", app.RatingIndex(updated).scores).next_page(len(updated)) == expected
+    assert catalog.records[catalog.row_of["d3"]] == destinations["d3"]  # the original is untouched
+
+
+def test_watcher_reloads_without_dropping_running_queries(tmp_path, store, monkeypatch):
+    path = str(tmp_path / "destinations.jsonl")
+    destinations = generate_catalog(300, 5)
+    write_catalog(path, destinations)
+    source = catalog_source.CatalogSource(path)
+    catalog = app.CompiledCatalog(source.load())
+    monkeypatch.setattr(app, "CATALOG_SOURCE", source)
+    monkeypatch.setattr(app, "CATALOG", catalog)
+    monkeypatch.setattr(app, "DESTINATIONS", catalog.destinations)
+    monkeypatch.setattr(app, "RATING_INDEX", app.RatingIndex(catalog))
+    monkeypatch.setattr(app, "ITEM_NEIGHBORS", app.ItemNeighbors(catalog.ids))
+
+    expected = [rec["id"] for rec in app.recommendation_cursor(PREFS).next_page(len(catalog))]
+    running = app.recommendation_cursor(PREFS)
+    first = running.next_page(5)
+
+    edited = copy.deepcopy(destinations)
+    removed = expected[10]
+    del edited[removed]
+    edited["new"] = dict(destinations[expected[0]], name="New Beach Stay")
+    stop = catalog_source.start_watcher(app.reload_catalog, 0.01)
+    try:
+        rewrite(path, edited)
+        deadline = time.monotonic() + 10
+        while app.CATALOG is catalog and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        stop.set()
+
+    assert app.CATALOG is not catalog
+    assert app.DESTINATIONS is app.CATALOG.destinations
+    # The query that started before the swap finishes on the old catalog.
+    assert [rec["id"] for rec in first + running.next_page(len(catalog))] == expected
+    recs = app.recommendation_cursor(PREFS).next_page(len(app.CATALOG))
+    ids = [rec["id"] for rec in recs]
+    assert sorted(ids) == sorted(set(expected) - {removed} | {"new"})
+    # A copy of the best match scores as well as the best match.
+    assert recs[ids.index("new")]["score"] == recs[0]["score"]
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+import smart_travel_app as app
+from synthetic_data import generate_catalog
+
+
+def row_values(dest):
+    return {
+        "type": {dest["type"].lower()},
+        "region": {dest["region"].lower()},
+        "budget": {key for key, (lo, hi) in zip(app.BUDGET_KEYS, app.BUDGET_RANGES) if lo <= dest["price"] <= hi},
+        "activities": {act.lower() for act in dest["activities"]},
+        "cuisines": {c.lower() for c in dest["cuisines"]},
+        "accommodation": {a.lower() for a in dest["accommodation"]},
+    }
+
+
+def brute_force_counts(destinations, selection):
+    rows = [row_values(dest) for dest in destinations.values()]
+    selection = {field: {value.lower() for value in values} for field, values in selection.items()}
+
+    def matches(values, skip=None):
+        return all(values[field] & chosen for field, chosen in selection.items() if field != skip)
+
+    counts = {}
+    for field in app.FacetIndex.FIELDS:
+        # Every value some live destination carries is listed, even at zero.
+        by_value = {value: 0 for values in rows for value in values[field]}
+        for values in rows:
+            if matches(values, skip=field):
+                for value in values[field]:
+                    by_value[value] += 1
+        counts[field] = by_value
+    return sum(1 for values in rows if matches(values)), counts
+
+
+def random_selection(rng, facets):
+    selection = {}
+    for field in rng.sample(app.FacetIndex.FIELDS, rng.randint(0, 3)):
+        values = sorted(facets.values[field])
+        selection[field] = rng.sample(values, rng.randint(0, min(3, len(values))))
+    return selection
+
+
+def test_counts_match_brute_force():
+    rng = random.Random(0)
+    destinations = generate_catalog(1500, 0)
+    facets = app.FacetIndex(app.CompiledCatalog(destinations))
+    for _ in range(60):
+        selection = random_selection(rng, facets)
+        assert facets.counts(selection) == brute_force_counts(destinations, selection)
+
+
+def test_counts_after_update_match_brute_force():
+    rng = random.Random(1)
+    destinations = generate_catalog(800, 1)
+    catalog = app.CompiledCatalog(destinations)
+    facets = app.FacetIndex(catalog)
+    extra = generate_catalog(900, 2)
+    for _ in range(5):
+        removed = rng.sample(list(catalog.destinations), 20)
+        upserts = {dest_id: extra[rng.choice(list(extra))]
+                   for dest_id in rng.sample(list(catalog.destinations), 20) + [f"new{rng.random()}"]}
+        before = set(catalog.row_of.values())
+        catalog = catalog.updated(upserts, removed)
+        facets.update(catalog, sorted(before ^ set(catalog.row_of.values()) |
+                                      {catalog.row_of[dest_id] for dest_id in upserts}))
+        for _ in range(10):
+            selection = random_selection(rng, facets)
+            assert facets.counts(selection) == brute_force_counts(catalog.destinations, selection)
+
+
+def test_unknown_facets_and_values_are_rejected():
+    facets = app.FacetIndex(app.CompiledCatalog(generate_catalog(50, 3)))
+    # Questionnaire answers are known even when no destination carries them.
+    total, counts = facets.counts({"budget": ["HIGH"], "cuisines": ["vegan"]})
+    assert total == brute_force_counts(generate_catalog(50, 3), {"budget": ["high"], "cuisines": ["vegan"]})[0]
+    for selection, message in (({"colour": ["red"]}, "unknown facets: colour"),
+                               ({"budget": ["high ($500+)"]}, r"unknown facet values: budget=high \(\$500\+\)"),
+                               ({"type": ["beach", "desert"]}, "unknown facet values: type=desert")):
+        with pytest.raises(ValueError, match=message):
+            facets.counts(selection)
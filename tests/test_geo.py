@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import smart_travel_app as app
+from geo import SpatialIndex, haversine_km
+from synthetic_data import generate_catalog
+
+
+def brute_force_radius(catalog, lat, lon, km):
+    rows = np.flatnonzero(~np.isnan(catalog.lat))
+    distances = haversine_km(lat, lon, catalog.lat[rows], catalog.lon[rows])
+    near = distances <= km
+    return set(rows[near].tolist())
+
+
+def brute_force_nearest(catalog, lat, lon, k):
+    rows = np.flatnonzero(~np.isnan(catalog.lat))
+    distances = haversine_km(lat, lon, catalog.lat[rows], catalog.lon[rows])
+    return np.sort(distances)[:k]
+
+
+def check(index, catalog, rng):
+    for _ in range(40):
+        lat, lon = float(rng.uniform(-80, 80)), float(rng.uniform(-180, 180))
+        km = float(rng.choice([50, 500, 3000]))
+        rows, distances = index.radius(lat, lon, km)
+        assert set(rows.tolist()) == brute_force_radius(catalog, lat, lon, km)
+        assert np.all(np.diff(distances) >= 0)
+        np.testing.assert_allclose(distances, haversine_km(lat, lon, catalog.lat[rows], catalog.lon[rows]),
+                                   atol=1e-6)
+        rows, distances = index.nearest(lat, lon, k=7)
+        np.testing.assert_allclose(distances, brute_force_nearest(catalog, lat, lon, 7), atol=1e-6)
+
+
+@pytest.mark.parametrize("rebuild_every", [4096, 25])
+def test_queries_match_haversine_scan(rebuild_every):
+    rng = np.random.default_rng(rebuild_every)
+    catalog = app.CompiledCatalog(generate_catalog(2000, 0))
+    index = SpatialIndex.from_catalog(catalog, rebuild_every=rebuild_every)
+    check(index, catalog, rng)
+    extra = generate_catalog(500, 1)
+    # Moves, removals and additions, some of them without coordinates.
+    for step in range(4):
+        ids = list(catalog.destinations)
+        upserts = {dest_id: extra[f"d{rng.integers(1, 501)}"] for dest_id in rng.choice(ids, 8)}
+        upserts[f"new{step}"] = extra[f"d{rng.integers(1, 501)}"]
+        upserts[f"bare{step}"] = {key: value for key, value in extra["d1"].items() if key not in ("lat", "lon")}
+        removed = list(rng.choice(ids, 5))
+        before = set(catalog.row_of.values())
+        catalog = catalog.updated(upserts, removed)
+        index.update(catalog, sorted(before ^ set(catalog.row_of.values()) |
+                                     {catalog.row_of[dest_id] for dest_id in upserts}))
+        assert len(index) == int(np.count_nonzero(~np.isnan(catalog.lat)))
+        check(index, catalog, rng)
+
+
+def test_bad_points_are_rejected():
+    index = SpatialIndex([10.0], [20.0])
+    with pytest.raises(ValueError):
+        index.nearest(91, 0)
+    with pytest.raises(ValueError):
+        index.radius(0, 0, -1)
+
+
+def test_near_recommendations_favour_closer_destinations():
+    prefs = {"trip_type": "beach", "budget": {"price_range": [0, 9999]}, "activities": ["surfing"],
+             "accommodation": "Resort", "cuisine": ["seafood"], "travel_season": "summer"}
+    near = {"lat": 0.0, "lon": 100.0, "radius_km": 4000}
+    plain = {rec["id"]: rec["score"] for rec in app.recommend(prefs, {}, len(app.CATALOG))}
+    recs = app.recommend(prefs, {}, len(app.CATALOG), near)
+    assert recs and all(rec["distance_km"] <= 4000 for rec in recs)
+    for rec in recs:
+        dest = app.DESTINATIONS[rec["id"]]
+        assert rec["distance_km"] == round(float(haversine_km(0.0, 100.0, dest["lat"], dest["lon"])), 1)
+        expected = 0.8 * plain[rec["id"]] + 0.2 * 100 * (1 - rec["distance_km"] / 4000)
+        assert abs(rec["score"] - expected) <= 1
+    for bad in ({"lat": float("nan"), "lon": 0.0, "radius_km": 10}, {"lat": 0.0, "lon": float("inf")},
+                {"lat": "0", "lon": 0.0}):
+        with pytest.raises(ValueError, match="finite numeric lat and lon"):
+            app.resolve_near(bad)
+    with pytest.raises(KeyError):
+        app.nearby_destinations({"dest_id": "nope"})
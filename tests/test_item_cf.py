@@ -0,0 +1,90 @@
+"""Item-item neighbours against brute-force cosine similarity."""
+import random
+
+import numpy as np
+import pytest
+
+from item_cf import ItemNeighbors
+
+DEST_IDS = [f"d{i}" for i in range(30)]
+
+
+def random_users(rng, n_users):
+    return {f"user{u}": {"ratings": {dest_id: rng.randint(1, 5)
+                                     for dest_id in rng.sample(DEST_IDS, rng.randint(0, 8))}}
+            for u in range(n_users)}
+
+
+def cosines(users):
+    """Dense item x item cosine similarity of the users' ratings."""
+    matrix = np.zeros((len(users), len(DEST_IDS)))
+    for u, user in enumerate(users.values()):
+        for dest_id, rating in user["ratings"].items():
+            matrix[u, DEST_IDS.index(dest_id)] = rating
+    dots = matrix.T @ matrix
+    norms = np.sqrt(np.diag(dots))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nan_to_num(dots / np.outer(norms, norms))
+
+
+def neighbor_cosines(neighbors, i):
+    valid = neighbors.neighbor_items[i] >= 0
+    items = neighbors.neighbor_items[i][valid]
+    return dict(zip(items.tolist(), neighbors._cosines(i, items, neighbors.neighbor_dots[i][valid]).tolist()))
+
+
+@pytest.mark.parametrize("n_neighbors", [3, 40])
+def test_fit_keeps_most_similar_items(n_neighbors):
+    users = random_users(random.Random(1), 60)
+    expected = cosines(users)
+    neighbors = ItemNeighbors(DEST_IDS, n_neighbors=n_neighbors, block_size=7).fit(users)
+    for i in range(len(DEST_IDS)):
+        others = np.delete(expected[i], i)
+        best = sorted(others[others > 0], reverse=True)[:n_neighbors]
+        got = neighbor_cosines(neighbors, i)
+        assert sorted(got.values(), reverse=True) == pytest.approx(best)
+        for j, cosine in got.items():
+            assert cosine == pytest.approx(expected[i, j])
+
+
+def test_updates_match_a_refit():
+    rng = random.Random(2)
+    users = random_users(rng, 40)
+    # Room for every item, so incremental and refitted lists hold the same pairs.
+    neighbors = ItemNeighbors(DEST_IDS, n_neighbors=len(DEST_IDS), merge_every=25).fit(users)
+    for _ in range(300):
+        username = rng.choice(list(users) + ["newcomer"])
+        ratings = users.setdefault(username, {"ratings": {}})["ratings"]
+        dest_id = rng.choice(DEST_IDS + ["unknown"])
+        rating = rng.randint(1, 5)
+        previous = ratings.get(dest_id)
+        ratings[dest_id] = rating
+        neighbors.update(username, dest_id, rating, previous, ratings)
+    refit = ItemNeighbors(DEST_IDS, n_neighbors=len(DEST_IDS)).fit(users)
+    assert neighbors.norm2 == pytest.approx(refit.norm2)
+    for i in range(len(DEST_IDS)):
+        got, expected = neighbor_cosines(neighbors, i), neighbor_cosines(refit, i)
+        assert got.keys() == expected.keys()
+        assert [got[j] for j in expected] == pytest.approx(list(expected.values()))
+    for user in users.values():
+        got, expected = neighbors.predict(user["ratings"]), refit.predict(user["ratings"])
+        assert got.keys() == expected.keys()
+        assert [got[dest_id] for dest_id in expected] == pytest.approx(list(expected.values()))
+    neighbors.merge()
+    assert not neighbors._delta
+
+
+def test_predict_weights_own_ratings_by_similarity():
+    users = {
+        "a": {"ratings": {"d0": 5, "d1": 5}},
+        "b": {"ratings": {"d0": 4, "d2": 2}},
+        "c": {"ratings": {"d1": 3, "d2": 1}},
+    }
+    neighbors = ItemNeighbors(DEST_IDS).fit(users)
+    sims = cosines(users)
+    predicted = neighbors.predict({"d0": 5, "d1": 1, "gone": 3})
+    # d2 neighbours both rated items; d0 and d1 are rated already.
+    expected = (sims[2, 0] * 5 + sims[2, 1] * 1) / (sims[2, 0] + sims[2, 1])
+    assert predicted == pytest.approx({"d2": expected})
+    assert neighbors.predict({}) == {}
+    assert neighbors.predict({"d29": 4}) == {}
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import itinerary
+
+
+def random_candidates(rng, n, n_groups=5):
+    scores = rng.integers(0, itinerary.MAX_SCORE + 1, size=n)
+    prices = rng.integers(20, 900, size=n).astype(np.float64)
+    return scores, prices, rng.integers(n_groups, size=n)
+
+
+def key(scores, prices, indices):
+    """``(total score, -stops, -total price)`` of a plan, as ``brute_force`` ranks them."""
+    return (int(sum(scores[i] for i in indices)), -len(indices), -float(sum(prices[i] for i in indices)))
+
+
+@pytest.mark.parametrize("max_stops", [1, 2, 3, 4])
+def test_plan_matches_brute_force(max_stops):
+    rng = np.random.default_rng(max_stops)
+    for _ in range(40):
+        scores, prices, groups = random_candidates(rng, int(rng.integers(1, 14)))
+        # Repeated scores and prices make ties, which the tie-breaks must settle.
+        scores[rng.random(len(scores)) < 0.3] = scores[0]
+        budget = float(rng.integers(0, 2500))
+        for g in (None, groups):
+            indices, exact = itinerary.plan(scores, prices, budget, max_stops, g)
+            assert exact
+            assert len(indices) <= max_stops and sum(prices[i] for i in indices) <= budget
+            if g is not None:
+                assert len({g[i] for i in indices}) == len(indices)
+            assert key(scores, prices, indices) == itinerary.brute_force(scores, prices, budget, max_stops, g)
+
+
+def test_coarse_budget_cells_still_fit_the_budget():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        scores, prices, groups = random_candidates(rng, 12)
+        prices += rng.random(len(prices))
+        indices, exact = itinerary.plan(scores, prices, 1500.0, 3, groups, max_cells=500)
+        assert not exact
+        assert sum(prices[i] for i in indices) <= 1500.0
+        assert key(scores, prices, indices)[0] <= itinerary.brute_force(scores, prices, 1500.0, 3, groups)[0]
+
+
+@pytest.mark.parametrize("grouped", [False, True])
+def test_prune_keeps_an_optimal_plan_for_large_inputs(grouped):
+    # Past 4096 candidates prune filters by histogram first; the plan over
+    # the survivors must score what brute force finds over those survivors.
+    rng = np.random.default_rng(1)
+    scores, prices, groups = random_candidates(rng, 20_000, n_groups=3)
+    groups = groups if grouped else None
+    kept = itinerary.prune(scores, prices, 2, groups)
+    assert len(kept) < 2 * (itinerary.MAX_SCORE + 1) * 3
+    # Every pruned candidate is beaten by enough kept ones to stand in for it.
+    kept_set = set(kept.tolist())
+    for i in rng.choice(len(scores), 300, replace=False):
+        if i in kept_set:
+            continue
+        beaters = [j for j in kept if scores[j] >= scores[i] and prices[j] <= prices[i]
+                   and (groups is None or groups[j] == groups[i])]
+        assert len(beaters) >= (2 if groups is None else 1)
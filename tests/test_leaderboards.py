@@ -0,0 +1,130 @@
+"""Leaderboards and their skip lists against brute-force rankings."""
+import math
+import random
+
+import numpy as np
+import pytest
+
+from leaderboards import PRIOR_MEAN, PRIOR_WEIGHT, Leaderboards, SkipList
+
+NOW = 1_700_000_000  # realistic Unix seconds, where exp(decay * t) would overflow
+DAY = 86400
+BOARDS = {f"d{i}": [("beach" if i % 2 else "city", "europe" if i % 3 else "asia", "low" if i < 6 else "high")]
+          for i in range(12)}
+BOARDS["d11"].append(("city", "europe", "medium"))  # listed in two budget buckets
+
+
+def boards_of(dest_id):
+    return BOARDS.get(dest_id, ())
+
+
+def expected_top_rated(ratings, pattern, n):
+    """Brute-force top rated over ``{(user, dest_id): stars}``."""
+    totals = {}
+    for (_, dest_id), stars in ratings.items():
+        total, count = totals.get(dest_id, (0, 0))
+        totals[dest_id] = (total + stars, count + 1)
+    listed = [(-(total + PRIOR_MEAN * PRIOR_WEIGHT) / (count + PRIOR_WEIGHT), -count, dest_id)
+              for dest_id, (total, count) in totals.items()
+              if any(all(want is None or want == value for want, value in zip(pattern, board))
+                     for board in boards_of(dest_id))]
+    return [(dest_id, totals[dest_id][0] / totals[dest_id][1], totals[dest_id][1])
+            for _, _, dest_id in sorted(listed)[:n]]
+
+
+def events_of(ratings, times):
+    dest_ids = sorted({dest_id for _, dest_id in ratings})
+    keys = list(ratings)
+    return (dest_ids, [dest_ids.index(dest_id) for _, dest_id in keys], [ratings[key] for key in keys],
+            [times.get(key, 0) for key in keys])
+
+
+def test_skip_list_stays_sorted():
+    rng = random.Random(1)
+    skiplist, keys = SkipList(rng), []
+    for _ in range(2000):
+        if keys and rng.random() < 0.4:
+            key = keys.pop(rng.randrange(len(keys)))
+            skiplist.remove(key)
+        else:
+            key = (rng.random(), rng.randrange(5))
+            skiplist.insert(key)
+            keys.append(key)
+        assert len(skiplist) == len(keys)
+    assert list(skiplist) == sorted(keys)
+    with pytest.raises(KeyError):
+        skiplist.remove((2.0, 0))
+
+    rebuilt = SkipList.from_sorted(sorted(keys), rng)
+    assert list(rebuilt) == sorted(keys) and len(rebuilt) == len(keys)
+    rebuilt.insert((-1.0, 0))
+    rebuilt.remove(sorted(keys)[0])
+    assert list(rebuilt) == sorted([(-1.0, 0)] + sorted(keys)[1:])
+
+
+@pytest.mark.parametrize("pattern", [(None, None, None), ("beach", None, None), ("city", "europe", None),
+                                     (None, None, "high"), ("city", "asia", "low")])
+def test_rating_updates_match_brute_force(pattern):
+    rng = np.random.default_rng(2)
+    boards, ratings = Leaderboards(boards_of), {}
+    for _ in range(400):
+        key = (f"u{rng.integers(30)}", f"d{rng.integers(14)}")  # d12 and d13 are not in the catalog
+        stars = int(rng.integers(1, 6))
+        boards.record(key[1], stars, ratings.get(key), NOW)
+        ratings[key] = stars
+        assert boards.top_rated(pattern, 5) == expected_top_rated(ratings, pattern, 5)
+    expected = expected_top_rated(ratings, pattern, 20)
+    assert boards.top_rated(pattern, 20) == expected
+
+    rebuilt = Leaderboards(boards_of)
+    rebuilt.rebuild(*events_of(ratings, {}))
+    assert rebuilt.top_rated(pattern, 20) == expected
+    assert rebuilt.trending(pattern, 20) == []  # no rating times, no popularity
+
+
+def test_destinations_are_listed_once_and_refiled():
+    boards = Leaderboards(boards_of)
+    boards.record("d11", 5, ts=NOW)
+    boards.record("d12", 4, ts=NOW)
+    assert [dest_id for dest_id, *_ in boards.top_rated((None, None, None))] == ["d11"]
+    assert [dest_id for dest_id, _ in boards.trending(("city", "europe", "medium"), now=NOW)] == ["d11"]
+    assert boards.top_rated(("city", "europe", "low")) == []
+
+    BOARDS["d12"] = [("city", "europe", "low")]
+    try:
+        boards.refile(["d12"])
+        assert boards.top_rated((None, None, None)) == [("d11", 5.0, 1), ("d12", 4.0, 1)]
+        assert boards.top_rated(("city", "europe", "low")) == [("d12", 4.0, 1)]
+    finally:
+        del BOARDS["d12"]
+    boards.refile()
+    assert len(boards) == 1 and boards.top_rated(("city", None, None)) == [("d11", 5.0, 1)]
+
+
+def test_trending_decays_in_log_space():
+    boards = Leaderboards(boards_of, half_life_days=7.0)
+    week = 7 * DAY
+    ratings = {("u1", "d1"): 5, ("u2", "d3"): 5, ("u3", "d3"): 5, ("u1", "d5"): 1}
+    times = {("u1", "d1"): NOW, ("u2", "d3"): NOW - week, ("u3", "d3"): NOW - 2 * week, ("u1", "d5"): NOW}
+    for key, stars in ratings.items():
+        boards.record(key[1], stars, ts=times[key])
+
+    # A rating one half-life old counts half, two half-lives old a quarter.
+    trending = boards.trending((None, None, None), now=NOW)
+    assert [dest_id for dest_id, _ in trending] == ["d1", "d3", "d5"]
+    assert np.allclose([popularity for _, popularity in trending], [1.0, 0.75, 0.2])
+    later = boards.trending((None, None, None), now=NOW + week)
+    assert [dest_id for dest_id, _ in later] == ["d1", "d3", "d5"]
+    assert np.allclose([popularity for _, popularity in later], [0.5, 0.375, 0.1])
+    assert all(math.isfinite(popularity) for _, popularity in later)
+
+    rebuilt = Leaderboards(boards_of, half_life_days=7.0)
+    rebuilt.rebuild(*events_of(ratings, times))
+    assert [dest_id for dest_id, _ in rebuilt.trending((None, None, None), now=NOW)] == ["d1", "d3", "d5"]
+    assert np.allclose([popularity for _, popularity in rebuilt.trending((None, None, None), now=NOW)],
+                       [popularity for _, popularity in trending])
+
+    # A replaced rating keeps its share as a second rating event.
+    boards.record("d5", 5, previous=1, ts=NOW)
+    assert boards.trending(("beach", None, None), 1, now=NOW) == [("d5", pytest.approx(1.2))]
+    assert ("d5", 5.0, 1) in boards.top_rated(("beach", None, None))
@@ -0,0 +1,77 @@
+import sys
+import threading
+import time
+
+from metrics import Metrics, SamplingProfiler
+
+
+def test_counters_and_stages():
+    metrics = Metrics()
+    metrics.count("cache_hits")
+    metrics.count("cache_hits", 2)
+    for _ in range(2):
+        with metrics.stage("rank"):
+            pass
+    snap = metrics.snapshot()
+    assert snap["counters"] == {"cache_hits": 3}
+    assert snap["stages"]["rank"]["count"] == 2
+    assert 0 <= snap["stages"]["rank"]["max_s"] <= snap["stages"]["rank"]["total_s"]
+
+    text = metrics.prometheus()
+    assert "# TYPE travel_cache_hits_total counter\ntravel_cache_hits_total 3\n" in text
+    assert 'travel_stage_seconds_count{stage="rank"} 2\n' in text
+    assert 'travel_stage_seconds_max{stage="rank"}' in text
+
+    metrics.reset()
+    assert metrics.snapshot() == {"counters": {}, "stages": {}}
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False)
+    metrics.count("cache_hits")
+    with metrics.stage("rank"):
+        pass
+    assert metrics.snapshot() == {"counters": {}, "stages": {}}
+    assert metrics.prometheus() == "\n"
+    metrics.enable()
+    metrics.count("cache_hits")
+    assert metrics.snapshot()["counters"] == {"cache_hits": 1}
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_profiler_samples_the_entering_thread():
+    with SamplingProfiler(interval=0.001) as profiler:
+        busy_wait(0.2)
+    assert sum(profiler.samples.values()) > 0
+    # Only this thread's stacks, almost all of them inside busy_wait.
+    assert all("test_profiler_samples_the_entering_thread" in stack for stack in profiler.samples)
+    function, own, total = profiler.top(1)[0]
+    assert function.startswith("busy_wait (test_metrics.py:") and own <= total
+    stack, count = profiler.collapsed().splitlines()[0].rsplit(" ", 1)
+    assert profiler.samples[stack] == int(count)
+
+
+def test_overlapping_profilers_restore_the_switch_interval():
+    original = sys.getswitchinterval()
+    entered, release = threading.Event(), threading.Event()
+
+    def other():
+        with SamplingProfiler(interval=0.002):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    entered.wait()
+    with SamplingProfiler(interval=0.001):
+        assert sys.getswitchinterval() == min(original, 0.001)
+        # The other profiler exits first; this one's interval still applies.
+        release.set()
+        thread.join()
+        assert sys.getswitchinterval() == min(original, 0.001)
+    assert sys.getswitchinterval() == original
@@ -0,0 +1,133 @@
+import json
+
+import numpy as np
+import pytest
+
+from rating_matrix import RatingMatrix, RatingTimes, UserRatings
+from user_store import JournaledUserStore
+
+
+def random_ratings(n_users=40, n_dests=30, seed=0):
+    rng = np.random.default_rng(seed)
+    return {f"u{u}": {f"d{d}": int(rng.integers(1, 6)) for d in rng.choice(n_dests, rng.integers(0, 8), replace=False)}
+            for u in range(n_users)}
+
+
+def contents(matrix):
+    ratings = {}
+    for username, dest_id, rating in matrix.iter_ratings():
+        assert dest_id not in ratings.setdefault(username, {})
+        ratings[username][dest_id] = rating
+    return ratings
+
+
+def expected_totals(ratings):
+    totals = {}
+    for user_ratings in ratings.values():
+        for dest_id, rating in user_ratings.items():
+            total, count = totals.get(dest_id, (0, 0))
+            totals[dest_id] = (total + rating, count + 1)
+    return totals
+
+
+@pytest.mark.parametrize("merge_every", [1, 7, 10000])
+def test_buffered_writes_match_a_dict(merge_every):
+    ratings = random_ratings()
+    matrix = RatingMatrix.from_ratings(ratings.items(), merge_every=merge_every)
+    rng = np.random.default_rng(1)
+    for _ in range(300):
+        username, dest_id = f"u{rng.integers(45)}", f"d{rng.integers(35)}"
+        rating = int(rng.integers(0, 6))
+        previous = ratings.get(username, {}).get(dest_id)
+        if rating:
+            assert matrix.set(username, dest_id, rating) == previous
+            ratings.setdefault(username, {})[dest_id] = rating
+        elif previous is not None:
+            assert matrix.set(username, dest_id, 0) == previous
+            del ratings[username][dest_id]
+        assert matrix.get(username, dest_id) == (rating or None)
+
+    ratings = {username: user_ratings for username, user_ratings in ratings.items() if user_ratings}
+    for _ in range(2):
+        assert contents(matrix) == ratings
+        assert matrix.totals() == expected_totals(ratings)
+        for username, user_ratings in ratings.items():
+            assert matrix.rows()[matrix.user_of[username]] == user_ratings
+        matrix.merge()
+    assert not matrix._buffer
+    indptr, items, _, _ = matrix._csr
+    assert all(np.all(np.diff(items[lo:hi]) > 0) for lo, hi in zip(indptr[:-1], indptr[1:]))
+
+
+def test_rerating_replaces_the_stored_rating():
+    matrix = RatingMatrix.from_ratings([("amy", {"d1": 4, "d2": 2})])
+    view = matrix.rows()[0]
+    assert view.rate("d1", 5) == 4
+    assert view.rate("d1", 3) == 5
+    matrix.merge()
+    assert view.rate("d1", 1) == 3
+    assert dict(view.items()) == {"d1": 1, "d2": 2}
+    assert matrix.totals() == {"d1": (1, 1), "d2": (2, 1)}
+    assert len(list(matrix.iter_ratings())) == 2
+
+
+def test_user_ratings_view_behaves_like_a_dict():
+    matrix = RatingMatrix(merge_every=3)
+    view = matrix.add_user("amy")
+    other = matrix.add_user("bob")
+    view["d1"] = 4
+    other["d1"] = 2
+    view["d2"] = 5
+    assert isinstance(view, UserRatings)
+    assert view == {"d1": 4, "d2": 5} and other == {"d1": 2}
+    assert len(view) == 2 and sorted(view) == ["d1", "d2"]
+    assert view["d1"] == 4 and view.get("d3") is None and view.get("d3", 0) == 0
+    assert "d2" in view and "d9" not in view
+    with pytest.raises(KeyError):
+        view["d9"]
+    del view["d1"]
+    with pytest.raises(KeyError):
+        del view["d1"]
+    assert view == {"d2": 5}
+    with pytest.raises(ValueError):
+        view["d3"] = 0
+    assert json.dumps(view, default=dict) == '{"d2": 5}'
+
+
+def test_snapshot_round_trips_through_the_matrix(tmp_path):
+    path = str(tmp_path / "users.json")
+    ratings = random_ratings(seed=2)
+    with open(path, "w") as f:
+        json.dump({username: {"password": "h", "preferences": None, "ratings": user_ratings}
+                   for username, user_ratings in ratings.items()}, f)
+
+    store = JournaledUserStore(path, compact_every=25)
+    assert isinstance(store["u0"]["ratings"], UserRatings)
+    assert {username: dict(store[username]["ratings"]) for username in store} == ratings
+    for i in range(60):
+        username, dest_id = f"u{i % 40}", f"d{i % 33}"
+        store.rate(username, dest_id, i % 5 + 1)
+        ratings[username][dest_id] = i % 5 + 1
+    store.compact()
+    store.close()
+
+    with open(path) as f:
+        assert {username: record["ratings"] for username, record in json.load(f).items()} == ratings
+    reopened = JournaledUserStore(path)
+    assert {username: dict(reopened[username]["ratings"]) for username in reopened} == ratings
+    assert reopened.rating_totals() == expected_totals(ratings)
+
+
+def test_rating_times_follow_their_ratings_through_merges():
+    matrix = RatingMatrix.from_ratings([("amy", {"d1": 4, "d2": 2}, {"d1": 100}), ("bob", {"d1": 3})], merge_every=1000)
+    matrix.set("bob", "d2", 5, 200)
+    matrix.set("amy", "d1", 1, 300)
+    matrix.set("amy", "d2", 0)
+    for _ in range(2):
+        times = RatingTimes(matrix, matrix.user_of["amy"])
+        assert dict(times) == {"d1": 300} and "d2" not in times
+        assert dict(RatingTimes(matrix, matrix.user_of["bob"])) == {"d2": 200}
+        items, stars, seconds = matrix.events()
+        assert sorted(zip((matrix.dest_ids[d] for d in items), stars.tolist(), seconds.tolist())) == [
+            ("d1", 1, 300), ("d1", 3, 0), ("d2", 5, 200)]
+        matrix.merge()
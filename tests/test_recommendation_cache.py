@@ -0,0 +1,89 @@
+import smart_travel_app as app
+
+PREFS = {"trip_type": "beach", "budget": {"price_range": [0, 300]}, "activities": ["surfing"],
+         "accommodation": "Hotel", "cuisine": ["local"], "travel_season": "summer"}
+
+
+def make_catalog():
+    destinations = {}
+    for i in range(500):
+        destinations[f"d{i}"] = {
+            "name": f"Destination {i}", "type": ("beach", "city")[i % 2], "region": "europe",
+            "location": "Somewhere", "tags": {},
+            "activities": ["Surfing", "Spa"][:1 + i % 2], "cuisines": ["Local", "Seafood"][:1 + i % 3 // 2],
+            "price": 50 + (i * 37) % 600, "accommodation": ["Hotel", "Villa"][i % 2:],
+            "ideal_weather": ["sunny", "mild"][:1 + i % 2],
+        }
+    catalog = app.CompiledCatalog(destinations)
+    return catalog, app.RatingIndex(catalog).scores
+
+
+def test_pool_is_cached_on_second_request():
+    catalog, rating_scores = make_catalog()
+    cache = app.RecommendationCache()
+    assert cache.get_or_score(catalog, PREFS, "sunny", rating_scores) is None
+    pool = cache.get_or_score(catalog, PREFS, "sunny", rating_scores)
+    assert pool is not None
+    assert cache.get_or_score(catalog, PREFS, "sunny", rating_scores) is pool
+    assert cache.stats()["hits"] == 1
+
+
+def test_rating_during_scoring_is_not_cached(monkeypatch):
+    catalog, rating_scores = make_catalog()
+    cache = app.RecommendationCache()
+    dest = catalog.records[int(next(catalog.candidate_chunks(PREFS))[0])]
+    score_candidates = catalog.score_candidates
+
+    def rated_meanwhile(*args):
+        # Another thread's apply_rating lands while this pool is being scored.
+        pool = score_candidates(*args)
+        cache.invalidate_destination(dest)
+        return pool
+
+    monkeypatch.setattr(catalog, "score_candidates", rated_meanwhile)
+    cache.get_or_score(catalog, PREFS, "sunny", rating_scores)
+    assert cache.get_or_score(catalog, PREFS, "sunny", rating_scores) is not None
+    assert cache.stats()["entries"] == 0
+
+    monkeypatch.setattr(catalog, "score_candidates", score_candidates)
+    cache.get_or_score(catalog, PREFS, "sunny", rating_scores)
+    pool = cache.get_or_score(catalog, PREFS, "sunny", rating_scores)
+    assert cache.stats()["entries"] == 1
+    cache.invalidate_destination(dest)
+    assert cache.stats()["entries"] == 0
+    assert cache.get_or_score(catalog, PREFS, "sunny", rating_scores) is not pool
+
+
+def test_clear_during_scoring_is_not_cached(monkeypatch):
+    catalog, rating_scores = make_catalog()
+    cache = app.RecommendationCache()
+    score_candidates = catalog.score_candidates
+
+    def cleared_meanwhile(*args):
+        pool = score_candidates(*args)
+        cache.clear()
+        return pool
+
+    cache.get_or_score(catalog, PREFS, "sunny", rating_scores)
+    monkeypatch.setattr(catalog, "score_candidates", cleared_meanwhile)
+    assert cache.get_or_score(catalog, PREFS, "sunny", rating_scores) is not None
+    assert cache.stats()["entries"] == 0
+
+
+def test_large_pools_are_left_to_the_caller():
+    catalog, rating_scores = make_catalog()
+    cache = app.RecommendationCache(max_rows=10)
+    for _ in range(3):
+        assert cache.get_or_score(catalog, PREFS, "sunny", rating_scores) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_personalized_scores_match_the_cursor():
+    catalog, rating_scores = make_catalog()
+    pool = catalog.score_candidates(PREFS, "sunny", rating_scores)
+    personal = {catalog.ids[int(pool.rows[0])]: 1, catalog.ids[int(pool.rows[3])]: 1, "d1": 4}
+    scores = pool.personalized(personal)
+    assert pool.personalized() is pool.scores
+    assert scores[0] < pool.scores[0] and scores[3] < pool.scores[3]
+    by_id = {catalog.ids[int(row)]: int(score) for row, score in zip(pool.rows, scores)}
+    assert {rec["id"]: rec["score"] for rec in pool.cursor(personal).next_page(len(pool))} == by_id
@@ -0,0 +1,376 @@
+"""Vectorized scoring against the original per-destination loop."""
+import functools
+import io
+import random
+from contextlib import redirect_stdout
+
+import numpy as np
+import pytest
+
+import smart_travel_app as app
+
+WEATHER_MAP = {"summer": "sunny", "winter": "snowy", "spring": "mild", "fall": "rainy"}
+ACTIVITY_GROUPS = {
+    "beach": ["Surfing", "Snorkeling", "Spa"],
+    "mountain": ["Skiing", "Snowboarding", "Mountain climbing"],
+    "city": ["Shopping", "Museums", "City tours"],
+}
+CUISINES = ["Local", "Vegetarian", "Seafood", "Street food", "Meat", "Vegan"]
+ACCOMMODATIONS = ["Hotel", "Villa", "Apartment"]
+BUDGET_RANGES = [(0, 300), (300, 500), (500, 9999)]
+WEATHERS = ["sunny", "snowy", "mild", "rainy", "warm"]
+
+
+def loop_recommendations(destinations, users, username, prefs):
+    """Every recommendation of the original loop, best first."""
+    season = prefs.get("travel_season", "summer")
+    weather = WEATHER_MAP.get(season.lower(), "mild")
+    recommendations = []
+    budget_min, budget_max = prefs["budget"]["price_range"]
+
+    for dest_id, dest in destinations.items():
+        if not (budget_min <= dest["price"] <= budget_max):
+            continue
+        if dest["type"] != prefs["trip_type"]:
+            continue
+
+        user_activities = set(act.lower() for act in prefs["activities"])
+        dest_activities = set(act.lower() for act in dest["activities"])
+        matched_activities = list(user_activities & dest_activities)
+        if not matched_activities and dest["activities"]:
+            matched_activities = [dest["activities"][0].lower()]
+        if not matched_activities:
+            continue
+
+        common_cuisines = set(prefs["cuisine"]) & set([c.lower() for c in dest["cuisines"]])
+        matching_accom = prefs["accommodation"] in dest["accommodation"]
+        if not (matched_activities or common_cuisines or matching_accom):
+            continue
+
+        activity_score = len(matched_activities) / max(1, len(prefs["activities"]))
+        cuisine_score = len(common_cuisines) / max(1, len(prefs["cuisine"]))
+        accom_score = 1.0 if matching_accom else 0.5
+        weather_boost = 1.5 if weather in dest["ideal_weather"] else 0.8
+
+        rating_score = 1.0
+        if dest_id in users[username]["ratings"]:
+            rating_score = users[username]["ratings"][dest_id] / 5.0
+        elif any(dest_id in user["ratings"] for user in users.values()):
+            total_ratings = sum(user["ratings"].get(dest_id, 0) for user in users.values())
+            rating_count = sum(1 for user in users.values() if dest_id in user["ratings"])
+            rating_score = (total_ratings / rating_count) / 5.0
+
+        total_score = (
+                0.25 * activity_score +
+                0.25 * cuisine_score +
+                0.2 * weather_boost +
+                0.15 * accom_score +
+                0.15 * rating_score
+        )
+        recommendations.append({
+            "id": dest_id,
+            "name": dest["name"],
+            "location": dest["location"],
+            "score": min(100, round(total_score * 100)),
+            "price": dest["price"],
+            "weather": "Ideal" if weather in dest["ideal_weather"] else "Good",
+            "matched_activities": matched_activities,
+            "matched_cuisines": list(common_cuisines),
+            "accommodation": dest["accommodation"],
+        })
+    recommendations.sort(key=lambda x: x["score"], reverse=True)
+    return recommendations
+
+
+def comparable(recommendations):
+    return [dict(rec, matched_activities=sorted(rec["matched_activities"]),
+                 matched_cuisines=sorted(rec["matched_cuisines"])) for rec in recommendations]
+
+
+def random_destinations(rng, n):
+    """Destinations shaped like the catalog's, with its mixed casing and budget-edge prices."""
+    destinations = {}
+    for i in range(1, n + 1):
+        trip_type = rng.choice(list(ACTIVITY_GROUPS))
+        activities = rng.sample(ACTIVITY_GROUPS[trip_type], rng.randint(0, 3))
+        if rng.random() < 0.1:
+            activities.append(rng.choice(ACTIVITY_GROUPS[rng.choice(list(ACTIVITY_GROUPS))]))
+        cuisines = rng.sample(CUISINES, rng.randint(0, 3))
+        destinations[f"d{i}"] = {
+            "name": f"Destination {i}",
+            "type": trip_type,
+            "region": rng.choice(["europe", "asia", "americas"]),
+            "location": f"Town {i}, Country",
+            "price": rng.choice([rng.randint(20, 1200), 300, 500]),
+            "tags": {trip_type: 0.8},
+            "ideal_weather": rng.sample(WEATHERS, rng.randint(1, 2)),
+            "activities": activities,
+            "accommodation": rng.sample(ACCOMMODATIONS, rng.randint(1, 3)),
+            "cuisines": [c.lower() if rng.random() < 0.3 else c for c in cuisines],
+        }
+    return destinations
+
+
+def random_prefs(rng):
+    """Questionnaire answers, plus the odd casing and repeats hand-written profiles have."""
+    trip_type = rng.choice(["beach", "mountain", "city", "Beach"])
+    group = ACTIVITY_GROUPS.get(trip_type, ACTIVITY_GROUPS["beach"])
+    activities = rng.sample(group, rng.randint(1, len(group)))
+    activities = [act.lower() if rng.random() < 0.7 else act for act in activities]
+    if rng.random() < 0.1:
+        activities.append(activities[0])
+    cuisines = [c.lower() for c in rng.sample(CUISINES, rng.randint(0, 3))]
+    if cuisines and rng.random() < 0.2:
+        cuisines[0] = cuisines[0].capitalize()
+    if rng.random() < 0.8:
+        price_range = list(rng.choice(BUDGET_RANGES))
+    else:
+        price_range = sorted(rng.sample(range(0, 1600), 2))
+    return {
+        "trip_type": trip_type,
+        "budget": {"price_range": price_range},
+        "activities": activities,
+        "accommodation": rng.choice(ACCOMMODATIONS + ["hotel", "Hostel"]),
+        "cuisine": cuisines,
+        "travel_season": rng.choice(list(WEATHER_MAP) + ["monsoon"]),
+    }
+
+
+def random_users(rng, dest_ids, n_users):
+    return {f"user{u}": {"password": "hash", "preferences": {},
+                         "ratings": {dest_id: rng.randint(1, 5)
+                                     for dest_id in rng.sample(dest_ids, rng.randint(0, 30))}}
+            for u in range(n_users)}
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_cursor_pages_match_loop(seed):
+    rng = random.Random(seed)
+    destinations = random_destinations(rng, 1500)
+    catalog = app.CompiledCatalog(destinations)
+    # Small chunks, so pages are merged across many of them.
+    catalog.candidate_chunks = functools.partial(catalog.candidate_chunks, chunk_size=37)
+    users = random_users(rng, list(destinations), 40)
+    rating_index = app.RatingIndex(catalog)
+    rating_index.rebuild(users)
+    for _ in range(40):
+        prefs = random_prefs(rng)
+        username = rng.choice(list(users))
+        weather = WEATHER_MAP.get(prefs["travel_season"], "mild")
+        expected = loop_recommendations(destinations, users, username, prefs)
+        ratings = users[username]["ratings"]
+        cursor = catalog.cursor(prefs, weather, rating_index.scores, ratings)
+        assert len(cursor) == len(expected)
+        pages = []
+        while cursor.remaining:
+            pages += cursor.next_page(rng.randint(1, 50))
+        assert comparable(pages) == comparable(expected)
+        assert cursor.next_page() == []
+        k = rng.randint(1, 10)
+        assert comparable(catalog.top_k(prefs, weather, rating_index.scores, ratings, k)) == comparable(expected[:k])
+
+
+def test_cached_pool_pages_match_loop():
+    rng = random.Random(3)
+    destinations = random_destinations(rng, 1500)
+    catalog = app.CompiledCatalog(destinations)
+    users = random_users(rng, list(destinations), 40)
+    rating_index = app.RatingIndex(catalog)
+    rating_index.rebuild(users)
+    for _ in range(40):
+        prefs = random_prefs(rng)
+        username = rng.choice(list(users))
+        weather = WEATHER_MAP.get(prefs["travel_season"], "mild")
+        expected = loop_recommendations(destinations, users, username, prefs)
+        pool = catalog.score_candidates(prefs, weather, rating_index.scores)
+        # Small chunks, so the user's ratings are applied across many of them.
+        pool.chunks = functools.partial(pool.chunks, chunk_size=37)
+        cursor = pool.cursor(users[username]["ratings"])
+        assert len(cursor) == len(expected)
+        pages = []
+        while cursor.remaining:
+            pages += cursor.next_page(rng.randint(1, 50))
+        assert comparable(pages) == comparable(expected)
+
+
+@pytest.mark.parametrize("strategy", app.GROUP_STRATEGIES)
+def test_group_top_k_matches_loop(strategy):
+    rng = random.Random(7)
+    destinations = random_destinations(rng, 1500)
+    dest_ids = list(destinations)
+    catalog = app.CompiledCatalog(destinations)
+    users = random_users(rng, dest_ids, 40)
+    rating_index = app.RatingIndex(catalog)
+    rating_index.rebuild(users)
+    aggregate = {"average": sum, "least_misery": min, "most_pleasure": max}[strategy]
+    for _ in range(20):
+        usernames = rng.sample(list(users), rng.randint(1, 4))
+        prefs = [random_prefs(rng) for _ in usernames]
+        # Each member is scored within the budget every member can afford.
+        budget = [max(p["budget"]["price_range"][0] for p in prefs), min(p["budget"]["price_range"][1] for p in prefs)]
+        scores = {}
+        for m, (username, member_prefs) in enumerate(zip(usernames, prefs)):
+            member_prefs = dict(member_prefs, budget={"price_range": budget})
+            for rec in loop_recommendations(destinations, users, username, member_prefs):
+                scores.setdefault(rec["id"], [0] * len(usernames))[m] = rec["score"]
+        expected = sorted(scores.items(), key=lambda item: (-aggregate(item[1]), -sum(item[1]),
+                                                            dest_ids.index(item[0])))
+        members = [(p, WEATHER_MAP.get(p["travel_season"], "mild"),
+                    catalog.personal_scores(users[username]["ratings"]))
+                   for username, p in zip(usernames, prefs)]
+        k = rng.randint(1, 10)
+        picks = catalog.group_top_k(members, rating_index.scores, strategy, k)
+        assert [(catalog.ids[row], member_scores) for row, member_scores in picks] == expected[:k]
+
+
+def test_vocabularies_past_64_terms_match_loop():
+    rng = random.Random(6)
+    destinations = random_destinations(rng, 800)
+    # Enough distinct activities and cuisines that their masks need several words.
+    extra_activities = [f"Activity {i}" for i in range(150)]
+    extra_cuisines = [f"cuisine {i}" for i in range(100)]
+    for dest in destinations.values():
+        dest["activities"] += rng.sample(extra_activities, rng.randint(0, 4))
+        dest["cuisines"] += rng.sample(extra_cuisines, rng.randint(0, 4))
+    catalog = app.CompiledCatalog(destinations)
+    assert catalog.activities.shape[1] == 3 and catalog.cuisines.shape[1] == 2
+    users = random_users(rng, list(destinations), 10)
+    rating_index = app.RatingIndex(catalog)
+    rating_index.rebuild(users)
+    for _ in range(40):
+        prefs = random_prefs(rng)
+        prefs["activities"] += [act.lower() for act in rng.sample(extra_activities, rng.randint(0, 5))]
+        prefs["cuisine"] += rng.sample(extra_cuisines, rng.randint(0, 5))
+        weather = WEATHER_MAP.get(prefs["travel_season"], "mild")
+        expected = loop_recommendations(destinations, users, "user0", prefs)
+        cursor = catalog.cursor(prefs, weather, rating_index.scores, users["user0"]["ratings"])
+        assert comparable(cursor.next_page(len(expected))) == comparable(expected)
+
+
+def test_cursor_pages_see_ratings_made_in_between():
+    rng = random.Random(9)
+    destinations = random_destinations(rng, 600)
+    catalog = app.CompiledCatalog(destinations)
+    rating_index = app.RatingIndex(catalog)
+    prefs = {"trip_type": "beach", "budget": {"price_range": [0, 9999]}, "activities": ["surfing"],
+             "accommodation": "Hotel", "cuisine": ["local"], "travel_season": "summer"}
+    cursor = catalog.cursor(prefs, "sunny", rating_index.scores, {})
+    first = cursor.next_page(5)
+    # A one-star rating pushes what would have been the next result down.
+    upcoming = catalog.top_k(prefs, "sunny", rating_index.scores, {}, k=6)[5]
+    rating_index.record(upcoming["id"], 1)
+    second = cursor.next_page(5)
+    assert upcoming["id"] not in [rec["id"] for rec in first + second[:1]]
+    assert not {rec["id"] for rec in first} & {rec["id"] for rec in second}
+
+
+def test_index_candidates_match_filter():
+    rng = random.Random(4)
+    destinations = random_destinations(rng, 800)
+    records = list(destinations.values())
+    catalog = app.CompiledCatalog(destinations)
+    for _ in range(100):
+        trip_type = rng.choice(list(ACTIVITY_GROUPS) + ["desert"])
+        budget_min, budget_max = rng.choice([(0, 300), (300, 500), tuple(sorted(rng.sample(range(0, 1300), 2)))])
+        expected = [row for row, dest in enumerate(records) if dest["type"] == trip_type
+                    and budget_min <= dest["price"] <= budget_max and dest["activities"]]
+        rows = catalog.index.candidates(trip_type, budget_min, budget_max)
+        assert sorted(rows.tolist()) == expected
+        assert (np.diff(catalog.price[rows]) >= 0).all()
+    for value, rows in catalog.index.postings["cuisines"].items():
+        assert rows.tolist() == [row for row, dest in enumerate(records)
+                                 if value in {c.lower() for c in dest["cuisines"]}]
+
+
+def test_recorded_ratings_match_rebuild():
+    rng = random.Random(5)
+    destinations = random_destinations(rng, 200)
+    catalog = app.CompiledCatalog(destinations)
+    users = random_users(rng, list(destinations), 10)
+    rating_index = app.RatingIndex(catalog)
+    rating_index.rebuild(users)
+    for _ in range(500):
+        # Overwrites and ratings for destinations no longer in the catalog included.
+        ratings = users[rng.choice(list(users))]["ratings"]
+        dest_id = rng.choice(list(destinations) + ["gone1", "gone2"])
+        rating = rng.randint(1, 5)
+        rating_index.record(dest_id, rating, ratings.get(dest_id))
+        ratings[dest_id] = rating
+    rebuilt = app.RatingIndex(catalog)
+    rebuilt.rebuild(users)
+    assert (rating_index.totals == rebuilt.totals).all() and (rating_index.counts == rebuilt.counts).all()
+    assert (rating_index.scores == rebuilt.scores).all()
+    for dest_id in list(destinations) + ["gone1", "gone2", "never"]:
+        assert rating_index.average(dest_id) == rebuilt.average(dest_id)
+
+
+def test_score_table_head_matches_streaming():
+    rng = random.Random(4)
+    destinations = random_destinations(rng, 1500)
+    catalog = app.CompiledCatalog(destinations)
+    tables = app.ScoreTables.build(catalog, depth=10)
+    users = random_users(rng, list(destinations), 40)
+    rating_index = app.RatingIndex(catalog)
+    rating_index.rebuild(users)
+    covered = 0
+    for _ in range(150):
+        prefs = random_prefs(rng)
+        ratings = users[rng.choice(list(users))]["ratings"]
+        weather = WEATHER_MAP.get(prefs["travel_season"], "mild")
+        head = tables.head(prefs, weather, rating_index.scores, ratings)
+        if head is None:
+            continue
+        covered += 1
+        with_tables = catalog.cursor(prefs, weather, rating_index.scores, ratings, None, head)
+        streamed = catalog.cursor(prefs, weather, rating_index.scores, ratings)
+        # The last page runs past the tables' depth, so it streams too.
+        for size in (3, 4, 3, 5):
+            assert with_tables.next_page(size) == streamed.next_page(size)
+        assert tables.top_k(prefs, weather, rating_index.scores, ratings, 5) == \
+            catalog.top_k(prefs, weather, rating_index.scores, ratings, 5)
+    assert covered >= 5
+
+
+def test_score_tables_are_saved_for_one_catalog(tmp_path):
+    rng = random.Random(5)
+    destinations = random_destinations(rng, 300)
+    catalog = app.CompiledCatalog(destinations)
+    tables = app.ScoreTables.build(catalog, depth=5)
+    path = str(tmp_path / "tables.npz")
+    tables.save(path)
+    loaded = app.ScoreTables.load(path, catalog)
+    assert loaded.depth == 5
+    for name in ("indptr", "rows", "codes", "values"):
+        assert np.array_equal(getattr(loaded, name), getattr(tables, name))
+
+    destinations["d1"] = dict(destinations["d1"], price=destinations["d1"]["price"] + 1)
+    with pytest.raises(ValueError, match="different catalog"):
+        app.ScoreTables.load(path, app.CompiledCatalog(destinations))
+
+
+def test_get_recommendations_matches_loop(monkeypatch):
+    rng = random.Random(11)
+    destinations = random_destinations(rng, 400)
+    users = random_users(rng, list(destinations), 10)
+    catalog = app.CompiledCatalog(destinations)
+    rating_index = app.RatingIndex(catalog)
+    rating_index.rebuild(users)
+    monkeypatch.setattr(app, "CATALOG", catalog)
+    monkeypatch.setattr(app, "RATING_INDEX", rating_index)
+    monkeypatch.setattr(app, "USERS", users)
+    monkeypatch.setattr(app, "RECOMMENDATION_CACHE", app.RecommendationCache())
+    # The loop knows nothing of predicted ratings.
+    monkeypatch.setattr(app, "ITEM_NEIGHBORS", app.ItemNeighbors(catalog.ids))
+    companion = app.TravelCompanion()
+    companion.current_user = "user0"
+    for _ in range(40):
+        prefs = random_prefs(rng)
+        users["user0"]["preferences"] = prefs
+        expected = loop_recommendations(destinations, users, "user0", prefs)[:3]
+        # Scored chunk by chunk the first time, from the cached pool the second.
+        for _ in range(2):
+            companion.last_recommendations = []
+            with redirect_stdout(io.StringIO()):
+                companion.get_recommendations()
+            assert comparable(companion.last_recommendations) == comparable(expected)
+    assert app.RECOMMENDATION_CACHE.stats()["entries"] > 0
@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+from sessions import PasswordVerifier, SessionTable, VerifierBusy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_tokens_expire_after_ttl():
+    clock = Clock()
+    table = SessionTable(ttl=100, clock=clock)
+    token = table.issue("amy")
+    other = table.issue("bob")
+    assert token != other and len(table) == 2
+    clock.now = 99
+    assert table.get(token) == "amy"
+    clock.now = 100
+    assert table.get(other) is None
+    assert table.get("unknown") is None
+    assert len(table) == 1
+
+
+def test_use_in_the_second_half_renews():
+    clock = Clock()
+    table = SessionTable(ttl=100, clock=clock)
+    token = table.issue("amy")
+    clock.now = 40
+    assert table.get(token) == "amy"  # first half: the deadline stays at 100
+    clock.now = 60
+    assert table.get(token) == "amy"  # second half: renewed until 160
+    clock.now = 150
+    # The heap entry for the old deadline surfaced and was skipped as stale.
+    assert table.evict_expired() == 0
+    assert table.get(token) == "amy"
+    clock.now = 260
+    assert table.evict_expired() == 1
+    assert table.get(token) is None and len(table) == 0
+
+
+def test_revoke_and_stale_heap_entries():
+    clock = Clock()
+    table = SessionTable(ttl=10, clock=clock)
+    token = table.issue("amy")
+    assert table.revoke(token) == "amy"
+    assert table.revoke(token) is None
+    assert table.get(token) is None
+    keep = table.issue("bob")
+    # Renewing every few ticks piles up stale entries; they are rebuilt away.
+    for _ in range(3000):
+        clock.now += 6
+        assert table.get(keep) == "bob"
+    assert len(table._expiry) <= 2 * len(table) + 1024
+
+
+def test_passwords_are_checked_on_worker_threads():
+    threads = []
+
+    def hash_password(password):
+        threads.append(threading.current_thread())
+        return "h:" + password
+
+    verifier = PasswordVerifier(hash_password, max_workers=2)
+    try:
+        assert verifier.hash("pw").result() == "h:pw"
+        assert verifier.submit("h:pw", "pw").result() is True
+        assert verifier.verify("h:pw", "other") is False
+        # Unknown users never match, but their check costs a hash all the same.
+        assert verifier.verify(None, "pw") is False
+    finally:
+        verifier.close()
+    assert len(threads) == 4
+    assert all(thread is not threading.main_thread() and thread.name.startswith("password")
+               for thread in threads)
+
+
+def test_verifier_refuses_work_beyond_max_pending():
+    release = threading.Event()
+
+    def slow_hash(password):
+        release.wait(5)
+        return password
+
+    verifier = PasswordVerifier(slow_hash, max_workers=1, max_pending=2)
+    try:
+        futures = [verifier.submit("pw", "pw"), verifier.submit("pw", "pw")]
+        with pytest.raises(VerifierBusy):
+            verifier.submit("pw", "pw")
+        release.set()
+        assert [future.result() for future in futures] == [True, True]
+        assert verifier.hash("pw").result(timeout=5) == "pw"
+    finally:
+        release.set()
+        verifier.close()
@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK = """
+import json, sys
+import smart_travel_app as app
+heavy = sorted(name for name in sys.modules if name.split(".")[0] in ("scipy", "sklearn"))
+print(json.dumps({"heavy": heavy, "users_loaded": app.USERS.loaded,
+                  "neighbors_numbered": app.ITEM_NEIGHBORS.item_of is not None}))
+app.ensure_users()
+print(json.dumps({"users_loaded": app.USERS.loaded, "users": len(app.USERS)}))
+"""
+
+
+def test_import_defers_heavy_modules_and_users(tmp_path):
+    with open(tmp_path / "users.json", "w") as f:
+        json.dump({"amy": {"password": "x", "preferences": {}, "ratings": {"beach_001": 4}}}, f)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, "-c", CHECK], cwd=tmp_path, env=env,
+                         capture_output=True, text=True, check=True).stdout.splitlines()
+    assert json.loads(out[0]) == {"heavy": [], "users_loaded": False, "neighbors_numbered": False}
+    assert json.loads(out[1]) == {"users_loaded": True, "users": 1}
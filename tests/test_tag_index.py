@@ -0,0 +1,67 @@
+"""The tag-similarity LSH index against brute-force cosine similarity."""
+import numpy as np
+
+import smart_travel_app as app
+from synthetic_data import generate_catalog
+from tag_index import TagIndex
+
+
+def cosines(records, tags):
+    """Exact cosine similarity of every record's tags to ``tags``."""
+    def unit(vector):
+        norm = sum(weight * weight for weight in vector.values()) ** 0.5
+        return {tag: weight / norm for tag, weight in vector.items()}
+
+    query = unit(tags)
+    return np.array([sum(weight * query.get(tag, 0.0) for tag, weight in unit(dest["tags"]).items())
+                     for dest in records])
+
+
+def recall(rows, sims, k):
+    # Equal tag vectors make the exact top k ambiguous, so a hit is any row
+    # at least as similar as the k-th best.
+    kth = np.sort(sims)[-k]
+    return np.sum(sims[rows] >= kth - 1e-6) / k
+
+
+def test_recall_against_brute_force():
+    catalog = app.CompiledCatalog(generate_catalog(3000, 7))
+    index = TagIndex.from_catalog(catalog)
+    rng = np.random.default_rng(8)
+    similar_recall, query_recall, candidates = [], [], []
+    for row in rng.integers(len(catalog), size=60).tolist():
+        tags = catalog.records[row]["tags"]
+        sims = cosines(catalog.records, tags)
+        rows, found = index.query(tags, 10)
+        assert np.allclose(found, sims[rows], atol=1e-5)
+        query_recall.append(recall(rows, sims, 10))
+        sims[row] = -1.0
+        similar_recall.append(recall(index.similar(row, 10)[0], sims, 10))
+        candidates.append(len(index._candidates(index._sigs[row], 11)))
+    assert np.mean(query_recall) >= 0.95
+    assert np.mean(similar_recall) >= 0.95
+    # The buckets, not a full scan, supply the candidates.
+    assert np.median(candidates) < len(catalog) / 10
+
+
+def test_pending_changes_are_found_before_a_merge():
+    index = TagIndex(merge_every=1000)
+    index.add(range(4), [{"beach": 1.0}, {"beach": 0.5, "city": 0.5}, {"city": 1.0}, {"mountain": 1.0}])
+    index.merge()
+    index.add([4], [{"beach": 2.0}])
+    index.add([2], [{"beach": 1.0, "mountain": 0.1}])
+    index.remove([1])
+    rows, sims = index.similar(0, 3)
+    assert rows.tolist() == [4, 2]
+    assert np.allclose(sims, [1.0, 1 / np.sqrt(1.01)])
+    assert len(index) == 4
+
+
+def test_dissimilar_rows_are_not_returned():
+    index = TagIndex()
+    index.add(range(3), [{"beach": 1.0}, {"city": 1.0}, {"city": 1.0, "museums": 1.0}])
+    index.merge()
+    rows, sims = index.query({"city": 1.0}, 5)
+    assert rows.tolist() == [1, 2] and np.all(sims > 0)
+    assert index.similar(0, 5)[0].tolist() == []
+    assert index.query({"skiing": 1.0}, 5)[0].tolist() == []
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import smart_travel_app as app
+from leaderboards import Leaderboards
+from sessions import PasswordVerifier, SessionTable
+from travel_service import TravelService
+
+PREFS = {"trip_type": "beach", "budget": {"price_range": [0, 1000]}, "activities": ["surfing"],
+         "accommodation": "Hotel", "cuisine": ["local"], "travel_season": "summer"}
+
+
+class Client:
+    """Raw HTTP/1.1 requests against a service listening on an ephemeral port."""
+
+    def __init__(self, port):
+        self.port = port
+
+    async def send(self, raw):
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(raw)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, body = response.split(b"\r\n\r\n", 1)
+        return int(head.split()[1]), json.loads(body)
+
+    async def request(self, method, path, body=None, token=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        headers = f"{method} {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n"
+        if token:
+            headers += f"Authorization: Bearer {token}\r\n"
+        headers += f"Content-Length: {len(data)}\r\n\r\n"
+        return await self.send(headers.encode() + data)
+
+    async def user(self, username):
+        """A session token for a new user with preferences."""
+        _, body = await self.request("POST", "/register", {"username": username, "password": "pw"})
+        status, _ = await self.request("PUT", "/preferences", {"preferences": PREFS}, body["token"])
+        assert status == 200
+        return body["token"]
+
+
+@pytest.fixture
+def run(store):
+    """Run ``scenario(client, service)`` against a service over ``store``."""
+    def run_scenario(scenario):
+        async def main():
+            service = TravelService(users=store)
+            server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+            try:
+                await scenario(Client(server.sockets[0].getsockname()[1]), service)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run(main())
+
+    return run_scenario
+
+
+def test_recommend_page_and_rate(run):
+    async def scenario(client, service):
+        token = await client.user("amy")
+        status, body = await client.request("GET", "/recommendations?k=2", token=token)
+        assert status == 200
+        first = body["recommendations"]
+        assert first == app.recommend(PREFS, {}, 2)
+        status, body = await client.request("GET", "/recommendations/next?k=2", token=token)
+        assert status == 200
+        assert not {rec["id"] for rec in first} & {rec["id"] for rec in body["recommendations"]}
+        dest_id = first[0]["id"]
+        assert (await client.request("POST", "/rate", {"dest_id": dest_id, "rating": 2}, token))[0] == 200
+        assert app.RATING_INDEX.average(dest_id) == 2
+        assert dict(app.USERS["amy"]["ratings"]) == {dest_id: 2}
+        status, body = await client.request("POST", "/login", {"username": "amy", "password": "pw"})
+        assert status == 200 and body["has_preferences"]
+
+    run(scenario)
+
+
+@pytest.mark.parametrize("length", ["abc", "-5", "1e3"])
+def test_bad_content_length_is_rejected(run, length):
+    async def scenario(client, service):
+        status, body = await client.send(
+            f"POST /login HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode())
+        assert status == 400
+        assert "Content-Length" in body["error"]
+
+    run(scenario)
+
+
+def test_unexpected_handler_error_is_a_500(run):
+    async def scenario(client, service):
+        async def broken(data, query, headers):
+            raise KeyError("preferences")
+
+        service._routes[("POST", "/rate")] = broken
+        assert await client.request("POST", "/rate", {}) == (500, {"error": "internal server error"})
+        # The service keeps answering afterwards.
+        status, _ = await client.request("POST", "/login", {"username": "nobody", "password": "pw"})
+        assert status == 401
+
+    run(scenario)
+
+
+def test_session_and_input_errors(run):
+    async def scenario(client, service):
+        assert (await client.request("GET", "/recommendations"))[0] == 401
+        token = await client.user("amy")
+        assert (await client.request("POST", "/register", {"username": "amy", "password": "x"}))[0] == 409
+        assert (await client.request("GET", "/recommendations/next", token=token))[0] == 409
+        assert (await client.request("GET", "/recommendations?k=0", token=token))[0] == 400
+        assert (await client.request("GET", "/nowhere"))[0] == 404
+        assert (await client.request("DELETE", "/rate"))[0] == 405
+        status, body = await client.request("POST", "/rate", [1], token)
+        assert (status, body["error"]) == (400, "body must be a JSON object")
+        status, _ = await client.request("POST", "/rate", {"dest_id": "d1", "rating": 5}, token)
+        assert status == 400  # not among the session's recommendations
+        status, _ = await client.request("PUT", "/preferences", {"preferences": {"trip_type": 1}}, token)
+        assert status == 400
+
+    run(scenario)
+
+
+def test_metrics_and_profiled_recommendations(run):
+    async def scenario(client, service):
+        token = await client.user("amy")
+        status, body = await client.request("GET", "/recommendations?profile=1", token=token)
+        assert status == 200
+        assert body["recommendations"] == app.recommend(PREFS, {}, 3)
+        assert set(body["profile"]) == {"samples", "top", "collapsed"}
+        status, body = await client.request("GET", "/metrics.json")
+        assert status == 200
+        assert body["counters"]["recommendations_returned"] >= 3
+        assert body["stages"]["recommend"]["count"] >= 1
+
+    run(scenario)
+
+
+def test_group_recommendations_need_an_invite(run):
+    async def scenario(client, service):
+        amy, bob = await client.user("amy"), await client.user("bob")
+        await client.user("cat")
+        status, body = await client.request("POST", "/group/invite", token=bob)
+        assert status == 201
+        invite = body["invite"]
+        status, body = await client.request("POST", "/group/recommendations",
+                                            {"invites": [invite], "strategy": "least_misery", "k": 2}, amy)
+        assert status == 200 and body["strategy"] == "least_misery"
+        expected = app.group_recommendations(["amy", "bob"], "least_misery", 2)
+        for rec, exp in zip(body["recommendations"], expected):
+            assert rec["your_score"] == exp.pop("member_scores")["amy"]
+            assert "member_scores" not in rec and rec == dict(exp, your_score=rec["your_score"])
+        # A username is not an invite, and every bad invite gets the same answer.
+        for invites in (["cat"], [invite, "nope"]):
+            status, body = await client.request("POST", "/group/recommendations", {"invites": invites}, amy)
+            assert status == 404 and body["error"] == "unknown or expired invite"
+        status, body = await client.request("POST", "/group/recommendations", {"invites": "bob"}, amy)
+        assert status == 400
+        status, body = await client.request("POST", "/group/recommendations",
+                                            {"invites": [invite], "strategy": "loudest"}, amy)
+        assert status == 400
+
+    run(scenario)
+
+
+def test_itinerary_fits_the_budget(run):
+    async def scenario(client, service):
+        token = await client.user("amy")
+        status, body = await client.request("GET", "/itinerary?stops=3&budget=900&distinct_regions=1", token=token)
+        assert status == 200
+        assert body == app.plan_itinerary(PREFS, {}, 3, True, 900.0)
+        assert 0 < len(body["stops"]) <= 3 and body["total_price"] <= 900 and body["exact"]
+        assert len({stop["region"] for stop in body["stops"]}) == len(body["stops"])
+        status, body = await client.request("GET", "/itinerary?stops=11", token=token)
+        assert status == 400 and body["error"] == "stops must be between 1 and 10"
+        assert (await client.request("GET", "/itinerary?budget=lots", token=token))[0] == 400
+        _, body = await client.request("POST", "/register", {"username": "bob", "password": "pw"})
+        assert (await client.request("GET", "/itinerary", token=body["token"]))[0] == 409
+
+    run(scenario)
+
+
+def test_facet_counts(run, monkeypatch):
+    monkeypatch.setattr(app, "FACET_INDEX", None)
+
+    async def scenario(client, service):
+        token = await client.user("amy")
+        status, body = await client.request("GET", "/facets?type=beach&budget=low&budget=medium", token=token)
+        assert status == 200
+        assert body == app.facet_counts({"type": ["beach"], "budget": ["low", "medium"]})
+        assert body["facets"]["type"]["beach"] == body["total"] > 0
+        status, body = await client.request("GET", "/facets?budget=cheap", token=token)
+        assert status == 400 and body["error"] == "unknown facet values: budget=cheap"
+
+    run(scenario)
+
+
+def test_nearby_and_near_recommendations(run, monkeypatch):
+    monkeypatch.setattr(app, "GEO_INDEX", None)
+
+    async def scenario(client, service):
+        token = await client.user("amy")
+        status, body = await client.request("GET", "/nearby?near=d1&k=3", token=token)
+        assert status == 200 and body["destinations"] == app.nearby_destinations({"dest_id": "d1"}, 3)
+        distances = [dest["distance_km"] for dest in body["destinations"]]
+        assert len(distances) == 3 and distances == sorted(distances)
+        assert "d1" not in {dest["id"] for dest in body["destinations"]}
+        status, body = await client.request("GET", "/recommendations?near=d1&radius_km=5000&k=20", token=token)
+        assert status == 200 and body["recommendations"]
+        for rec in body["recommendations"]:
+            assert rec["id"] != "d1" and 0 <= rec["distance_km"] <= 5000
+        near = app.resolve_near({"dest_id": "d1", "radius_km": 5000})
+        assert body["recommendations"] == app.recommend(PREFS, {}, 20, near)
+        assert (await client.request("GET", "/nearby?near=nope", token=token))[0] == 404
+        status, body = await client.request("GET", "/recommendations?near=nope&radius_km=100", token=token)
+        assert (status, body["error"]) == (404, "unknown near destination")
+        status, body = await client.request("GET", "/recommendations?lat=10&lon=20", token=token)
+        assert status == 400 and body["error"] == "radius_km is required"
+        for query in ("/nearby?lat=nan&lon=0", "/nearby?lat=0&lon=inf", "/nearby?lat=0&lon=0&radius_km=-inf",
+                      "/recommendations?lat=-Infinity&lon=0&radius_km=100"):
+            status, body = await client.request("GET", query, token=token)
+            assert status == 400 and body["error"] == "lat, lon and radius_km must be finite numbers"
+        assert (await client.request("GET", "/nearby?lat=north&lon=0", token=token))[0] == 400
+
+    run(scenario)
+
+
+def test_similar_and_tag_search(run, monkeypatch):
+    monkeypatch.setattr(app, "TAG_INDEX", None)
+
+    async def scenario(client, service):
+        token = await client.user("amy")
+        status, body = await client.request("GET", "/similar?dest_id=d1&k=3", token=token)
+        assert status == 200
+        assert body["destinations"] == app.similar_destinations("d1", 3)
+        assert len(body["destinations"]) == 3 and "d1" not in {dest["id"] for dest in body["destinations"]}
+        status, body = await client.request("POST", "/search", {"tags": {"Beach": 1.0}, "k": 2}, token)
+        assert status == 200 and body["destinations"] == app.search_by_tags({"beach": 1.0}, 2)
+        assert len(body["destinations"]) == 2 and all("beach" in dest["tags"] for dest in body["destinations"])
+        assert (await client.request("GET", "/similar?dest_id=nope", token=token))[0] == 404
+        status, body = await client.request("POST", "/search", {"tags": {"beach": -1}}, token)
+        assert status == 400 and body["error"] == "tag weights must be non-negative numbers"
+        assert (await client.request("POST", "/search", {"tags": {"beach": 1}, "k": 0}, token))[0] == 400
+
+    run(scenario)
+
+
+def test_leaderboards_follow_ratings(run, monkeypatch):
+    monkeypatch.setattr(app, "LEADERBOARDS", Leaderboards(app._leaderboard_boards))
+
+    async def scenario(client, service):
+        tokens = [await client.user("amy"), await client.user("bob")]
+        picks = []
+        for token, stars in zip(tokens, ([5, 3], [4])):
+            _, body = await client.request("GET", "/recommendations?k=2", token=token)
+            picks = [rec["id"] for rec in body["recommendations"]]
+            for dest_id, rating in zip(picks, stars):
+                status, _ = await client.request("POST", "/rate", {"dest_id": dest_id, "rating": rating}, token)
+                assert status == 200
+        status, body = await client.request("GET", "/leaderboards?k=5", token=tokens[0])
+        assert status == 200 and body == {"kind": "top_rated", "destinations": app.top_destinations(n=5)}
+        top = body["destinations"][0]
+        assert (top["id"], top["average_rating"], top["ratings"]) == (picks[0], 4.5, 2)
+        status, body = await client.request("GET", f"/leaderboards?kind=trending&type={top['type']}", token=tokens[1])
+        assert status == 200 and body["destinations"][0]["id"] == top["id"]
+        assert all(dest["type"] == top["type"] and dest["popularity"] > 0 for dest in body["destinations"])
+        status, body = await client.request("GET", "/leaderboards?kind=newest", token=tokens[1])
+        assert status == 400 and body["error"] == "kind must be one of top_rated, trending"
+        assert (await client.request("GET", "/leaderboards"))[0] == 401
+
+    run(scenario)
+
+
+def test_sessions_expire_and_log_out(run):
+    async def scenario(client, service):
+        now = [0.0]
+        service.sessions = SessionTable(60, clock=lambda: now[0])
+        token = await client.user("amy")
+        now[0] = 59
+        assert (await client.request("GET", "/recommendations", token=token))[0] == 200
+        now[0] = 110  # renewed until 119 by the request at 59
+        assert (await client.request("GET", "/recommendations", token=token))[0] == 200
+        now[0] = 171  # renewed until 170 by the request at 110
+        status, body = await client.request("GET", "/recommendations", token=token)
+        assert (status, body["error"]) == (401, "missing, unknown or expired session token")
+
+        _, body = await client.request("POST", "/login", {"username": "amy", "password": "pw"})
+        token = body["token"]
+        assert (await client.request("POST", "/logout", token=token))[0] == 200
+        assert (await client.request("GET", "/recommendations", token=token))[0] == 401
+        assert (await client.request("POST", "/logout", token=token))[0] == 401
+
+    run(scenario)
+
+
+def test_logins_beyond_the_verifier_queue_get_a_503(run):
+    async def scenario(client, service):
+        await client.user("amy")
+        started, release = threading.Event(), threading.Event()
+
+        def slow_hash(password):
+            started.set()
+            release.wait(5)
+            return app.hash_password(password)
+
+        service.passwords = PasswordVerifier(slow_hash, max_workers=1, max_pending=1)
+        try:
+            first = asyncio.ensure_future(client.request("POST", "/login", {"username": "amy", "password": "pw"}))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            status, body = await client.request("POST", "/login", {"username": "amy", "password": "pw"})
+            assert status == 503 and "retry" in body["error"]
+            release.set()
+            assert (await first)[0] == 200
+        finally:
+            release.set()
+            service.passwords.close()
+
+    run(scenario)
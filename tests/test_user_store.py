@@ -0,0 +1,302 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import smart_travel_app as app
+from user_store import JournaledUserStore, SQLiteUserStore, rating_events, rating_totals
+
+
+def snapshot_of(store):
+    return {username: {"password": record["password"], "preferences": record["preferences"],
+                       "ratings": dict(record["ratings"])}
+            for username, record in store.items()}
+
+
+def fill(store):
+    store.register("amy", "h1")
+    store.register("bob", "h2")
+    store.set_preferences("amy", {"trip_type": "beach"})
+    store.rate("amy", "d1", 4)
+    store.rate("bob", "d1", 2)
+    store.rate("amy", "d1", 5)
+
+
+def test_journal_replays_after_reopen(tmp_path):
+    path = str(tmp_path / "users.json")
+    store = JournaledUserStore(path)
+    fill(store)
+    expected = snapshot_of(store)
+    store.close()
+
+    assert not os.path.exists(path)
+    assert snapshot_of(JournaledUserStore(path)) == expected
+
+
+def test_rate_returns_previous_rating(tmp_path):
+    store = JournaledUserStore(str(tmp_path / "users.json"))
+    store.register("amy", "h")
+    assert store.rate("amy", "d1", 4) is None
+    assert store.rate("amy", "d1", 2) == 4
+
+
+def test_compaction_folds_journal_into_snapshot(tmp_path):
+    path = str(tmp_path / "users.json")
+    store = JournaledUserStore(path, compact_every=4)
+    fill(store)
+    expected = snapshot_of(store)
+    store.close()
+
+    with open(path) as f:
+        assert set(json.load(f)) == {"amy", "bob"}
+    with open(str(tmp_path / "users.journal")) as f:
+        assert len(f.readlines()) == 2  # written after the compaction at the fourth entry
+    assert snapshot_of(JournaledUserStore(path)) == expected
+
+
+def test_concurrent_writers_are_all_durable(tmp_path):
+    path = str(tmp_path / "users.json")
+    store = JournaledUserStore(path, compact_every=150)
+    for u in range(8):
+        store.register(f"user{u}", "h")
+
+    def rate_many(username):
+        for i in range(60):
+            store.rate(username, f"d{i}", i % 5 + 1)
+
+    threads = [threading.Thread(target=rate_many, args=(f"user{u}",)) for u in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expected = snapshot_of(store)
+    store.close()
+    assert snapshot_of(JournaledUserStore(path)) == expected
+    assert all(len(record["ratings"]) == 60 for record in expected.values())
+
+
+
+def test_journal_replayed_over_its_own_snapshot(tmp_path):
+    path = str(tmp_path / "users.json")
+    journal = str(tmp_path / "users.journal")
+    store = JournaledUserStore(path)
+    store.register("old", "h0")
+    store.rate("old", "d9", 3)
+    store.compact()
+    fill(store)
+    with open(journal, "rb") as f:
+        entries = f.read()
+    # Crash after the snapshot is replaced but before the journal is emptied.
+    store.compact()
+    expected = snapshot_of(store)
+    store.close()
+    with open(journal, "wb") as f:
+        f.write(entries)
+
+    store = JournaledUserStore(path)
+    assert snapshot_of(store) == expected
+    assert sorted(store.ratings.usernames) == ["amy", "bob", "old"]
+    assert rating_totals(store) == {"d1": (7, 2), "d9": (3, 1)}
+
+def test_torn_tail_is_dropped(tmp_path):
+    path = str(tmp_path / "users.json")
+    store = JournaledUserStore(path)
+    fill(store)
+    expected = snapshot_of(store)
+    store.close()
+    journal = str(tmp_path / "users.journal")
+    size = os.path.getsize(journal)
+    with open(journal, "ab") as f:
+        f.write(b'{"op":"rate","user":"amy","dest":"d2","rat')
+
+    assert snapshot_of(JournaledUserStore(path)) == expected
+    assert os.path.getsize(journal) == size
+
+
+def test_corrupt_entry_stops_replay(tmp_path, capsys):
+    path = str(tmp_path / "users.json")
+    with open(str(tmp_path / "users.journal"), "w") as f:
+        f.write('{"op":"register","user":"amy","password":"h"}\n')
+        f.write('not json\n')
+        f.write('{"op":"register","user":"bob","password":"h"}\n')
+
+    store = JournaledUserStore(path)
+    assert list(store) == ["amy"]
+    assert "Corrupted journal entry" in capsys.readouterr().out
+
+
+def test_corrupt_snapshot_skips_entries_of_lost_users(tmp_path, capsys):
+    path = str(tmp_path / "users.json")
+    with open(path, "w") as f:
+        f.write('{"amy": {"password": ')
+    with open(str(tmp_path / "users.journal"), "w") as f:
+        for entry in [{"op": "rate", "user": "amy", "dest": "d1", "rating": 4},
+                      {"op": "preferences", "user": "amy", "preferences": {}},
+                      {"op": "register", "user": "bob", "password": "h"},
+                      {"op": "rate", "user": "bob", "dest": "d2", "rating": 3}]:
+            f.write(json.dumps(entry) + "\n")
+
+    store = JournaledUserStore(path)
+    assert list(store) == ["bob"]
+    assert dict(store["bob"]["ratings"]) == {"d2": 3}
+    assert os.path.exists(path + ".corrupt")
+    out = capsys.readouterr().out
+    assert "Corrupted user file" in out and "Skipped 2 journal entries" in out
+
+
+LEGACY = {"frf": {"password": "h", "prefs": {"trip_type": "beech", "budget": "hi"}, "ratings": {"d1": 4}}}
+
+
+def test_legacy_records_are_normalized(tmp_path):
+    path = str(tmp_path / "users.json")
+    with open(path, "w") as f:
+        json.dump(LEGACY, f)
+
+    store = JournaledUserStore(path, normalize=app.normalize_user)
+    prefs = store["frf"]["preferences"]
+    assert prefs["trip_type"] == "beach"
+    assert prefs["budget"]["price_range"] == list(app.BUDGET_RANGES[2])
+    assert prefs["travel_season"] == "summer"
+    assert dict(store["frf"]["ratings"]) == {"d1": 4}
+    assert app.normalize_user(store["frf"]) is store["frf"]
+
+
+def test_sqlite_import_matches_the_json_store(tmp_path):
+    path = str(tmp_path / "users.json")
+    json_store = JournaledUserStore(path, compact_every=3)
+    fill(json_store)
+    json_store.register("cat", "h3")
+    json_store.compact()
+    expected = snapshot_of(json_store)
+    json_store.close()
+    with open(path) as f:
+        users = dict(json.load(f), **LEGACY)
+    with open(path, "w") as f:
+        json.dump(users, f)
+
+    store = SQLiteUserStore(str(tmp_path / "users.db"))
+    assert not store.imported(path)
+    assert store.import_json(path, app.normalize_user, batch_size=2) == 4
+    assert store.imported(path)
+    assert snapshot_of(store) == dict(expected, frf=app.normalize_user(LEGACY["frf"]))
+    assert rating_totals(store) == {"d1": (11, 3)}
+    assert sorted(store.iter_ratings()) == [("amy", "d1", 5), ("bob", "d1", 2), ("frf", "d1", 4)]
+    store.close()
+
+
+def test_sqlite_store_writes_through_its_cache(tmp_path):
+    store = SQLiteUserStore(str(tmp_path / "users.db"), cache_size=2)
+    fill(store)
+    store.register("cat", "h3")
+    with pytest.raises(KeyError):
+        store.register("amy", "again")
+    with pytest.raises(KeyError):
+        store.rate("nobody", "d1", 3)
+    assert "nobody" not in store and "cat" in store
+    assert len(store) == 3 and list(store) == ["amy", "bob", "cat"]
+
+    amy = store["amy"]
+    assert store["amy"] is amy  # cached
+    assert store.rate("amy", "d2", 3) is None
+    store.set_preferences("amy", {"trip_type": "city"})
+    assert amy["ratings"] == {"d1": 5, "d2": 3} and amy["preferences"] == {"trip_type": "city"}
+    store["bob"], store["cat"]
+    assert len(store._cache) == 2 and "amy" not in store._cache
+    assert snapshot_of(store) == snapshot_of(SQLiteUserStore(store.path))
+
+
+def test_sqlite_connections_are_per_thread(tmp_path):
+    store = SQLiteUserStore(str(tmp_path / "users.db"))
+    store.register("amy", "h")
+    main_db = store._connection()
+    assert store._connection() is main_db
+    seen = []
+
+    def worker():
+        seen.append(store._connection())
+        for i in range(20):
+            store.rate("amy", f"d{i}", i % 5 + 1)
+        store.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(db) for db in seen + [main_db]}) == 5
+    assert len(store["amy"]["ratings"]) == 20
+    assert store._connection() is main_db
+
+
+def test_sqlite_store_imports_pending_journal_on_first_open(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, "USERS_DB_PATH", str(tmp_path / "users.db"))
+    json_store = JournaledUserStore("users.json", "users.journal")
+    fill(json_store)
+    expected = snapshot_of(json_store)
+    json_store._journal.close()  # leave the entries in the journal
+    json_store._journal = None
+
+    store = app.open_user_store()
+    assert isinstance(store, SQLiteUserStore)
+    assert snapshot_of(store) == expected
+    assert os.path.getsize("users.journal") == 0
+    store.close()
+
+
+def events_of(store):
+    dest_ids, items, stars, times = rating_events(store)
+    return sorted((dest_ids[item], int(rating), int(seconds)) for item, rating, seconds in zip(items, stars, times))
+
+
+def test_rating_times_survive_replay_compaction_and_import(tmp_path):
+    path = str(tmp_path / "users.json")
+    store = JournaledUserStore(path)
+    store.register("amy", "h1")
+    store.register("bob", "h2")
+    store.rate("amy", "d1", 4, ts=1000)
+    store.rate("bob", "d1", 2, ts=2000)
+    store.rate("amy", "d1", 5, ts=3000)
+    before = int(time.time())
+    store.rate("amy", "d2", 3)
+    assert store["amy"]["rated_at"]["d1"] == 3000
+    assert before <= store["amy"]["rated_at"]["d2"] <= time.time()
+    expected = [("d1", 2, 2000), ("d1", 5, 3000), ("d2", 3, store["amy"]["rated_at"]["d2"])]
+    assert events_of(store) == expected
+    store.close()
+
+    reopened = JournaledUserStore(path)  # replays the journal
+    assert events_of(reopened) == expected
+    reopened.compact()
+    reopened.close()
+    reopened = JournaledUserStore(path)  # reads the snapshot
+    assert events_of(reopened) == expected
+    assert dict(reopened["bob"]["rated_at"]) == {"d1": 2000}
+    reopened.close()
+
+    sqlite_store = SQLiteUserStore(str(tmp_path / "users.db"))
+    sqlite_store.import_json(path)
+    assert events_of(sqlite_store) == expected
+    sqlite_store.close()
+
+
+def test_sqlite_store_adds_the_rating_time_column(tmp_path):
+    path = str(tmp_path / "users.db")
+    with sqlite3.connect(path) as db:
+        db.executescript("""
+            CREATE TABLE users (username TEXT PRIMARY KEY, password TEXT NOT NULL, preferences TEXT) WITHOUT ROWID;
+            CREATE TABLE ratings (username TEXT NOT NULL, dest_id TEXT NOT NULL, rating INTEGER NOT NULL,
+                                  PRIMARY KEY (username, dest_id)) WITHOUT ROWID;
+            INSERT INTO users VALUES ('amy', 'h', NULL);
+            INSERT INTO ratings VALUES ('amy', 'd1', 4);
+        """)
+    db.close()
+
+    store = SQLiteUserStore(path)
+    assert events_of(store) == [("d1", 4, 0)]  # the time of an old rating is unknown
+    assert store.rate("amy", "d2", 5, ts=1234) is None
+    assert events_of(store) == [("d1", 4, 0), ("d2", 5, 1234)]
+    store.close()
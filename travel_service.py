@@ -0,0 +1,508 @@
+"""Local HTTP/JSON recommendation service built on asyncio.
+
+Endpoints (JSON bodies, session token in ``Authorization: Bearer <token>``):
+
+    POST /register               {"username": ..., "password": ...} -> {"token": ...}
+    POST /login                  {"username": ..., "password": ...} -> {"token": ...}
+    POST /logout                 ends the session
+    PUT  /preferences            {"preferences": {...}}
+    GET  /recommendations?k=3    first page of a fresh query (add &profile=1 for a sampled profile;
+                                 &lat=..&lon=..&radius_km=.. or &near=d1&radius_km=.. to search nearby)
+    GET  /recommendations/next   next page of the session's last query
+    POST /rate                   {"dest_id": ..., "rating": 1-5}
+    POST /group/invite           -> {"invite": ...}, a code others can use to plan a trip with you
+    POST /group/recommendations  {"invites": [...], "strategy": "average", "k": 3} -> picks for you and the
+                                 members who gave you those invites
+    GET  /itinerary?stops=3      best multi-stop trip within the budget (&distinct_regions=1, &budget=...)
+    GET  /facets?type=beach&...  destination counts per facet value under a partial selection
+    GET  /similar?dest_id=d1&k=5 destinations with the most similar tags
+    POST /search                 {"tags": {"beach": 1.0, ...}, "k": 5} -> nearest destinations by tag
+    GET  /nearby?lat=..&lon=..   nearest destinations (or &near=d1; &radius_km=.. to cap the distance, &k=5)
+    GET  /leaderboards?kind=trending&region=europe&k=10
+                                 top_rated or trending destinations (&type=, &region=, &budget= narrow it)
+    GET  /metrics                counters and stage timers, Prometheus text format
+    GET  /metrics.json           the same as JSON
+
+Every session keeps its own user and result cursor, so one process serves
+many users at once. Group picks only include users who handed out an
+invite (valid for ``--session-ttl`` seconds too), and show each member only
+their own score. Sessions expire after ``--session-ttl`` seconds without
+use. Passwords are hashed and checked on a small pool of worker threads,
+and writes go through the journaled user store on worker threads, where
+concurrent writes share an fsync, so neither blocks the event loop.
+
+When ``TRAVEL_CATALOG`` names a catalog source or compiled catalog file,
+the service checks it every ``--reload-interval`` seconds and applies
+changes without a restart.
+
+Usage:
+    python travel_service.py --port 8080
+    TRAVEL_CATALOG=destinations.jsonl python travel_service.py --reload-interval 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import catalog_source
+import smart_travel_app as app
+from metrics import METRICS, SamplingProfiler
+from sessions import SessionTable, VerifierBusy
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+
+log = logging.getLogger("travel_service")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Session:
+    def __init__(self, username):
+        self.username = username
+        self.cursor = None
+        self.last_recommendations = []
+
+
+class TravelService:
+    def __init__(self, users=None, session_ttl=1800.0, passwords=None):
+        self.users = users if users is not None else app.USERS
+        self.sessions = SessionTable(session_ttl)
+        self.invites = SessionTable(session_ttl)  # invite -> username
+        self.passwords = passwords or app.PASSWORDS
+        self._routes = {
+            ("POST", "/register"): self.register,
+            ("POST", "/login"): self.login,
+            ("POST", "/logout"): self.logout,
+            ("PUT", "/preferences"): self.preferences,
+            ("POST", "/preferences"): self.preferences,
+            ("GET", "/recommendations"): self.recommendations,
+            ("GET", "/recommendations/next"): self.next_recommendations,
+            ("POST", "/rate"): self.rate,
+            ("POST", "/group/invite"): self.group_invite,
+            ("POST", "/group/recommendations"): self.group_recommendations,
+            ("GET", "/itinerary"): self.itinerary,
+            ("GET", "/facets"): self.facets,
+            ("GET", "/similar"): self.similar,
+            ("POST", "/search"): self.search,
+            ("GET", "/nearby"): self.nearby,
+            ("GET", "/leaderboards"): self.leaderboards,
+            ("GET", "/metrics"): self.metrics,
+            ("GET", "/metrics.json"): self.metrics_json,
+        }
+
+    # ---- request handling ----
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    await self._respond(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    status, payload = await self._dispatch(method, path, query, headers, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except Exception:
+                    # A bug in one handler must not drop the connection without an answer.
+                    log.exception("unhandled error in %s %s", method, path)
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal server error"}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = headers.get("content-length", "0") or "0"
+        if not (length.isascii() and length.isdigit()):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Content-Length must be a non-negative integer")
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "body too large")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), headers, body
+
+    async def _dispatch(self, method, path, query, headers, body):
+        handler = self._routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self._routes):
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "method not allowed")
+            raise HTTPError(HTTPStatus.NOT_FOUND, "not found")
+        try:
+            data = json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "body must be a JSON object")
+        return await handler(data=data, query=query, headers=headers)
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        status = HTTPStatus(status)
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    # ---- helpers ----
+
+    @staticmethod
+    def _token(headers):
+        auth = headers.get("authorization", "")
+        return auth[7:] if auth.startswith("Bearer ") else ""
+
+    def _session(self, headers):
+        session = self.sessions.get(self._token(headers))
+        if session is None:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "missing, unknown or expired session token")
+        return session
+
+    async def _user(self, username):
+        """The record of ``username``, or None.
+
+        The first lookup opens the user store and a SQLite store reads the
+        disk, so lookups run off the loop.
+        """
+        return await self._run_blocking(self.users.get, username)
+
+    async def _session_user(self, headers):
+        session = self._session(headers)
+        user = await self._user(session.username)
+        if user is None:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "missing, unknown or expired session token")
+        return session, user
+
+    def _new_session(self, username):
+        return self.sessions.issue(Session(username))
+
+    async def _password_check(self, future_factory, *args):
+        try:
+            future = future_factory(*args)
+        except VerifierBusy:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "too many logins in progress, retry shortly")
+        return await asyncio.wrap_future(future)
+
+    @staticmethod
+    def _credentials(data):
+        username, password = data.get("username"), data.get("password")
+        if not isinstance(username, str) or not username.strip() or not isinstance(password, str):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "username and password are required")
+        return username.strip(), password.strip()
+
+    @staticmethod
+    def _page_size(query):
+        try:
+            k = int(query.get("k", ["3"])[0])
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "k must be an integer")
+        if not 1 <= k <= 100:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "k must be between 1 and 100")
+        return k
+
+    @staticmethod
+    def _near(query):
+        """The ``near`` query given by ``near``/``lat``/``lon``/``radius_km`` parameters, or None."""
+        if not any(name in query for name in ("near", "lat", "lon")):
+            return None
+        try:
+            near = {name: float(query[name][0]) for name in ("lat", "lon", "radius_km") if name in query}
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "lat, lon and radius_km must be numbers")
+        # float() accepts "nan" and "inf", which no point or radius can be.
+        if not all(math.isfinite(value) for value in near.values()):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "lat, lon and radius_km must be finite numbers")
+        if "near" in query:
+            near["dest_id"] = query["near"][0]
+        return near
+
+    @staticmethod
+    async def _run_blocking(func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    # ---- endpoints ----
+
+    async def register(self, data, query, headers):
+        username, password = self._credentials(data)
+        password_hash = await self._password_check(self.passwords.hash, password)
+        try:
+            await self._run_blocking(self.users.register, username, password_hash)
+        except KeyError:
+            raise HTTPError(HTTPStatus.CONFLICT, "username already exists")
+        return HTTPStatus.CREATED, {"token": self._new_session(username)}
+
+    async def login(self, data, query, headers):
+        username, password = self._credentials(data)
+        user = await self._user(username)
+        if not await self._password_check(self.passwords.submit, user["password"] if user else None, password):
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "invalid credentials")
+        return HTTPStatus.OK, {"token": self._new_session(username),
+                               "has_preferences": bool(user.get("preferences"))}
+
+    async def logout(self, data, query, headers):
+        if self.sessions.revoke(self._token(headers)) is None:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "missing, unknown or expired session token")
+        return HTTPStatus.OK, {"status": "logged out"}
+
+    async def preferences(self, data, query, headers):
+        session = self._session(headers)
+        prefs = data.get("preferences")
+        try:
+            app.validate_preferences(prefs)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        await self._run_blocking(self.users.set_preferences, session.username, prefs)
+        session.cursor = None
+        session.last_recommendations = []
+        return HTTPStatus.OK, {"status": "saved"}
+
+    async def recommendations(self, data, query, headers):
+        session, user = await self._session_user(headers)
+        k = self._page_size(query)
+        prefs = user["preferences"]
+        if not prefs:
+            raise HTTPError(HTTPStatus.CONFLICT, "set preferences first")
+        ratings = dict(user["ratings"])
+        near = self._near(query)
+        if near is not None:
+            try:
+                near = app.resolve_near(near, radius_required=True)
+            except KeyError:
+                raise HTTPError(HTTPStatus.NOT_FOUND, "unknown near destination")
+            except ValueError as e:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+        def first_page():
+            with METRICS.stage("recommend"):
+                cursor = app.recommendation_cursor(prefs, ratings, near)
+                return cursor, cursor.next_page(k)
+
+        def profiled_first_page():
+            # The profiler samples the thread that enters it, so it runs on the worker.
+            with SamplingProfiler() as profiler:
+                result = first_page()
+            return result, profiler
+
+        profiler = None
+        if query.get("profile", ["0"])[0] == "1":
+            (session.cursor, page), profiler = await self._run_blocking(profiled_first_page)
+        else:
+            session.cursor, page = await self._run_blocking(first_page)
+        session.last_recommendations = page
+        response = {"recommendations": page, "remaining": session.cursor.remaining}
+        if profiler is not None:
+            response["profile"] = {
+                "samples": sum(profiler.samples.values()),
+                "top": [{"function": frame, "self": own, "total": total} for frame, own, total in profiler.top()],
+                "collapsed": profiler.collapsed(),
+            }
+        return HTTPStatus.OK, response
+
+    async def next_recommendations(self, data, query, headers):
+        session = self._session(headers)
+        if session.cursor is None:
+            raise HTTPError(HTTPStatus.CONFLICT, "request recommendations first")
+        # Every page is a scoring pass over the candidates, so keep it off the loop.
+        page = await self._run_blocking(session.cursor.next_page, self._page_size(query))
+        session.last_recommendations.extend(page)
+        return HTTPStatus.OK, {"recommendations": page, "remaining": session.cursor.remaining}
+
+    async def rate(self, data, query, headers):
+        session = self._session(headers)
+        dest_id, rating = data.get("dest_id"), data.get("rating")
+        if not any(rec["id"] == dest_id for rec in session.last_recommendations):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "dest_id must be one of your recent recommendations")
+        if not isinstance(rating, int) or isinstance(rating, bool) or not 1 <= rating <= 5:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "rating must be an integer between 1 and 5")
+        rated_at = time.time()
+        previous = await self._run_blocking(self.users.rate, session.username, dest_id, rating, rated_at)
+        # Index updates are deltas against the stored previous value and
+        # apply_rating serializes them, so they can run off the loop thread.
+        await self._run_blocking(app.apply_rating, session.username, dest_id, rating, previous, rated_at)
+        return HTTPStatus.OK, {"status": "saved"}
+
+    async def group_invite(self, data, query, headers):
+        session = self._session(headers)
+        return HTTPStatus.CREATED, {"invite": self.invites.issue(session.username)}
+
+    async def group_recommendations(self, data, query, headers):
+        session = self._session(headers)
+        invites, strategy, k = data.get("invites", []), data.get("strategy", "average"), data.get("k", 3)
+        if not isinstance(invites, list) or not all(isinstance(i, str) for i in invites) or len(invites) > 50:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "invites must be a list of at most 50 invite codes")
+        if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= 100:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "k must be an integer between 1 and 100")
+        members = [self.invites.get(invite) for invite in invites]
+        # One error for every bad invite, so invites cannot be used to probe for usernames.
+        if None in members:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "unknown or expired invite")
+        try:
+            results = await self._run_blocking(app.group_recommendations, [session.username] + members,
+                                               strategy, k)
+        except KeyError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "unknown or expired invite")
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        # Members see the group's score and their own, never another member's.
+        for result in results:
+            result["your_score"] = result.pop("member_scores")[session.username]
+        return HTTPStatus.OK, {"recommendations": results, "strategy": strategy}
+
+    async def itinerary(self, data, query, headers):
+        _, user = await self._session_user(headers)
+        prefs = user["preferences"]
+        if not prefs:
+            raise HTTPError(HTTPStatus.CONFLICT, "set preferences first")
+        try:
+            max_stops = int(query.get("stops", ["3"])[0])
+            budget = query.get("budget", [None])[0]
+            budget = None if budget is None else float(budget)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "stops and budget must be numbers")
+        if not 1 <= max_stops <= 10:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "stops must be between 1 and 10")
+        if budget is not None and not 0 <= budget <= 1_000_000:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "budget must be between 0 and 1000000")
+        distinct_regions = query.get("distinct_regions", ["0"])[0] == "1"
+        plan = await self._run_blocking(app.plan_itinerary, prefs, dict(user["ratings"]), max_stops,
+                                        distinct_regions, budget)
+        return HTTPStatus.OK, plan
+
+    async def facets(self, data, query, headers):
+        self._session(headers)
+        # Repeated parameters select several values of one facet.
+        try:
+            # The first count builds the bitsets, so keep it off the loop.
+            return HTTPStatus.OK, await self._run_blocking(app.facet_counts, query)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+    async def similar(self, data, query, headers):
+        self._session(headers)
+        dest_id, k = query.get("dest_id", [None])[0], self._page_size(query)
+        try:
+            # The first similarity query builds the index, so keep it off the loop.
+            results = await self._run_blocking(app.similar_destinations, dest_id, k)
+        except KeyError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "unknown dest_id")
+        return HTTPStatus.OK, {"destinations": results}
+
+    async def search(self, data, query, headers):
+        self._session(headers)
+        k = data.get("k", 5)
+        if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= 100:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "k must be an integer between 1 and 100")
+        try:
+            results = await self._run_blocking(app.search_by_tags, data.get("tags"), k)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        return HTTPStatus.OK, {"destinations": results}
+
+    async def nearby(self, data, query, headers):
+        self._session(headers)
+        near, k = self._near(query), self._page_size(query)
+        if near is None:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "give lat and lon or near")
+        try:
+            # The first nearby query builds the index, so keep it off the loop.
+            results = await self._run_blocking(app.nearby_destinations, near, k)
+        except KeyError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "unknown near destination")
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        return HTTPStatus.OK, {"destinations": results}
+
+    async def leaderboards(self, data, query, headers):
+        self._session(headers)
+        kind, k = query.get("kind", ["top_rated"])[0], self._page_size(query)
+        trip_type, region, budget = (query.get(name, [None])[0] for name in ("type", "region", "budget"))
+        try:
+            # The first read may load the user store and wildcard reads merge many boards,
+            # so keep it off the loop like the other queries.
+            results = await self._run_blocking(app.top_destinations, kind, trip_type, region, budget, k)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        return HTTPStatus.OK, {"kind": kind, "destinations": results}
+
+    async def metrics(self, data, query, headers):
+        return HTTPStatus.OK, METRICS.prometheus()
+
+    async def metrics_json(self, data, query, headers):
+        return HTTPStatus.OK, METRICS.snapshot()
+
+
+async def serve(host="127.0.0.1", port=8080, service=None, reload_interval=2.0, session_ttl=1800.0):
+    service = service or TravelService(session_ttl=session_ttl)
+    # Load users up front rather than on the first request, which would stall the loop.
+    await asyncio.get_running_loop().run_in_executor(None, app.ensure_users)
+    stop_watcher = None
+    if app.CATALOG_PATH and reload_interval > 0:
+        stop_watcher = catalog_source.start_watcher(app.reload_catalog, reload_interval)
+    server = await asyncio.start_server(service.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+    try:
+        async with server:
+            print(f"Smart Travel Companion service listening on http://{host}:{port}")
+            await server.serve_forever()
+    finally:
+        if stop_watcher is not None:
+            stop_watcher.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the recommendation HTTP service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--reload-interval", type=float, default=2.0,
+                        help="seconds between catalog change checks (0 disables)")
+    parser.add_argument("--session-ttl", type=float, default=1800.0,
+                        help="seconds a session token stays valid without use")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, reload_interval=args.reload_interval,
+                          session_ttl=args.session_ttl))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+
+from rating_matrix import RatingMatrix, RatingTimes
+
+
+class JournaledUserStore(Mapping):
+    """User records kept in memory and persisted as snapshot + journal.
+
+    Every mutation (register, preferences, rate) is appended to a JSON-lines
+    journal instead of rewriting the whole users file. Callers that write at
+    the same time share a single fsync: whoever arrives first flushes all
+    pending lines while the others wait for it (group commit). Once the
+    journal holds ``compact_every`` entries it is folded into a new snapshot,
+    which is written to a temporary file and atomically renamed into place.
+
+    A crash between writing a snapshot and emptying the journal leaves
+    entries that the snapshot already reflects. Replaying them gives the
+    same state: preferences and ratings are plain assignments, and a
+    replayed registration starts the user's record over (keeping its row of
+    ratings, emptied) before that user's later entries are applied again.
+    Entries for users the snapshot lacks (because it was corrupt) are
+    skipped with a warning.
+
+    Ratings live in one ``RatingMatrix`` (``self.ratings``); each record's
+    ``"ratings"`` is a live view of the user's row in it, and ``"rated_at"``
+    one of the times those ratings were made (Unix seconds).
+
+    ``normalize`` is applied to every snapshot record as it is loaded (for
+    example to upgrade legacy records, as ``SQLiteUserStore.import_json``
+    does).
+    """
+
+    def __init__(self, snapshot_path="users.json", journal_path=None, compact_every=1000, normalize=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or os.path.splitext(snapshot_path)[0] + ".journal"
+        self.compact_every = compact_every
+        self.normalize = normalize
+
+        self._users = {}
+        self.ratings = RatingMatrix()
+        self._journal = None
+        self._journal_entries = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._pending = []
+        self._next_ticket = 1
+        self._durable = 0
+        self._flushing = False
+
+        self._load()
+
+    # ---- Mapping interface ----
+
+    def __getitem__(self, username):
+        return self._users[username]
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def __len__(self):
+        return len(self._users)
+
+    # ---- mutations ----
+
+    def register(self, username, password_hash):
+        def apply():
+            if username in self._users:
+                raise KeyError(f"User {username!r} already exists")
+            self._users[username] = self._new_record(username, password_hash)
+
+        self._commit({"op": "register", "user": username, "password": password_hash}, apply)
+
+    def set_preferences(self, username, preferences):
+        self._commit({"op": "preferences", "user": username, "preferences": preferences},
+                     lambda: self._users[username].__setitem__("preferences", preferences))
+
+    def rate(self, username, dest_id, rating, ts=None):
+        """Store a rating made at Unix time ``ts`` (default now); return the previous rating of ``dest_id``, if any."""
+        ts = time.time() if ts is None else ts
+        previous = []
+
+        def apply():
+            previous.append(self._users[username]["ratings"].rate(dest_id, rating, ts))
+
+        self._commit({"op": "rate", "user": username, "dest": dest_id, "rating": rating, "ts": int(ts)}, apply)
+        return previous[0]
+
+    def iter_ratings(self):
+        return self.ratings.iter_ratings()
+
+    def rating_totals(self):
+        return self.ratings.totals()
+
+    def rating_events(self):
+        return (self.ratings.dest_ids, *self.ratings.events())
+
+    # ---- persistence ----
+
+    def _new_record(self, username, password_hash):
+        ratings = self.ratings.add_user(username)
+        return {"password": password_hash, "preferences": None, "ratings": ratings,
+                "rated_at": RatingTimes(self.ratings, ratings.u)}
+
+    def _apply(self, entry):
+        op = entry["op"]
+        if op == "register":
+            user = self._users.get(entry["user"])
+            if user is None:
+                user = self._new_record(entry["user"], entry["password"])
+            else:
+                # The snapshot already has the user, so the crash came between
+                # writing it and emptying the journal. Start the record over on
+                # its existing matrix row; the user's later entries rebuild it.
+                ratings = user["ratings"]
+                for dest_id in list(ratings):
+                    del ratings[dest_id]
+                user = {"password": entry["password"], "preferences": None, "ratings": ratings,
+                        "rated_at": RatingTimes(self.ratings, ratings.u)}
+            self._users[entry["user"]] = user
+        elif op == "preferences":
+            self._users[entry["user"]]["preferences"] = entry["preferences"]
+        elif op == "rate":
+            self._users[entry["user"]]["ratings"].rate(entry["dest"], entry["rating"], entry.get("ts"))
+        else:
+            raise ValueError(f"Unknown journal operation: {op!r}")
+
+    def _load(self):
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, "r") as f:
+                    self._users = json.load(f)
+            except json.JSONDecodeError:
+                # Keep the damaged file around instead of overwriting it later.
+                os.replace(self.snapshot_path, self.snapshot_path + ".corrupt")
+                print(f"Warning: Corrupted user file moved to {self.snapshot_path}.corrupt. Starting fresh.")
+            if self.normalize is not None:
+                self._users = {username: self.normalize(record) for username, record in self._users.items()}
+            # Move every rating into the matrix and drop the per-user dicts.
+            self.ratings = RatingMatrix.from_ratings(
+                (username, record.get("ratings") or {}, record.get("rated_at"))
+                for username, record in self._users.items())
+            for record, ratings in zip(self._users.values(), self.ratings.rows()):
+                record["ratings"] = ratings
+                record["rated_at"] = RatingTimes(self.ratings, ratings.u)
+
+        if not os.path.exists(self.journal_path):
+            return
+        valid_bytes = skipped = 0
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write at the tail
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print("Warning: Corrupted journal entry. Ignoring the rest of the journal.")
+                    break
+                try:
+                    self._apply(entry)
+                except KeyError:
+                    # The user's register entry was folded into a snapshot that is now lost.
+                    skipped += 1
+                self._journal_entries += 1
+                valid_bytes += len(line)
+        if skipped:
+            print(f"Warning: Skipped {skipped} journal entries for users missing from the snapshot.")
+        if valid_bytes != os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(valid_bytes)
+
+    def _commit(self, entry, apply):
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+        with self._cond:
+            apply()
+            self._pending.append(line)
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while self._durable < ticket:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                # Become the leader: write every pending line with one fsync.
+                self._flushing = True
+                batch, self._pending = self._pending, []
+                upto = self._next_ticket - 1
+                self._cond.release()
+                try:
+                    self._write_batch(batch)
+                except BaseException:
+                    self._cond.acquire()
+                    self._pending[:0] = batch  # let the next leader retry them
+                    self._flushing = False
+                    self._cond.notify_all()
+                    raise
+                self._cond.acquire()
+                self._flushing = False
+                self._cond.notify_all()
+                self._durable = upto
+                self._journal_entries += len(batch)
+                if self._journal_entries >= self.compact_every:
+                    self._compact_locked()
+
+    def _write_batch(self, batch):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "ab")
+        self._journal.write(b"".join(batch))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _compact_locked(self):
+        # Anything still pending is already in memory, so it lands in the
+        # snapshot and is simply re-applied if its journal line follows.
+        data = json.dumps(self._users, indent=2, default=dict)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        with open(self.journal_path, "wb") as f:
+            os.fsync(f.fileno())
+        self._journal_entries = 0
+
+    def compact(self):
+        """Write a fresh snapshot and empty the journal."""
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            self._compact_locked()
+
+    def close(self):
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+def iter_ratings(users):
+    """``(username, dest_id, rating)`` for every rating in a user mapping."""
+    if isinstance(users, (JournaledUserStore, SQLiteUserStore)):
+        return users.iter_ratings()
+    return ((username, dest_id, rating)
+            for username, user in users.items() for dest_id, rating in user["ratings"].items())
+
+
+def rating_totals(users):
+    """``dest_id -> (total, count)`` over every rating in a user mapping."""
+    if isinstance(users, (JournaledUserStore, SQLiteUserStore)):
+        return users.rating_totals()
+    totals = {}
+    for _, dest_id, rating in iter_ratings(users):
+        total_count = totals.setdefault(dest_id, [0, 0])
+        total_count[0] += rating
+        total_count[1] += 1
+    return {dest_id: tuple(total_count) for dest_id, total_count in totals.items()}
+
+
+def _events(ratings):
+    dest_of = {}
+    items, stars, times = [], [], []
+    for dest_id, rating, seconds in ratings:
+        items.append(dest_of.setdefault(dest_id, len(dest_of)))
+        stars.append(rating)
+        times.append(seconds or 0)
+    return (list(dest_of), np.array(items, dtype=np.int64), np.array(stars, dtype=np.int64),
+            np.array(times, dtype=np.float64).astype(np.uint32))
+
+
+def rating_events(users):
+    """Every rating as ``(dest_ids, items, stars, times)``.
+
+    ``items`` indexes ``dest_ids``; ``times`` are Unix seconds, 0 where
+    the time of a rating is unknown (records without ``rated_at``).
+    """
+    if isinstance(users, (JournaledUserStore, SQLiteUserStore)):
+        return users.rating_events()
+    return _events((dest_id, rating, (user.get("rated_at") or {}).get(dest_id))
+                   for user in users.values() for dest_id, rating in user["ratings"].items())
+
+
+def iter_json_object(f, chunk_size=1 << 16):
+    """Yield the ``(key, value)`` pairs of the JSON object in file ``f`` one at a time.
+
+    Only one member is decoded at a time, so memory stays bounded by the
+    largest record rather than the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    def decode():
+        # A value is complete once a following non-space character is buffered.
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            rest = end
+            while rest < len(buffer) and buffer[rest].isspace():
+                rest += 1
+            if rest < len(buffer) or eof:
+                pos = end
+                return value
+            fill()
+
+    fill()
+    skip_space()
+    if buffer[pos:pos + 1] != "{":
+        raise ValueError("expected a JSON object")
+    pos += 1
+    skip_space()
+    if buffer[pos:pos + 1] == "}":
+        return
+    while True:
+        key = decode()
+        skip_space()
+        if buffer[pos:pos + 1] != ":":
+            raise ValueError("expected ':' after an object key")
+        pos += 1
+        skip_space()
+        yield key, decode()
+        skip_space()
+        separator = buffer[pos:pos + 1]
+        pos += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError("expected ',' or '}' in object")
+        skip_space()
+
+
+class SQLiteUserStore(Mapping):
+    """User records in a SQLite database, loaded one user at a time.
+
+    Lookups go through the ``users`` primary key and a user's ratings
+    through the ``(username, dest_id)`` key of ``ratings``, so nothing is
+    read up front. Up to ``cache_size`` recently used records stay in
+    memory; memory does not grow with the number of users. The database
+    runs in WAL mode, so readers in other threads and processes proceed
+    beside the single writer. Each thread gets its own connection.
+
+    Cached records are kept in step with writes made through this store;
+    writes from other processes show up once a record leaves the cache.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            preferences TEXT
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS ratings (
+            username TEXT NOT NULL,
+            dest_id TEXT NOT NULL,
+            rating INTEGER NOT NULL,
+            rated_at INTEGER,
+            PRIMARY KEY (username, dest_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS ratings_by_dest ON ratings (dest_id);
+        CREATE TABLE IF NOT EXISTS imports (
+            path TEXT PRIMARY KEY,
+            users INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path="users.db", cache_size=10000):
+        self.path = path
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._connection() as db:
+            db.executescript(self.SCHEMA)
+            # Databases created before rating times were kept lack the column.
+            if "rated_at" not in [column[1] for column in db.execute("PRAGMA table_info(ratings)")]:
+                db.execute("ALTER TABLE ratings ADD COLUMN rated_at INTEGER")
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # ---- Mapping interface ----
+
+    def __getitem__(self, username):
+        with self._lock:
+            user = self._cache.get(username)
+            if user is not None:
+                self._cache.move_to_end(username)
+                return user
+            writes = self._writes
+        db = self._connection()
+        row = db.execute("SELECT password, preferences FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            raise KeyError(username)
+        ratings = dict(db.execute("SELECT dest_id, rating FROM ratings WHERE username = ?", (username,)))
+        user = {"password": row[0], "preferences": json.loads(row[1]) if row[1] else None, "ratings": ratings}
+        with self._lock:
+            if self._writes != writes:
+                return user
+            # Another thread may have loaded the record meanwhile.
+            user = self._cache.setdefault(username, user)
+            self._cache.move_to_end(username)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    def __contains__(self, username):
+        with self._lock:
+            if username in self._cache:
+                return True
+        return self._connection().execute(
+            "SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+
+    def __iter__(self):
+        for (username,) in self._connection().execute("SELECT username FROM users ORDER BY username"):
+            yield username
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    # ---- mutations ----
+
+    def register(self, username, password_hash):
+        try:
+            with self._connection() as db:
+                db.execute("INSERT INTO users (username, password, preferences) VALUES (?, ?, NULL)",
+                           (username, password_hash))
+        except sqlite3.IntegrityError:
+            raise KeyError(f"User {username!r} already exists") from None
+
+    def _begin_write(self):
+        # Reads that overlap a write are not cached; the write patches cached records itself.
+        with self._lock:
+            self._writes += 1
+
+    def set_preferences(self, username, preferences):
+        self._begin_write()
+        with self._connection() as db:
+            updated = db.execute("UPDATE users SET preferences = ? WHERE username = ?",
+                                 (json.dumps(preferences), username)).rowcount
+        if not updated:
+            raise KeyError(username)
+        with self._lock:
+            if username in self._cache:
+                self._cache[username]["preferences"] = preferences
+
+    def rate(self, username, dest_id, rating, ts=None):
+        """Store a rating made at Unix time ``ts`` (default now); return the previous rating of ``dest_id``, if any."""
+        ts = time.time() if ts is None else ts
+        self._begin_write()
+        db = self._connection()
+        with db:
+            # Take the write lock first so the previous value cannot change under us.
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is None:
+                raise KeyError(username)
+            row = db.execute("SELECT rating FROM ratings WHERE username = ? AND dest_id = ?",
+                             (username, dest_id)).fetchone()
+            db.execute("INSERT OR REPLACE INTO ratings (username, dest_id, rating, rated_at) VALUES (?, ?, ?, ?)",
+                       (username, dest_id, rating, int(ts)))
+        with self._lock:
+            if username in self._cache:
+                self._cache[username]["ratings"][dest_id] = rating
+        return row[0] if row else None
+
+    # ---- aggregates ----
+
+    def iter_ratings(self):
+        return iter(self._connection().execute("SELECT username, dest_id, rating FROM ratings"))
+
+    def rating_totals(self):
+        return {dest_id: (total, count) for dest_id, total, count in self._connection().execute(
+            "SELECT dest_id, SUM(rating), COUNT(*) FROM ratings GROUP BY dest_id")}
+
+    def rating_events(self):
+        return _events((dest_id, rating, rated_at) for dest_id, rating, rated_at in self._connection().execute(
+            "SELECT dest_id, rating, rated_at FROM ratings"))
+
+    # ---- migration ----
+
+    def import_json(self, json_path, normalize=None, batch_size=1000):
+        """Copy the users of a users.json file into the store in one streaming pass.
+
+        ``normalize`` is applied to every record first (for example to
+        upgrade legacy records). Users that already exist are replaced.
+        The import is recorded, see ``imported``. Returns the number of users
+        imported.
+        """
+        db = self._connection()
+        count = 0
+        with open(json_path, "r") as f:
+            batch = []
+            for username, record in iter_json_object(f):
+                batch.append((username, normalize(record) if normalize else record))
+                if len(batch) >= batch_size:
+                    self._import_batch(db, batch)
+                    count += len(batch)
+                    batch = []
+            self._import_batch(db, batch)
+            count += len(batch)
+        with db:
+            db.execute("INSERT OR REPLACE INTO imports (path, users) VALUES (?, ?)",
+                       (os.path.abspath(json_path), count))
+        with self._lock:
+            self._cache.clear()
+        return count
+
+    def imported(self, json_path):
+        """True if ``import_json`` has completed for this file."""
+        return self._connection().execute("SELECT 1 FROM imports WHERE path = ?",
+                                          (os.path.abspath(json_path),)).fetchone() is not None
+
+    @staticmethod
+    def _import_batch(db, batch):
+        with db:
+            for username, record in batch:
+                preferences = record.get("preferences")
+                db.execute("INSERT OR REPLACE INTO users (username, password, preferences) VALUES (?, ?, ?)",
+                           (username, record["password"], json.dumps(preferences) if preferences else None))
+                db.execute("DELETE FROM ratings WHERE username = ?", (username,))
+                rated_at = record.get("rated_at") or {}
+                db.executemany("INSERT INTO ratings (username, dest_id, rating, rated_at) VALUES (?, ?, ?, ?)",
+                               [(username, dest_id, rating, rated_at.get(dest_id))
+                                for dest_id, rating in record["ratings"].items()])
+
+    # ---- housekeeping ----
+
+    def compact(self):
+        """Fold the write-ahead log back into the database file."""
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None